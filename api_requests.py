@@ -1,84 +1,351 @@
-import os, requests, datetime, random
+import os, re, json, time, datetime, random, asyncio, logging, threading, contextvars
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from typing import NamedTuple, Optional
+import numpy as np
 from dotenv import load_dotenv
+from tmdb_client import get_json
+from tmdb_async import get_json_async
+from tmdb_cache import make_cache, SingleFlight
+from background import PeriodicTask
 # from secret_keys import API_SECRET_KEY
 # from mysecrets import get_secret
 
-API_BASE_URL = 'https://api.themoviedb.org/3/'
+load_dotenv()
+
+API_BASE_URL = os.environ.get('TMDB_API_BASE_URL', 'https://api.themoviedb.org/3/')
 IMAGE_BASE_URL = 'https://image.tmdb.org/t/p/w500/'
 YOUTUBE_BASE_URL = 'https://www.youtube.com/embed/'
-load_dotenv()
 
 API_KEY = os.environ.get('API_KEY')
 
+# Upper bound on parallel TMDB fetches issued by one batch call
+MAX_CONCURRENCY = int(os.environ.get('TMDB_MAX_CONCURRENCY', 12))
+# Movies kept of a person's filmography: the cast page shows 5, cast search 12
+CAST_CREDITS = 12
+# Filmographies longer than this are ranked by numpy partial selection; a
+# plain sort is faster below it
+PARTIAL_SELECT_MIN = 400
+# Seconds a worker may hold the fill of a url while the other workers on the
+# machine wait for it to land in the shared (sqlite) cache; 0 turns it off
+CACHE_LEASE = float(os.environ.get('TMDB_CACHE_LEASE', 0))
+# Seconds between a waiting worker's looks at the shared cache
+LEASE_POLL = 0.05
+# Seconds between background refreshes of the trending list and genre list
+TRENDING_REFRESH_INTERVAL = int(os.environ.get('TRENDING_REFRESH_INTERVAL', 60 * 60))
+GENRE_REFRESH_INTERVAL = int(os.environ.get('GENRE_REFRESH_INTERVAL', 24 * 60 * 60))
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+# Response cache shared by every TMDB call (see tmdb_cache.make_cache)
+cache = make_cache()
+
+
+# Cache key of a url: the url without the api key
+def cache_key(url):
+    return re.sub(r'api_key=[^&]*&?', '', url)
+
+
+# Concurrent misses of one url in this worker share a single TMDB request
+flights = SingleFlight()
+
+
+# Get a TMDB payload from the cache, or from the API on a miss
+def cached_get_json(endpoint, url):
+    key = cache_key(url)
+
+    response = cache.get(endpoint, key)
+    if response is not None:
+        return response
+
+    flight, leader = flights.begin(key)
+    if leader:
+        return lead(endpoint, key, url, flight)
+
+    return json.loads(flight.result())
+
+
+# Same as cached_get_json, awaiting the API on a miss
+async def cached_get_json_async(endpoint, url):
+    key = cache_key(url)
+
+    response = cache.get(endpoint, key)
+    if response is not None:
+        return response
+
+    # Shielded: a caller that goes away must not cancel a fetch others wait on
+    flight, leader = flights.begin(key)
+    if leader:
+        return await asyncio.shield(asyncio.ensure_future(lead_async(endpoint, key, url, flight)))
+
+    return json.loads(await asyncio.shield(asyncio.wrap_future(flight)))
+
+
+# Fill a key for everyone waiting on its flight
+def lead(endpoint, key, url, flight):
+    try:
+        response = fill(endpoint, key, url)
+    except BaseException as exc:
+        flights.finish(key, flight, exc=exc)
+        raise
+
+    flights.finish(key, flight, response)
+    return response
+
+
+async def lead_async(endpoint, key, url, flight):
+    try:
+        response = await fill_async(endpoint, key, url)
+    except BaseException as exc:
+        flights.finish(key, flight, exc=exc)
+        raise
+
+    flights.finish(key, flight, response)
+    return response
+
+
+# Fetch a url into the cache. With CACHE_LEASE, a worker that finds another
+# one fetching the same url waits for its payload in the shared cache, and
+# fetches itself only if the lease is given up or runs out first.
+def fill(endpoint, key, url):
+    # A flight that just landed may have filled it since our miss
+    response = cache.peek(endpoint, key)
+    if response is not None:
+        return response
+
+    leased = CACHE_LEASE > 0 and cache.lease(endpoint, key, CACHE_LEASE)
+    if CACHE_LEASE > 0 and not leased:
+        deadline = time.monotonic() + CACHE_LEASE
+        while time.monotonic() < deadline and not leased:
+            time.sleep(LEASE_POLL)
+            response = cache.peek(endpoint, key)
+            if response is not None:
+                return response
+            leased = cache.lease(endpoint, key, CACHE_LEASE)
+
+    try:
+        response = get_json(url)
+        # TMDB error payloads carry success: false; never cache those
+        if response.get('success', True):
+            cache.set(endpoint, key, response)
+    finally:
+        if leased:
+            cache.release(endpoint, key)
+
+    return response
+
+
+async def fill_async(endpoint, key, url):
+    response = cache.peek(endpoint, key)
+    if response is not None:
+        return response
+
+    leased = CACHE_LEASE > 0 and cache.lease(endpoint, key, CACHE_LEASE)
+    if CACHE_LEASE > 0 and not leased:
+        deadline = time.monotonic() + CACHE_LEASE
+        while time.monotonic() < deadline and not leased:
+            await asyncio.sleep(LEASE_POLL)
+            response = cache.peek(endpoint, key)
+            if response is not None:
+                return response
+            leased = cache.lease(endpoint, key, CACHE_LEASE)
+
+    try:
+        response = await get_json_async(url)
+        if response.get('success', True):
+            cache.set(endpoint, key, response)
+    finally:
+        if leased:
+            cache.release(endpoint, key)
+
+    return response
+
+
+# Hit/miss counters of the response cache
+def cache_stats():
+    return cache.stats()
+
+# Url of a movie with everything the detail page needs appended
+def movie_url(id):
+    return (API_BASE_URL+'movie/{movie_id}?api_key={api_key}&append_to_response=videos,images,credits,watch/providers,reviews').format(api_key=API_KEY, movie_id=id)
+
+
+# Url of the base movie resource only
+def movie_base_url(id):
+    return (API_BASE_URL+'movie/{movie_id}?api_key={api_key}').format(api_key=API_KEY, movie_id=id)
+
+
+# Url of a person with their images and movie credits
+def cast_url(id):
+    return (API_BASE_URL+'person/{person_id}?api_key={api_key}&append_to_response=images,movie_credits').format(api_key=API_KEY, person_id=id)
+
+
+# Url of the most popular movies of a genre
+def genre_url(id):
+    return (API_BASE_URL+'discover/movie?api_key={api_key}&language=en-US&page=1&sort_by=popularity.desc&with_genres={genre_id}').format(api_key=API_KEY, genre_id=id)
+
+
 # Get suggested movies data from the API
 def get_movie(id):
-    url = (API_BASE_URL+'movie/{movie_id}%?api_key={api_key}&append_to_response=videos,images,credits,watch/providers,reviews').format(api_key=API_KEY, movie_id=id)
+    url = movie_url(id)
 
-    try:     
-        res = requests.get(url)
-    except:
-        raise ('not connected to internet or movidb issue')
-    
-    response = res.json()
+    response = cached_get_json('movie', url)
 
     return response
 
 
+async def get_movie_async(id):
+    return await cached_get_json_async('movie', movie_url(id))
+
+
+# Get only the base movie resource from the API, reusing a cached full payload
+def get_movie_base(id):
+    full = cache.peek('movie', cache_key(movie_url(id)))
+    if full is not None:
+        return full
+
+    response = cached_get_json('movie_summary', movie_base_url(id))
+
+    return response
+
+
+async def get_movie_base_async(id):
+    full = cache.peek('movie', cache_key(movie_url(id)))
+    if full is not None:
+        return full
+
+    return await cached_get_json_async('movie_summary', movie_base_url(id))
+
+
 
 # Get casts data from the API
 def get_cast(id):
-    url = (API_BASE_URL+'person/{person_id}%?api_key={api_key}&append_to_response=images,movie_credits').format(api_key=API_KEY, person_id=id)
-
-    try:     
-        res = requests.get(url)
-    except:
-        raise ('not connected to internet or movidb issue')
-    
-    response = res.json()
+    response = cached_get_json('person', cast_url(id))
 
     return response
 
 
+async def get_cast_async(id):
+    return await cached_get_json_async('person', cast_url(id))
+
+
 
 # Get movies data based on genre from the API
 def get_movie_by_genre(id):
-    url1 = (API_BASE_URL+'discover/movie?api_key={api_key}&language=en-US&page=1&sort_by=popularity.desc&with_genres={genre_id}').format(api_key=API_KEY, genre_id=id)
-    url2 = (API_BASE_URL+"genre/movie/list?api_key={api_key}&language=en").format(api_key=API_KEY)
-    
-    try:     
-        res1 = requests.get(url1)
-        res2 = requests.get(url2)
-    except:
-        raise ('not connected to internet or movidb issue')
-    
-    response = res1.json()
-    genres = res2.json()
+    response = cached_get_json('discover', genre_url(id))
+
+    return response
+
+
+async def get_movie_by_genre_async(id):
+    return await cached_get_json_async('discover', genre_url(id))
+
+
+# Get the list of movie genres from the API
+def get_genres():
+    url = (API_BASE_URL+"genre/movie/list?api_key={api_key}&language=en").format(api_key=API_KEY)
 
+    response = cached_get_json('genres', url)
 
-    return [response, genres]
+    return response
 
 
 # Get trending movies list from the API
 def get_trending_movies():
     url = (API_BASE_URL+"trending/movie/week?api_key={api_key}&language=en-US&page1").format(api_key=API_KEY)
    
-    try:     
-        res = requests.get(url)
-    except:
-        raise ('not connected to internet or movidb issue')
-    
-    response = res.json()
+    response = cached_get_json('trending', url)
 
     return response
 
 
 
 
+class TrendingSnapshot:
+    """ Last trending list fetched from TMDB, refreshed in the background.
+
+    Readers never wait on TMDB: until the first refresh lands they get an
+    empty list, afterwards the last successful fetch. """
+
+    def __init__(self, interval):
+        self.results = []
+        self.fetched_at = None
+        self.task = PeriodicTask('trending-refresh', interval, self.refresh)
+
+    def refresh(self):
+        resp = get_trending_movies()
+        if not resp.get('results'):
+            raise ValueError(f"no trending results: {resp.get('status_message')}")
+
+        self.results = resp['results']
+        self.fetched_at = time.time()
+
+    def get(self):
+        self.task.start()
+        return self.results
+
+
+trending_snapshot = TrendingSnapshot(TRENDING_REFRESH_INTERVAL)
+
+
+class GenreRegistry:
+    """ TMDB movie genres as an id -> name map, refreshed in the background.
+
+    The first lookups in a worker wait for the initial load, at most
+    LOAD_TIMEOUT seconds once; every lookup after that is a dict read. If
+    that load fails, lookups get None until a retry of the task lands. """
+
+    # Longest the first lookups wait for the initial load, in seconds
+    LOAD_TIMEOUT = 10
+
+    def __init__(self, interval):
+        self.names = {}
+        # Set once lookups stop waiting: after the first load attempt,
+        # failed or not, or once a wait for it timed out
+        self._settled = threading.Event()
+        self.task = PeriodicTask('genre-refresh', interval, self.refresh)
+
+    def refresh(self):
+        try:
+            resp = get_genres()
+            if not resp.get('genres'):
+                raise ValueError(f"no genres: {resp.get('status_message')}")
+
+            self.names = {genre['id']: genre['name'] for genre in resp['genres']}
+        finally:
+            self._settled.set()
+
+    def name(self, id):
+        self.task.start()
+        if not self._settled.is_set():
+            self._settled.wait(self.LOAD_TIMEOUT)
+            self._settled.set()
+
+        try:
+            return self.names.get(int(id))
+        except (TypeError, ValueError):
+            return None
+
+
+genre_registry = GenreRegistry(GENRE_REFRESH_INTERVAL)
+
+
+
 # Retrieve movie's detail
 def get_movie_detail(id):
-        resp = get_movie(id)
+    return movie_detail(id, get_movie(id))
+
+
+async def get_movie_detail_async(id):
+    return movie_detail(id, await get_movie_async(id))
 
-        id = id
+
+# Build a movie's detail from its full TMDB payload
+def movie_detail(id, resp):
         title = resp['title']
         if resp['images']['posters']:
             poster_path = resp['images']['posters'][0]['file_path']
@@ -157,12 +424,153 @@ def get_movie_detail(id):
         return movie
 
 
+# Retrieve the fields a movie card needs: title, poster and popularity
+def get_movie_summary(id):
+    return movie_summary(id, get_movie_base(id))
+
+
+async def get_movie_summary_async(id):
+    return movie_summary(id, await get_movie_base_async(id))
+
+
+# Build a movie card from a base or full TMDB movie payload
+def movie_summary(id, resp):
+    title = resp['title']
+    if resp['poster_path']:
+        img_url = IMAGE_BASE_URL + resp['poster_path']
+    else:
+        img_url = "/static/images/noImage.jpg"
+    popularity = 0
+    if resp['popularity']:
+        popularity = round(float(resp['popularity']), 2)
+
+    movie = {
+        id: {
+            'title': title,
+            'img_url': img_url,
+            'popularity': popularity,
+        }
+    }
+
+    return movie
+
+
+# Shared thread pool for batch fetches, one per worker process
+def get_executor():
+    global _executor, _executor_pid
+
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _executor_lock:
+            if _executor is None or _executor_pid != pid:
+                _executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY,
+                                               thread_name_prefix='tmdb')
+                _executor_pid = pid
+
+    return _executor
+
+
+# Fetch many items in parallel, keeping input order and skipping failures
+def fetch_many(fetch, ids):
+    ids = list(dict.fromkeys(ids))
+    # Each fetch runs in a copy of our context, so it is timed with our request
+    futures = [get_executor().submit(contextvars.copy_context().run, fetch, id) for id in ids]
+
+    results = {}
+    for id, future in zip(ids, futures):
+        try:
+            results[id] = future.result()
+        except Exception:
+            logger.warning('TMDB fetch failed for id %s', id, exc_info=True)
+
+    return results
+
+
+# Retrieve the details of many movies at once
+def get_movie_details_many(ids):
+    movies = fetch_many(get_movie_detail, ids)
+
+    return {id: movie[id] for id, movie in movies.items()}
+
+
+# Retrieve the card fields of many movies at once
+def get_movie_summaries_many(ids):
+    movies = fetch_many(get_movie_summary, ids)
+
+    return {id: movie[id] for id, movie in movies.items()}
+
+
+# Same as fetch_many, as concurrent coroutines on the running loop
+async def fetch_many_async(fetch, ids):
+    ids = list(dict.fromkeys(ids))
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+
+    async def bounded(id):
+        async with semaphore:
+            return await fetch(id)
+
+    outcomes = await asyncio.gather(*(bounded(id) for id in ids), return_exceptions=True)
+
+    results = {}
+    for id, outcome in zip(ids, outcomes):
+        if isinstance(outcome, Exception):
+            logger.warning('TMDB fetch failed for id %s', id, exc_info=outcome)
+        else:
+            results[id] = outcome
+
+    return results
+
+
+async def get_movie_summaries_many_async(ids):
+    movies = await fetch_many_async(get_movie_summary_async, ids)
+
+    return {id: movie[id] for id, movie in movies.items()}
+
+
 # Retrieve cast's detail
 def get_cast_detail(id):
+    return cast_detail(id, get_cast(id))
 
-    resp = get_cast(id)
-    
-    id=id
+
+async def get_cast_detail_async(id):
+    return cast_detail(id, await get_cast_async(id))
+
+
+# One movie of a person's filmography; popularity is a percentage of their
+# most popular movie's
+class CastCredit(NamedTuple):
+    id: int
+    title: str
+    character: str
+    poster_path: Optional[str]
+    popularity: int
+
+
+# Indices of the n most popular credits, most popular first, and their popularity
+def top_credits(credits, n=CAST_CREDITS):
+    if len(credits) <= PARTIAL_SELECT_MIN or not 0 < n < len(credits):
+        popularity = list(map(credit_popularity, credits))
+        top = sorted(range(len(credits)), key=popularity.__getitem__, reverse=True)[:n]
+        return top, [popularity[i] for i in top]
+
+    popularity = np.fromiter(map(credit_popularity, credits), dtype=np.float64, count=len(credits))
+    # Everything above the n-th largest value, then the earliest of its ties,
+    # so the pick matches a stable sort
+    cutoff = np.partition(popularity, len(credits) - n)[len(credits) - n]
+    above = np.flatnonzero(popularity > cutoff)
+    top = np.concatenate([above, np.flatnonzero(popularity == cutoff)[:n - len(above)]])
+    top.sort()
+    top = top[np.argsort(-popularity[top], kind='stable')]
+
+    return top.tolist(), popularity[top].tolist()
+
+
+def credit_popularity(credit):
+    return credit.get('popularity') or 0
+
+
+# Build a cast's detail from their TMDB payload
+def cast_detail(id, resp, limit=CAST_CREDITS):
     name =  resp['name']
     if resp['images']['profiles']: 
         img_url = IMAGE_BASE_URL + resp['images']['profiles'][0]['file_path']
@@ -172,17 +580,17 @@ def get_cast_detail(id):
         biography = resp['biography']
     else:
         biography = "No information available."
-    movies = resp['movie_credits']['cast']
-    movies.sort(key=lambda x: x['popularity'], reverse=True)
-    
-    if movies:
-        max_pop = movies[0]['popularity']
-        if max_pop != 0:
-            for movie in movies:
-                movie['popularity'] = int(round((movie['popularity'] / max_pop) * 100))
-        else:
-            for movie in movies:
-                movie['popularity'] = 0
+
+    credits = resp['movie_credits']['cast']
+    top, popularity = top_credits(credits, limit)
+
+    # The most popular movie is 100%
+    best = popularity[0] if popularity else 0
+    percent = [round(value / best * 100) if best else 0 for value in popularity]
+
+    movies = [CastCredit(credit['id'], credit.get('title'), credit.get('character'),
+                         credit.get('poster_path'), value)
+              for credit, value in zip(map(credits.__getitem__, top), percent)]
       
     cast = {
         id: {
@@ -196,15 +604,33 @@ def get_cast_detail(id):
     return cast
 
 
+# {movie_id: title} of a person's most popular movies, without building their detail
+def cast_titles(resp, limit=CAST_CREDITS):
+    credits = resp['movie_credits']['cast']
+    top, _ = top_credits(credits, limit)
+    pick = itemgetter('id', 'title')
+
+    return dict(pick(credits[i]) for i in top)
+
+
 
 # Retrieve movie ids by genre
 def get_ids_by_genre(id):
+    return ids_by_genre(get_movie_by_genre(id), genre_registry.name(id))
 
-    resp = get_movie_by_genre(id)
 
-    
-    movie_ids = [movie['id'] for movie in resp[0]['results']]
-    genre = [genre['name'] for genre in resp[1]['genres'] if str(genre['id']) == id]
+async def get_ids_by_genre_async(id):
+    resp = await get_movie_by_genre_async(id)
+    # The first lookup may wait on the genre list; keep that off the loop
+    name = await asyncio.to_thread(genre_registry.name, id)
+
+    return ids_by_genre(resp, name)
+
+
+# Movie ids of a discover payload, plus the genre's name
+def ids_by_genre(resp, name):
+    movie_ids = [movie['id'] for movie in resp['results']]
+    genre = [name] if name else []
       
     return [movie_ids, genre]
 
@@ -212,8 +638,15 @@ def get_ids_by_genre(id):
 
 # Retrieve movie reviews
 def get_reviews(id):
+    return movie_reviews(get_movie(id))
+
 
-    resp = get_movie(id)
+async def get_reviews_async(id):
+    return movie_reviews(await get_movie_async(id))
+
+
+# TMDB reviews of a full movie payload, with absolute avatar urls
+def movie_reviews(resp):
     reviews = resp['reviews']['results']
     
     for review in reviews:
@@ -232,9 +665,9 @@ def get_reviews(id):
 # Retrieve trending movies data
 def get_trending_movies_info():
 
-    resp = get_trending_movies()
+    movies = trending_snapshot.get()
 
-    resp = random.sample(resp['results'], 10)
+    resp = random.sample(movies, min(10, len(movies)))
     trending = {}
     for index, movie in enumerate(resp):
         if index >= 10:
@@ -265,12 +698,7 @@ def get_trending_movies_info():
 def search_movie_by_title(title):
     url = (API_BASE_URL+'search/movie?query={movie_title}&api_key={api_key}&language=en-US&page=1&sort_by=popularity.desc').format(api_key=API_KEY, movie_title=title)
 
-    try:     
-        res = requests.get(url)
-    except:
-        raise ('not connected to internet or movidb issue')
-    
-    response = res.json()
+    response = cached_get_json('search', url)
 
     return response
 
@@ -298,12 +726,7 @@ def get_ids_and_titles(title):
 def search_movie_by_cast(name):
     url = (API_BASE_URL+'search/person?query={cast_name}&api_key={api_key}&language=en-US&page=1&sort_by=popularity.desc').format(api_key=API_KEY, cast_name=name)
     
-    try:
-        res = requests.get(url)
-    except:
-        raise ('not connected to internet or movidb issue')
-    
-    response = res.json()
+    response = cached_get_json('search', url)
 
     return response
 
@@ -318,18 +741,7 @@ def get_ids_and_cast(name):
         cast_id = resp['results'][0]['id']
 
         if cast_id:
-            cast_info = get_cast_detail(cast_id)
-
-            movies = cast_info[cast_id]['movies']
-
-            if movies:
-                for index, movie in enumerate(movies):
-                    if index >= 12:
-                        break
-                    movie_id = movie['id']
-                    title = movie['title']
-
-                    suggestions[movie_id] = title
+            suggestions = cast_titles(get_cast(cast_id))
 
         return suggestions
     
@@ -1,13 +1,29 @@
-import os, random, re
-from dotenv import load_dotenv
-from flask import Flask, render_template, flash, redirect, url_for, session, g, request
-from flask_debugtoolbar import DebugToolbarExtension
+import random, re, asyncio, logging, threading
+from flask import Flask, Response, render_template, flash, redirect, url_for, session, g, request, jsonify, send_file, abort
+from werkzeug.local import LocalProxy
 
+from config import get_config
 from forms import AddUserForm, LoginForm, MovieReccomend, EditUserForm, ReviewForm, Confirmation
 from models import db, connect_db, User, FavoriteCasts, FavoriteMovies
+from background import TaskQueue, PeriodicTask
+from identity import IdentityCache
+from metadata_store import save_movie_metadata, save_cast_metadata, get_favorite_movies_info, get_favorite_casts_info
+from pagination import keyset_paginate, page_args
+from instrumentation import instrument_app, render_metrics, metrics_authorized
 from sqlalchemy.exc import IntegrityError
-# from movie_recommender import movie_suggestions, cosine_sim2
-from api_requests import get_movie_detail, get_cast_detail, get_ids_by_genre, get_reviews, get_trending_movies_info, get_ids_and_titles, get_ids_and_cast
+from sqlalchemy.orm import joinedload
+from cachetools import TTLCache
+from movie_recommender import get_recommender
+from co_favorites import also_saved, run_update as update_co_favorites, cli as co_favorites_cli
+from catalog import search as search_catalog, localize as localize_titles, cli as catalog_cli
+from autocomplete import Autocomplete, MAX_SUGGESTIONS
+from suggestion_store import save as save_suggestions, load as load_suggestions
+from image_proxy import ImageStore, image_name, IMAGE_SIZES, FORMATS, MAX_AGE, NAME_RE, SOURCE_URL
+from tmdb_client import TMDBError
+from page_cache import PageCache
+from api_requests import get_movie_detail, get_cast_detail, get_trending_movies_info, get_ids_and_titles, get_ids_and_cast
+from api_requests import get_movie_detail_async, get_movie_summaries_many_async, get_cast_detail_async, get_ids_by_genre_async, get_reviews_async
+from tmdb_async import submit, wait
 # from mysecrets import get_secret
 
 
@@ -16,33 +32,106 @@ IMAGE_BASE_URL = 'https://image.tmdb.org/t/p/w500'
 
 
 app = Flask(__name__)
-load_dotenv()
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ.get('DATABASE_URL', 'postgresql:///MoviesBox_db'))
+app.config.from_object(get_config())
 # app.config['SQLALCHEMY_DATABASE_URI'] = get_secret("DATABASE_URL")
-app.config['SQLALCHEMY_ECHO'] = True
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "Chicken6768")
 # app.config['SECRET_KEY'] = get_secret('SECRET_KEY')
-# toolbar = DebugToolbarExtension(app)
+
+logging.basicConfig(level=app.config['LOG_LEVEL'],
+                    format='%(asctime)s %(levelname)s %(name)s %(message)s')
+logger = logging.getLogger(__name__)
+
+if app.config['DEBUG_TOOLBAR']:
+    from flask_debugtoolbar import DebugToolbarExtension
+    toolbar = DebugToolbarExtension(app)
+
+# Server-Timing header and /metrics histograms; registered first so the
+# timing covers every other before_request hook
+instrument_app(app)
 
 with app.app_context():
     connect_db(app)
 
+# Refreshes stale favorites metadata off the request path
+metadata_queue = TaskQueue(app, 'metadata-refresh')
+
+identity_cache = IdentityCache(app.config['IDENTITY_CACHE_TTL'])
+
+# Random reviews on /all_reviews are re-drawn every REVIEW_SAMPLE_TTL seconds
+review_sample_cache = TTLCache(maxsize=1, ttl=app.config['REVIEW_SAMPLE_TTL'])
+review_sample_lock = threading.Lock()
+
+# Cards of the suggestion sets this worker rendered recently, by set key
+suggestion_card_cache = TTLCache(maxsize=256, ttl=app.config['SUGGESTION_CARD_TTL'])
+suggestion_card_lock = threading.Lock()
+
+# `flask co-favorites update|rebuild`; with CO_FAVORITES_INTERVAL set, every
+# worker also folds in new favorites on a timer
+app.cli.add_command(co_favorites_cli)
+co_favorites_task = None
+if app.config['CO_FAVORITES_INTERVAL'] > 0:
+    co_favorites_task = PeriodicTask('co-favorites', app.config['CO_FAVORITES_INTERVAL'],
+                                     lambda: update_co_favorites(app))
+
+# `flask catalog ingest|localize`: TMDB's daily movie export, searched by title below
+app.cli.add_command(catalog_cli)
+
+def record_titles(movies):
+    """ Store the en-US titles of movies fetched from TMDB in the catalog, off
+    the request path, so title search finds them by those too. """
+
+    metadata_queue.submit(localize_titles, {id: movie['title'] for id, movie in movies.items()})
+
+# Movie and cast pages of anonymous visitors, with ETags for everyone; every
+# response keeps the login cookie a CDN bypasses its cache on up to date
+page_cache = PageCache(app.config['PAGE_CACHE_TTL'], CURR_USER_KEY)
+app.after_request(page_cache.mark_login)
+
+# Posters and profile pictures, resized and kept on local disk
+image_store = ImageStore(app.config['IMAGE_CACHE_DIR'])
+
+@app.template_filter('image')
+def image_filter(url, size):
+    """ The /images/ url of a TMDB image at size; other urls are left alone. """
+
+    name = image_name(url)
+    return url_for('show_image', size=size, name=name) if name else url
+
+# Typeahead for the homepage search, rebuilt from the catalog in the background
+autocomplete_index = Autocomplete(app, app.config['AUTOCOMPLETE_INTERVAL'], app.config['AUTOCOMPLETE_SIZE'])
+
 
 
 ##############################################################################
 # User signup/login/logout routes
 ##############################################################################
 
+def load_current_user():
+    """ Identity of the logged-in user, loaded at most once per request. """
+
+    if '_current_user' not in g:
+        if CURR_USER_KEY in session:
+            g._current_user = identity_cache.get(session[CURR_USER_KEY])
+        else:
+            g._current_user = None
+
+    return g._current_user
+
 @app.before_request
 def add_user_to_g():
-    """ If logged in, add curr user to Flask global. """
+    """ If logged in, add curr user to Flask global.
 
-    if CURR_USER_KEY in session:
-            g.user = User.query.get(session[CURR_USER_KEY]) 
-    else:
-        g.user = None
+    g.user is a lazy proxy: nothing is loaded until a view or template uses it. """
+
+    g.pop('_current_user', None)
+    g.user = LocalProxy(load_current_user)
+
+@app.before_request
+def start_background_tasks():
+    """ Start this worker's timers; a no-op once they run. """
+
+    if co_favorites_task is not None:
+        co_favorites_task.start()
+    autocomplete_index.task.start()
 
 def do_login(user):
     """Log in user."""
@@ -106,7 +195,8 @@ def login():
 
         flash("Invalid credentials.", 'danger')
     
-    print(form.errors)
+    if form.errors:
+        logger.debug('login form invalid errors=%s', form.errors)
 
     return render_template('users/login.html', form=form)
 
@@ -143,7 +233,7 @@ def user_edit_profile():
         flash("Please sign up or login", "danger")
         return redirect("/signup")
 
-    user = g.user
+    user = User.query.get_or_404(g.user.id)
     form = EditUserForm(obj=user)
     
     if form.validate_on_submit():
@@ -153,6 +243,7 @@ def user_edit_profile():
             user.image_profile = form.image_profile.data or "/static/images/default-pic.png"
 
             db.session.commit()
+            identity_cache.invalidate(user.id)
             return redirect(f"/users/{user.id}")
                 
         flash("Wrong password, please try again.", 'danger')
@@ -177,9 +268,11 @@ def delete_user():
     if form.validate_on_submit():
         confirmation = form.confirmation.data
         if confirmation == 'yes':
+            user = User.query.get_or_404(g.user.id)
             do_logout()
-            db.session.delete(g.user)
+            db.session.delete(user)
             db.session.commit()
+            identity_cache.invalidate(user.id)
             flash("Account has been deleted. Hope to see you soon again!", "success")
             return redirect("/signup")
         
@@ -205,6 +298,34 @@ def home():
 ##############################################################################
 # Homepage route
 ##############################################################################
+def search_titles(title):
+    """ {movie_id: title} of the movies matching title in the local catalog,
+    by original or localized title; TMDB search when the catalog has no match. """
+
+    return search_catalog(title, index=autocomplete_index.indexes['movie']) or get_ids_and_titles(title)
+
+def get_similar_titles(title):
+    """ The movie called title followed by the movies most like it, from the
+    local recommender index. Titles the index doesn't know are matched with
+    a title search; without an index, the search results are returned. """
+
+    recommender = get_recommender(app.config['RECOMMENDER_INDEX'])
+    if recommender is None:
+        return search_titles(title)
+
+    matches = None
+    movie_id = recommender.find(title)
+    if movie_id is None:
+        matches = search_titles(title)
+        movie_id = next((id for id in matches if id in recommender), None)
+
+    if movie_id is not None:
+        suggestions = recommender.movie_suggestions(movie_id, limit=11)
+        if suggestions:
+            return {movie_id: recommender.title(movie_id), **suggestions}
+
+    return matches if matches is not None else search_titles(title)
+
 @app.route('/homepage', methods = ["GET", "POST"])
 def show_homepage():
     """ Show homepage. """
@@ -224,24 +345,27 @@ def show_homepage():
         invalid_chars = r'[^\w\s]'
 
         if re.search(invalid_chars, search_input):
-            print('invalid char')
+            logger.info('search rejected reason=invalid_chars query=%r', search_input)
             error = True
             return render_template('public/homepage.html', form=form, trending=trending, error=error)
         
         if form.content.data == 'overview':
-            suggested_titles = get_ids_and_titles(search_input)      
+            suggested_titles = get_similar_titles(search_input)
         else:
             suggested_titles = get_ids_and_cast(search_input)
 
         # if the user input doesn't exist in the database 
         if isinstance(suggested_titles, str) or len(suggested_titles) == 0:
-            print('no title')
+            logger.info('search found nothing query=%r content=%s', search_input, form.content.data)
             error = True
             return render_template('public/homepage.html', form=form, trending=trending, error=error)
         
-        session['suggested_titles'] = suggested_titles
+        # Only the key of the stored results travels in the url
+        key = save_suggestions(suggested_titles)
+        # Results the session carried before they were stored server-side
+        session.pop('suggested_titles', None)
 
-        return redirect(url_for('show_suggestions', suggested_titles=suggested_titles))
+        return redirect(url_for('show_suggestions', key=key))
           
     else: 
         return render_template('public/homepage.html', form=form, trending=trending,
@@ -249,29 +373,70 @@ def show_homepage():
                                
    
 
+##############################################################################
+# Autocomplete route
+##############################################################################
+@app.route('/autocomplete')
+def autocomplete():
+    """ Most popular movie titles and person names with a word starting with ?q=, as JSON.
+
+    ?kind=movie or ?kind=person asks for one list only; ?limit= caps each list. """
+
+    text = request.args.get('q', '')[:100]
+    kind = request.args.get('kind')
+    limit = max(1, min(request.args.get('limit', 8, type=int), MAX_SUGGESTIONS))
+
+    if kind not in (None, 'movie', 'person'):
+        return jsonify(error=f"unknown kind {kind!r}"), 400
+
+    suggestions = {}
+    if kind in (None, 'movie'):
+        suggestions['movies'] = [{'id': id, 'title': title}
+                                 for id, title in autocomplete_index.suggest('movie', text, limit)]
+    if kind in (None, 'person'):
+        suggestions['people'] = [{'id': id, 'name': name}
+                                 for id, name in autocomplete_index.suggest('person', text, limit)]
+
+    response = jsonify(suggestions)
+    # Every keystroke asks again; let the browser reuse answers for a while
+    response.cache_control.public = True
+    response.cache_control.max_age = 300
+    return response
+
+
+
 ##############################################################################
 # Movie suggesions route
 ##############################################################################
 @app.route('/suggestions')
-def show_suggestions():
+async def show_suggestions():
     """ Show movie suggestions. """
     
     # genre status is deactive here
     genre = ""
 
-    # Retrieve the suggested_titles from the session
-    suggested_titles = session.get('suggested_titles')
+    key = request.args.get('key', '')
+    with suggestion_card_lock:
+        suggested_titles = suggestion_card_cache.get(key)
 
-    for id in suggested_titles.keys():
-        
-        movie = get_movie_detail(id)
-        title = movie[id]['title']
-        img_url = movie[id]['img_url']
-        popularity = movie[id]['popularity']
+    if suggested_titles is None:
+        movie_ids = load_suggestions(key)
+        if movie_ids is None:
+            flash("These suggestions have expired, please search again.", 'info')
+            return redirect('/homepage')
 
-        # Update suggested_titles with movies' image urls and popularity (%)     
-        suggested_titles[id] = (title, img_url, popularity)
-        
+        # Fetch the card fields in parallel; ids that fail to load are left out
+        movies = await wait(get_movie_summaries_many_async(movie_ids))
+        record_titles(movies)
+
+        # Movies' titles, image urls and popularity (%)
+        suggested_titles = {id: (movie['title'], movie['img_url'], movie['popularity'])
+                            for id, movie in movies.items()}
+
+        # Keep only complete sets, so a failed fetch is retried next view
+        if len(suggested_titles) == len(movie_ids):
+            with suggestion_card_lock:
+                suggestion_card_cache[key] = suggested_titles
          
     return render_template('public/show.html', suggested_titles=suggested_titles,
                            genre=genre)
@@ -282,12 +447,17 @@ def show_suggestions():
 # Movie detail route
 ##############################################################################
 @app.route('/movie_detail/<id>')
-def show_movie_detail(id):
+@page_cache.cached
+async def show_movie_detail(id):
     """ Show movie detail. """
     
-    movie = get_movie_detail(id)
+    # TMDB loads on its loop while the "also saved" query runs
+    movie = submit(get_movie_detail_async(id))
+    co_saved = also_saved(id, limit=6)
+    movie = await asyncio.wrap_future(movie)
+    record_titles(movie)
   
-    return render_template('public/movie_detail.html', movie=movie,
+    return render_template('public/movie_detail.html', movie=movie, co_saved=co_saved,
                            IMAGE_BASE_URL=IMAGE_BASE_URL)
 
 
@@ -304,14 +474,9 @@ def favorite_movies():
         return redirect("/signup")
 
     else:
-        movies = FavoriteMovies.query.filter_by(user_id = g.user.id).all()
+        page = get_favorite_movies_info(g.user.id, queue=metadata_queue, page_args=page_args())
         
-        movies_info = []
-        if movies:
-            for movie in movies:
-                movies_info.append(get_movie_detail(movie.id))
-        
-        return render_template('favorites/favorite_movies.html', movies_info=movies_info)
+        return render_template('favorites/favorite_movies.html', movies_info=page.items, page=page)
 
 
 
@@ -333,6 +498,7 @@ def favorite_movie_new(id):
             new_movie = FavoriteMovies(id=id, title=title, user_id=g.user.id)
             
             db.session.add(new_movie)
+            save_movie_metadata(id, movie[id])
             db.session.commit()
 
             flash("Movie added", 'success')
@@ -370,24 +536,19 @@ def favorite_movie_delete(id):
 # Movie suggesions by genre route
 ##############################################################################
 @app.route('/genre_suggestions/<id>')
-def genre_suggestions(id):
+async def genre_suggestions(id):
     """ Generates genre-specific movie suggestions based on the provided 'id'. """
 
     
-    movie_info = get_ids_by_genre(id)
-    random_ids = random.sample(movie_info[0], 12)
+    movie_info = await wait(get_ids_by_genre_async(id))
+    random_ids = random.sample(movie_info[0], min(12, len(movie_info[0])))
     genre = "".join(movie_info[1]).lower()
     
-    suggested_titles = {}
-    for id in random_ids:
-        
-        movie = get_movie_detail(id)
-        title = movie[id]['title']
-        img_url = movie[id]['img_url']
-        popularity = movie[id]['popularity']
-     
-        suggested_titles[id] = (title, img_url, popularity)
-        
+    movies = await wait(get_movie_summaries_many_async(random_ids))
+    record_titles(movies)
+
+    suggested_titles = {id: (movie['title'], movie['img_url'], movie['popularity'])
+                        for id, movie in movies.items()}
 
     return render_template('public/show.html', suggested_titles=suggested_titles,
                            genre=genre)
@@ -425,20 +586,28 @@ def create_movie_review(id):
 # Movie review route
 ##############################################################################
 @app.route('/reviews/<id>')
-def show_movie_review(id):
+async def show_movie_review(id):
     """ Show movie reviews. """
 
-    movies = FavoriteMovies.query \
+    args = page_args()
+
+    # Reviews from external sources, shown on the first page only; they
+    # load on the TMDB loop while the page query runs
+    ex_reviews = None
+    if args['after'] is None and args['before'] is None:
+        ex_reviews = submit(get_reviews_async(id))
+
+    query = FavoriteMovies.query \
+                                .options(joinedload(FavoriteMovies.user)) \
                                 .filter_by(id=id) \
-                                .filter(FavoriteMovies.review.isnot(None)) \
-                                .order_by(FavoriteMovies.pk.desc()) \
-                                .all() 
+                                .filter(FavoriteMovies.review.isnot(None))
+
+    page = keyset_paginate(query, FavoriteMovies.pk, **args)
 
-    # Reviews from external sources
-    ex_reviews = get_reviews(id)
+    ex_reviews = await asyncio.wrap_future(ex_reviews) if ex_reviews else []
 
-    return render_template('public/movie_reviews.html', movies=movies, id=id,
-                           ex_reviews=ex_reviews)
+    return render_template('public/movie_reviews.html', movies=page.items, id=id,
+                           ex_reviews=ex_reviews, page=page)
 
 
 
@@ -454,13 +623,14 @@ def show_user_reviews(id):
         return redirect("/signup")
     
     else:        
-        movies = FavoriteMovies.query \
+        query = FavoriteMovies.query \
                                     .filter_by(user_id=id) \
-                                    .filter(FavoriteMovies.review.isnot(None)) \
-                                    .order_by(FavoriteMovies.pk.desc()) \
-                                    .all() 
+                                    .filter(FavoriteMovies.review.isnot(None))
 
-        return render_template('favorites/user_reviews.html', id = int(id), movies=movies)
+        page = keyset_paginate(query, FavoriteMovies.pk, **page_args())
+
+        return render_template('favorites/user_reviews.html', id = int(id), movies=page.items,
+                               page=page)
 
 
 
@@ -520,12 +690,18 @@ def delete_movie_review(id):
 def show_all_reviews():
     """ Show selected reviews from random users. """
     
-    movies = FavoriteMovies.query \
-                                .filter(FavoriteMovies.review.isnot(None)) \
-                                .order_by(FavoriteMovies.pk.desc()) \
-                                .all()    
-
-    random_reviews = random.sample(movies, 5)
+    with review_sample_lock:
+        pks = review_sample_cache.get('pks')
+    if pks is None:
+        pks = FavoriteMovies.sample_reviewed(5)
+        with review_sample_lock:
+            review_sample_cache['pks'] = pks
+
+    random_reviews = FavoriteMovies.query \
+                                .options(joinedload(FavoriteMovies.user)) \
+                                .filter(FavoriteMovies.pk.in_(pks)) \
+                                .all()
+    random.shuffle(random_reviews)
 
     return render_template('public/all_reviews.html', random_reviews= random_reviews)
 
@@ -535,10 +711,11 @@ def show_all_reviews():
 # Cast detail route
 ##############################################################################
 @app.route('/cast_detail/<id>')
-def show_cast_detail(id):
+@page_cache.cached
+async def show_cast_detail(id):
     """ Show cast detail. """
     
-    cast = get_cast_detail(id)
+    cast = await wait(get_cast_detail_async(id))
        
     return render_template('public/cast_detail.html', cast=cast,
                            IMAGE_BASE_URL=IMAGE_BASE_URL)
@@ -556,14 +733,9 @@ def favorite_casts():
         return redirect("/signup")
 
     else:
-        casts = FavoriteCasts.query.filter_by(user_id = g.user.id).all()
-        
-        casts_info = []
-        if casts:
-            for cast in casts:
-                casts_info.append(get_cast_detail(cast.id))
+        page = get_favorite_casts_info(g.user.id, queue=metadata_queue, page_args=page_args())
 
-        return render_template('favorites/favorite_casts.html', casts_info=casts_info)
+        return render_template('favorites/favorite_casts.html', casts_info=page.items, page=page)
  
 
 
@@ -585,6 +757,7 @@ def favorite_cast_new(id):
             new_cast = FavoriteCasts(id=id, name=name, user_id=g.user.id)
             
             db.session.add(new_cast)
+            save_cast_metadata(id, cast[id])
             db.session.commit()
 
             flash("Cast added", 'success')
@@ -614,4 +787,49 @@ def favorite_cast_delete(id):
         db.session.commit()
         
         flash("Cast deleted", 'success')
-        return redirect('/favorite_casts')
\ No newline at end of file
+        return redirect('/favorite_casts')
+
+
+
+##############################################################################
+# Image route
+##############################################################################
+@app.route('/images/<size>/<name>')
+def show_image(size, name):
+    """ A TMDB image resized to size, as WebP if the browser takes it, else JPEG. """
+
+    if size not in IMAGE_SIZES or not NAME_RE.match(name):
+        abort(404)
+
+    fmt = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'jpg'
+
+    try:
+        path = image_store.variant(name, size, fmt)
+    except (TMDBError, OSError):
+        logger.exception('image %s/%s failed', size, name)
+        path = None
+
+    # Let the browser try TMDB itself
+    if path is None:
+        return redirect(SOURCE_URL.format(name=name))
+
+    response = send_file(path, mimetype=FORMATS[fmt][1], max_age=MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    response.vary.add('Accept')
+    return response
+
+
+
+##############################################################################
+# Metrics route
+##############################################################################
+@app.route('/metrics')
+def show_metrics():
+    """ Per-endpoint request, TMDB and SQL histograms of this worker, for Prometheus. """
+
+    # Hidden from anyone without METRICS_TOKEN
+    if not metrics_authorized(app.config['METRICS_TOKEN']):
+        abort(404)
+
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,245 @@
+"""Typeahead suggestions for movie titles and person names.
+
+A PrefixIndex holds the most popular entries of one catalog table
+(catalog.py) in three flat arrays:
+
+    text     every normalized name, each followed by '\\n'; an entry can have
+             more than one, e.g. a movie's English and original titles
+    offsets  the start of every word of every name in text, sorted by the
+             text from there to the end of its name
+    items    the entry each offset belongs to; entries are numbered by
+             popularity, so a lower number is a more popular entry
+
+A prefix selects one run of offsets by bisection, so 'mat' finds both
+'matrix' and 'the matrix'. Its most popular entries are the lowest item
+numbers in the run. Runs longer than SCAN_LIMIT (short, common prefixes
+such as 't') are answered from a table built with the index, so a lookup
+never reads more than SCAN_LIMIT items.
+
+Autocomplete rebuilds both indexes from the database on a daemon thread
+and swaps them in when they are done; requests keep reading the previous
+ones meanwhile, and get no suggestions before the first build lands.
+"""
+
+import re, time, heapq, logging, unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+
+from background import PeriodicTask
+from models import db, CatalogMovie, CatalogPerson
+
+
+logger = logging.getLogger(__name__)
+
+# Most suggestions one lookup returns; title search (catalog.search) asks for 12
+MAX_SUGGESTIONS = 12
+# Longest run of matches a lookup scans; longer ones are precomputed
+SCAN_LIMIT = 1024
+# Words of a name that start a key: 'the lord of the rings' is found from
+# 'lord' and 'rings', not from words past the sixth
+MAX_WORDS = 6
+# Sorts after every character a name can contain
+END = '\U0010ffff'
+
+WORD_RE = re.compile(r'[^\W_]+')
+
+
+def normalize(text):
+    """ Casefolded words of text without accents, joined by single spaces. """
+
+    text = text.casefold()
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(char for char in text if not unicodedata.combining(char))
+
+    return ' '.join(WORD_RE.findall(text))
+
+
+class Keys:
+    """ The sorted keys of a PrefixIndex as a sequence of strings, for bisect. """
+
+    def __init__(self, text, offsets):
+        self.text = text
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        start = self.offsets[i]
+        return self.text[start:self.text.index('\n', start)]
+
+
+class PrefixIndex:
+    """ Entries of one kind, looked up by the prefix of any word of their name. """
+
+    def __init__(self, entries=(), scan_limit=SCAN_LIMIT):
+        """ entries: (id, name, *other names) tuples, most popular first;
+        lookups return the name, and match any of them. """
+
+        self.ids = array('i')
+        self.names = []
+        # Normalized other names of the entries that have any, by item
+        self.aliases = {}
+        self.scan_limit = scan_limit
+
+        parts, offsets, items, suffixes = [], [], [], []
+        position = 0
+        for id, name, *others in entries:
+            keys = list(dict.fromkeys(filter(None, map(normalize, (name, *others)))))
+            if not keys:
+                continue
+            self.ids.append(id)
+            self.names.append(name)
+            item = len(self.names) - 1
+            if len(keys) > 1:
+                self.aliases[item] = keys[1:]
+
+            for key in keys:
+                # A key starts at every word of the name
+                start = 0
+                for word in key.split(' ', MAX_WORDS - 1):
+                    offsets.append(position + start)
+                    items.append(item)
+                    suffixes.append(key[start:])
+                    start += len(word) + 1
+
+                parts.append(key + '\n')
+                position += len(key) + 1
+
+        order = sorted(range(len(suffixes)), key=suffixes.__getitem__)
+        del suffixes
+
+        self.keys = Keys(''.join(parts), array('I', [offsets[i] for i in order]))
+        self.items = array('I', [items[i] for i in order])
+        self.top = {}
+        if len(self.items) > scan_limit:
+            self._precompute(0, len(self.items), 0)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _best(self, lo, hi, limit=MAX_SUGGESTIONS):
+        """ The most popular distinct items among keys lo..hi. """
+
+        return heapq.nsmallest(limit, set(self.items[lo:hi]))
+
+    def _precompute(self, lo, hi, depth):
+        """ Best items of keys lo..hi, which share their first depth characters.
+
+        Fills self.top for every prefix of over scan_limit keys; each run is
+        built from its child runs' best items, so every key is read once. """
+
+        if hi - lo <= self.scan_limit:
+            return self._best(lo, hi)
+
+        keys = self.keys
+        prefix = keys[lo][:depth]
+
+        # A key that is the prefix itself sorts first and has no child run
+        start = lo
+        while lo < hi and len(keys[lo]) == depth:
+            lo += 1
+        candidates = set(self.items[start:lo])
+
+        while lo < hi:
+            child = keys[lo][:depth + 1]
+            end = bisect_right(keys, child + END, lo, hi)
+            candidates.update(self._precompute(lo, end, depth + 1))
+            lo = end
+
+        best = self.top[prefix] = heapq.nsmallest(MAX_SUGGESTIONS, candidates)
+        return best
+
+    def _run(self, prefix):
+        """ Bounds of the keys starting with prefix. """
+
+        lo = bisect_left(self.keys, prefix)
+        return lo, bisect_right(self.keys, prefix + END, lo)
+
+    def suggest(self, text, limit=MAX_SUGGESTIONS):
+        """ [(id, name)] of the most popular entries with a word starting with text. """
+
+        prefix = normalize(text)
+        if not prefix or not self.names:
+            return []
+
+        best = self.top.get(prefix)
+        if best is None:
+            best = self._best(*self._run(prefix), limit)
+
+        return [(self.ids[item], self.names[item]) for item in best[:limit]]
+
+    def search(self, text, limit=MAX_SUGGESTIONS):
+        """ Like suggest(), but when no name holds the words of text in that
+        order, the names holding every one of them in any order, the last
+        word as a prefix. """
+
+        found = self.suggest(text, limit)
+        words = normalize(text).split(' ')
+        if found or len(words) < 2:
+            return found
+
+        # Candidates from the word with the fewest keys, most popular first
+        lo, hi = min((self._run(word) for word in words), key=lambda run: run[1] - run[0])
+        *whole, last = words
+
+        found = []
+        for item in sorted(set(self.items[lo:hi])):
+            for name in (normalize(self.names[item]), *self.aliases.get(item, ())):
+                name_words = name.split(' ')
+                if all(word in name_words for word in whole) and \
+                   any(word.startswith(last) for word in name_words):
+                    found.append((self.ids[item], self.names[item]))
+                    break
+            if len(found) == limit:
+                break
+
+        return found
+
+
+def load_entries(model, columns, size):
+    """ (id, name, *other names) of the size most popular rows of a catalog
+    table; the name is the first of columns that is set. """
+
+    query = db.session.query(model.id, *(getattr(model, column) for column in columns)) \
+                      .order_by(model.popularity.desc(), model.id) \
+                      .limit(size)
+
+    for id, *names in query.yield_per(10_000):
+        yield (id, *filter(None, names))
+
+
+class Autocomplete:
+    """ Movie and person PrefixIndexes of a worker, rebuilt in the background.
+
+    A rebuild replaces both indexes in one assignment, so a lookup never
+    mixes an old index with a new one and never waits for a build. """
+
+    # Movies are listed by their localized title, found by either title
+    SOURCES = {'movie': (CatalogMovie, ('localized_title', 'title')),
+               'person': (CatalogPerson, ('name',))}
+
+    def __init__(self, app, interval, size):
+        self.app = app
+        self.size = size
+        self.indexes = {kind: PrefixIndex() for kind in self.SOURCES}
+        self.built_at = None
+        self.task = PeriodicTask('autocomplete-rebuild', interval, self.rebuild)
+
+    def rebuild(self):
+        start = time.perf_counter()
+        with self.app.app_context():
+            indexes = {kind: PrefixIndex(load_entries(model, columns, self.size))
+                       for kind, (model, columns) in self.SOURCES.items()}
+            db.session.remove()
+
+        self.indexes = indexes
+        self.built_at = time.time()
+        logger.info('autocomplete rebuilt: %s in %.1fs',
+                    ', '.join(f'{len(index)} {kind}' for kind, index in indexes.items()),
+                    time.perf_counter() - start)
+
+    def suggest(self, kind, text, limit=MAX_SUGGESTIONS):
+        self.task.start()
+        return self.indexes[kind].suggest(text, limit)
@@ -0,0 +1,112 @@
+"""Background work for MoviesBox, run on daemon threads inside each worker."""
+
+import os, queue, logging, threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class TaskQueue:
+    """ Runs submitted jobs one at a time on a daemon thread, inside an app context.
+
+    Jobs submitted with a key are dropped while a job with the same key is
+    still pending, so repeated page views don't pile up duplicate work. """
+
+    def __init__(self, app, name):
+        self.app = app
+        self.name = name
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_worker(self):
+        """ Start the worker thread, again after a fork if needed. """
+
+        if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+            self._queue = queue.Queue()
+            self._pending = set()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def submit(self, func, *args, key=None):
+        """ Queue func(*args); returns False if an identical job is pending. """
+
+        with self._lock:
+            self._ensure_worker()
+            if key is not None:
+                if key in self._pending:
+                    return False
+                self._pending.add(key)
+            self._queue.put((func, args, key))
+
+        return True
+
+    def _run(self):
+        jobs = self._queue
+        while True:
+            func, args, key = jobs.get()
+            try:
+                with self.app.app_context():
+                    func(*args)
+            except Exception:
+                logger.exception('background job %s failed', getattr(func, '__name__', func))
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+                jobs.task_done()
+
+    def join(self):
+        """ Block until every queued job has run. """
+
+        self._queue.join()
+
+
+class PeriodicTask:
+    """ Calls func right away and then every interval seconds on a daemon thread.
+
+    A run that raises is retried after retry_interval instead. The thread is
+    started lazily by the first caller in each process, so nothing runs in a
+    gunicorn master that forks its workers. """
+
+    def __init__(self, name, interval, func, retry_interval=60):
+        self.name = name
+        self.interval = interval
+        self.retry_interval = min(retry_interval, interval)
+        self.func = func
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def start(self):
+        """ Start the thread if this process isn't running it yet. """
+
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._wake = threading.Event()
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def trigger(self):
+        """ Run func again now instead of waiting for the next interval. """
+
+        self._wake.set()
+
+    def _run(self):
+        wake = self._wake
+        while True:
+            try:
+                self.func()
+                delay = self.interval
+            except Exception:
+                logger.exception('periodic task %s failed', self.name)
+                delay = self.retry_interval
+            wake.wait(delay)
+            wake.clear()
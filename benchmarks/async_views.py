@@ -0,0 +1,112 @@
+"""Throughput of the TMDB-bound routes under gunicorn worker classes.
+
+Starts benchmarks/fake_tmdb.py with a fixed latency, runs the app under
+each gunicorn configuration with the response cache off, drives the
+detail, genre and review routes with concurrent clients and prints
+req/s and latency percentiles for each.
+
+    createdb MoviesBox_bench
+    python benchmarks/async_views.py --latency 0.15 --concurrency 64
+
+--app-dir runs another checkout (git worktree add) instead, for a
+before/after pair; it has to read TMDB_API_BASE_URL.
+"""
+
+import os, sys, time, random, signal, argparse, subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(__file__))
+import fake_tmdb
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+# gunicorn arguments of each configuration, by label
+CONFIGS = {
+    'sync -w 4': ['-w', '4'],
+    'gthread -w 4 --threads 16': ['-w', '4', '-k', 'gthread', '--threads', '16'],
+}
+
+PATHS = [
+    lambda: f'/movie_detail/{random.randint(1, 100_000)}',
+    lambda: f'/cast_detail/{random.randint(1, 100_000)}',
+    lambda: '/genre_suggestions/28',
+    lambda: f'/reviews/{random.randint(1, 100_000)}',
+]
+
+
+def wait_until_up(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(base_url + '/login', timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'app did not start on {base_url}')
+
+
+def drive(base_url, concurrency, duration):
+    """ Hit random routes from concurrency clients; returns (count, errors, latencies). """
+
+    deadline = time.time() + duration
+
+    def client():
+        latencies, errors = [], 0
+        while time.time() < deadline:
+            start = time.perf_counter()
+            try:
+                urllib.request.urlopen(base_url + random.choice(PATHS)(), timeout=30).read()
+                latencies.append(time.perf_counter() - start)
+            except OSError:
+                errors += 1
+        return latencies, errors
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(lambda _: client(), range(concurrency)))
+
+    latencies = sorted(l for result in results for l in result[0])
+    return len(latencies), sum(result[1] for result in results), latencies
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000 if values else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=os.environ.get('BENCH_DATABASE_URL',
+                                                                 'postgresql:///MoviesBox_bench'))
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--app-dir', default=ROOT, help='checkout of the app to run')
+    fake_tmdb.add_arguments(parser)
+    args = parser.parse_args()
+
+    tmdb = fake_tmdb.serve(latency=args.latency, **fake_tmdb.options(args))
+    env = dict(os.environ,
+               DATABASE_URL=args.database_url,
+               TMDB_API_BASE_URL=f'http://127.0.0.1:{tmdb.server_port}/3/',
+               TMDB_CACHE_BACKEND='none')
+    base_url = f'http://127.0.0.1:{args.port}'
+
+    print(f'{"workers":<28}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"errors":>8}')
+    for label, gunicorn_args in CONFIGS.items():
+        app = subprocess.Popen(['gunicorn', '-b', f'127.0.0.1:{args.port}', *gunicorn_args, 'app:app'],
+                               cwd=args.app_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_until_up(base_url)
+            count, errors, latencies = drive(base_url, args.concurrency, args.duration)
+        finally:
+            app.send_signal(signal.SIGTERM)
+            app.wait()
+
+        print(f'{label:<28}{count / args.duration:>9.1f}{percentile(latencies, 0.5):>9.0f}'
+              f'{percentile(latencies, 0.95):>9.0f}{percentile(latencies, 0.99):>9.0f}{errors:>8}')
+
+    tmdb.shutdown()
+
+
+if __name__ == '__main__':
+    main()
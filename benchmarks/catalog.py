@@ -0,0 +1,116 @@
+"""Ingest time and search latency of the local movie catalog.
+
+Writes a synthetic TMDB movie id export of --movies titles (words drawn
+from a Zipf-distributed vocabulary, so a few words are in a large share
+of titles, as 'the' and 'of' are), ingests it and times catalog.search()
+for queries of common, mid-frequency and rare words, prefixes and
+two-word titles: first on the GIN query alone, then with the autocomplete
+index of the --indexed most popular movies in front of it. --no-db skips
+the database and times the index alone, built from the export.
+
+    createdb MoviesBox_bench
+    python benchmarks/catalog.py --movies 1000000
+"""
+
+import os, sys, gzip, json, time, random, argparse, tempfile, itertools
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('DATABASE_URL', 'postgresql:///MoviesBox_bench')
+
+from app import app
+from models import db, CatalogMovie
+import catalog
+from autocomplete import PrefixIndex
+
+VOCABULARY = 50_000
+
+
+def word(rank):
+    return f'w{rank}x'
+
+
+def write_export(path, movies, seed=0):
+    rng = random.Random(seed)
+    cum_weights = list(itertools.accumulate(1 / rank ** 1.1 for rank in range(1, VOCABULARY + 1)))
+    ranks = range(1, VOCABULARY + 1)
+
+    with gzip.open(path, 'wt') as export:
+        for id in range(1, movies + 1):
+            title = ' '.join(word(rank) for rank in rng.choices(ranks, cum_weights=cum_weights, k=rng.randint(1, 5)))
+            export.write(json.dumps({'adult': False, 'id': id, 'original_title': title,
+                                     'popularity': round(rng.expovariate(0.2), 3), 'video': False}) + '\n')
+
+
+QUERIES = {
+    'most common word': lambda: word(1),
+    'rank-50 word': lambda: word(50),
+    'rank-5000 word': lambda: word(random.randint(4000, 6000)),
+    'prefix (w12*)': lambda: 'w12',
+    'two words': lambda: f'{word(random.randint(1, 20))} {word(random.randint(20, 200))}',
+    'no match': lambda: 'zzz',
+}
+
+
+def time_queries(label, search, queries):
+    timings, misses = [], 0
+    for _ in range(queries):
+        query = QUERIES[label]()
+        start = time.perf_counter()
+        misses += not search(query)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    print(f'{label:<20}p50 {timings[len(timings) // 2] * 1000:6.2f} ms   '
+          f'p99 {timings[int(len(timings) * 0.99)] * 1000:6.2f} ms   {misses} without a match')
+
+
+def index_from_export(path, size):
+    """ PrefixIndex of the size most popular movies of an export. """
+
+    with catalog.open_export(path) as lines:
+        rows = sorted(catalog.export_rows(lines, None), key=lambda row: (-row['popularity'], row['id']))
+    return PrefixIndex((row['id'], row['title']) for row in rows[:size])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--movies', type=int, default=1_000_000)
+    parser.add_argument('--indexed', type=int, default=app.config['AUTOCOMPLETE_SIZE'])
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--no-db', action='store_true')
+    args = parser.parse_args()
+
+    with app.app_context(), tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'movie_ids.json.gz')
+        write_export(path, args.movies)
+
+        if args.no_db:
+            start = time.perf_counter()
+            index = index_from_export(path, args.indexed)
+            print(f'index build         {len(index):,} movies in {time.perf_counter() - start:.1f}s')
+            for label in QUERIES:
+                time_queries(label, lambda query: index.search(query, catalog.SEARCH_LIMIT), args.queries)
+            return
+
+        CatalogMovie.__table__.drop(db.engine, checkfirst=True)
+        CatalogMovie.__table__.create(db.engine)
+
+        start = time.perf_counter()
+        with catalog.open_export(path) as lines:
+            upserted, _ = catalog.ingest(lines)
+        seconds = time.perf_counter() - start
+        db.session.execute(db.text('ANALYZE catalog_movies'))
+        db.session.commit()
+        print(f'ingest              {upserted:,} movies in {seconds:.1f}s ({upserted / seconds:,.0f}/s)')
+
+        print('GIN query')
+        for label in QUERIES:
+            time_queries(label, catalog.search, args.queries)
+
+        index = index_from_export(path, args.indexed)
+        print(f'index of {len(index):,} movies, then GIN query')
+        for label in QUERIES:
+            time_queries(label, lambda query: catalog.search(query, index=index), args.queries)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Throughput and memory of the co_favorites pipeline on a large favorites table.
+
+Fills the target database with --users users saving --per-user movies
+each (ids skewed toward popular movies), times a full update() from an
+empty watermark, then times an incremental run over --new fresh rows.
+Peak RSS is this process's, which runs update(); the work is in SQL, so
+it should not move with the table size.
+
+    createdb MoviesBox_bench
+    python benchmarks/co_favorites.py --users 50000 --per-user 20
+
+The tables of the target database are dropped and recreated.
+"""
+
+import os, sys, time, argparse, resource
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('DATABASE_URL', 'postgresql:///MoviesBox_bench')
+
+from app import app
+from models import db
+import co_favorites
+
+
+def seed(users, per_user, movies):
+    db.drop_all()
+    db.create_all()
+
+    db.session.execute(db.text("""
+        INSERT INTO users (id, username, password, email)
+        SELECT n, 'bench' || n, 'x', 'bench' || n || '@example.com'
+        FROM generate_series(1, :users) n
+    """), {'users': users})
+    db.session.execute(db.text("""
+        INSERT INTO movie_metadata (id, title, popularity, genres, director, refreshed_at)
+        SELECT n, 'Movie ' || n, 0,
+               json_build_array(json_build_object('id', n % 19), json_build_object('id', n % 7 + 100)),
+               json_build_object((n % 5000)::text, 'Director'), now()
+        FROM generate_series(1, :movies) n
+    """), {'movies': movies})
+    db.session.commit()
+    add_favorites(users, per_user, movies)
+
+
+def add_favorites(users, per_user, movies):
+    """ per_user more favorites for every user, skewed toward low (popular) ids. """
+
+    db.session.execute(db.text("""
+        INSERT INTO favorite_movies (id, title, user_id)
+        SELECT floor(:movies * power(random(), 3))::int + 1, 'Movie', user_id
+        FROM generate_series(1, :users) user_id, generate_series(1, :per_user)
+        ON CONFLICT (user_id, id) DO NOTHING
+    """), {'users': users, 'per_user': per_user, 'movies': movies})
+    db.session.commit()
+
+
+def timed_update(chunk_rows):
+    start = time.perf_counter()
+    consumed = co_favorites.update(chunk_rows)
+    return consumed['favorite_movies'], time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=50_000)
+    parser.add_argument('--per-user', type=int, default=20)
+    parser.add_argument('--movies', type=int, default=20_000)
+    parser.add_argument('--new', type=int, default=1, help='new favorites per user for the incremental run')
+    parser.add_argument('--chunk-rows', type=int, default=co_favorites.CHUNK_ROWS)
+    args = parser.parse_args()
+
+    with app.app_context():
+        seed(args.users, args.per_user, args.movies)
+        baseline_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+        rows, seconds = timed_update(args.chunk_rows)
+        pairs = db.session.execute(db.text("SELECT count(*) FROM movie_co_favorites")).scalar()
+        print(f'full update         {rows:,} favorites in {seconds:.1f}s ({rows / seconds:,.0f} rows/s), '
+              f'{pairs:,} co-favorite pairs')
+
+        add_favorites(args.users, args.new, args.movies)
+        rows, seconds = timed_update(args.chunk_rows)
+        print(f'incremental update  {rows:,} new favorites in {seconds:.2f}s ({rows / seconds:,.0f} rows/s)')
+
+        start = time.perf_counter()
+        for movie_id in range(1, 1001):
+            co_favorites.also_saved(movie_id)
+        print(f'also_saved          {(time.perf_counter() - start):.3f} ms per call (1,000 movies)')
+
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f'peak RSS            {peak_mb:,.0f} MB ({peak_mb - baseline_mb:+,.0f} MB during the updates)')
+
+
+if __name__ == '__main__':
+    main()
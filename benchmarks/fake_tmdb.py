@@ -0,0 +1,236 @@
+"""A stand-in TMDB API for load tests.
+
+Answers the endpoints the app calls from the fixtures in
+benchmarks/fixtures after a configurable delay, and can inject 5xx and
+429 responses, so a benchmark measures how the app waits on TMDB rather
+than TMDB itself.
+
+    python benchmarks/fake_tmdb.py --port 8765 --latency 0.15 --error-rate 0.01
+    TMDB_API_BASE_URL=http://127.0.0.1:8765/3/ gunicorn app:app
+
+Ids without a fixture of their own get a copy of the movie (603, The
+Matrix) or person (6384, Keanu Reeves) fixture under their own id and
+title. GET /__stats returns the calls served per endpoint and
+GET /__reset zeroes them.
+"""
+
+import os, re, copy, json, time, random, argparse, threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name + '.json')) as f:
+        return json.load(f)
+
+
+MOVIE = load_fixture('movie')
+PERSON = load_fixture('person')
+GENRES = load_fixture('genres')
+TRENDING = load_fixture('trending')
+DISCOVER = load_fixture('discover')
+SEARCH_MOVIE = load_fixture('search_movie')
+SEARCH_PERSON = load_fixture('search_person')
+
+# What append_to_response adds to the base movie resource
+APPENDED = ('videos', 'images', 'credits', 'watch/providers', 'reviews')
+
+# Every movie the list fixtures mention, so a card and its detail page agree
+MOVIES = {movie['id']: movie for movie in
+          TRENDING['results'] + DISCOVER['results'] + SEARCH_MOVIE['results'] + PERSON['movie_credits']['cast']}
+PEOPLE = {cast['id']: cast['name'] for cast in MOVIE['credits']['cast'] + MOVIE['credits']['crew']}
+
+
+def movie(id, full):
+    resp = copy.deepcopy(MOVIE)
+    if id != MOVIE['id']:
+        known = MOVIES.get(id, {})
+        resp.update(id=id,
+                    title=known.get('title', f'Movie {id}'),
+                    poster_path=known.get('poster_path', f'/fixture-poster-{id}.jpg'),
+                    popularity=known.get('popularity', 1 + id % 100),
+                    release_date=known.get('release_date', MOVIE['release_date']))
+        resp['images']['posters'] = [{'file_path': resp['poster_path']}] if resp['poster_path'] else []
+    if not full:
+        for key in APPENDED:
+            resp.pop(key)
+    return resp
+
+
+def person(id):
+    resp = copy.deepcopy(PERSON)
+    if id != PERSON['id']:
+        resp.update(id=id, name=PEOPLE.get(id, f'Person {id}'),
+                    profile_path=f'/fixture-profile-{id}.jpg')
+        resp['images']['profiles'] = [{'file_path': resp['profile_path']}]
+    return resp
+
+
+def discover(query):
+    genre = query.get('with_genres', [''])[0]
+    results = [movie for movie in DISCOVER['results'] if genre.isdigit() and int(genre) in movie['genre_ids']]
+    return dict(DISCOVER, results=results or DISCOVER['results'])
+
+
+def search_movie(query):
+    title = query.get('query', [''])[0].lower()
+    if title and title in 'the matrix':
+        return SEARCH_MOVIE
+    results = [movie for movie in MOVIES.values() if title and title in movie['title'].lower()]
+    return dict(SEARCH_MOVIE, results=results[:20], total_results=len(results))
+
+
+def search_person(query):
+    name = query.get('query', [''])[0].lower()
+    if name and name in 'keanu reeves':
+        return SEARCH_PERSON
+    return dict(SEARCH_PERSON, results=[], total_results=0)
+
+
+# (endpoint, path pattern, payload of a match and the parsed query string)
+# Older app versions sent movie/<id>% and person/<id>%; accept both
+ROUTES = [
+    ('movie', re.compile(r'/3/movie/(\d+)%?$'), lambda m, q: movie(int(m[1]), 'append_to_response' in q)),
+    ('person', re.compile(r'/3/person/(\d+)%?$'), lambda m, q: person(int(m[1]))),
+    ('discover', re.compile(r'/3/discover/movie$'), lambda m, q: discover(q)),
+    ('trending', re.compile(r'/3/trending/movie/week$'), lambda m, q: TRENDING),
+    ('genres', re.compile(r'/3/genre/movie/list$'), lambda m, q: GENRES),
+    ('search_movie', re.compile(r'/3/search/movie$'), lambda m, q: search_movie(q)),
+    ('search_person', re.compile(r'/3/search/person$'), lambda m, q: search_person(q)),
+]
+
+
+class Stats:
+    """ Calls served per endpoint, and the error responses among them. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.calls = Counter()
+            self.errors = Counter()
+
+    def record(self, endpoint, status):
+        with self.lock:
+            self.calls[endpoint] += 1
+            if status >= 400:
+                self.errors[status] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {'calls': sum(self.calls.values()),
+                    'endpoints': dict(self.calls),
+                    'errors': {str(status): n for status, n in self.errors.items()}}
+
+
+class Handler(BaseHTTPRequestHandler):
+    """ Route a GET to its fixture after the server's latency. """
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; don't let them wait on an ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        url = urlsplit(unquote(self.path))
+
+        if url.path == '/__stats':
+            return self.send_json(200, server.stats.snapshot())
+        if url.path == '/__reset':
+            server.stats.reset()
+            return self.send_json(200, {'reset': True})
+
+        time.sleep(server.latency + random.uniform(0, server.jitter))
+
+        for endpoint, pattern, payload in ROUTES:
+            match = pattern.match(url.path)
+            if match:
+                break
+        else:
+            server.stats.record('unknown', 404)
+            return self.send_json(404, {'success': False, 'status_code': 34,
+                                        'status_message': 'The resource you requested could not be found.'})
+
+        roll = random.random()
+        headers = {}
+        if roll < server.error_rate:
+            status, body = 500, {'success': False, 'status_code': 11,
+                                 'status_message': 'Internal error: Something went wrong, contact TMDb.'}
+        elif roll < server.error_rate + server.rate_limit_rate:
+            status, body = 429, {'success': False, 'status_code': 25,
+                                 'status_message': 'Your request count is over the allowed limit.'}
+            headers['Retry-After'] = '1'
+        else:
+            status, body = 200, payload(match, parse_qs(url.query))
+
+        server.stats.record(endpoint, status)
+        self.send_json(status, body, headers)
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_server(port=0, latency=0.15, jitter=0, error_rate=0, rate_limit_rate=0):
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.jitter = jitter
+    server.error_rate = error_rate
+    server.rate_limit_rate = rate_limit_rate
+    server.stats = Stats()
+
+    return server
+
+
+def serve(port=0, latency=0.15, **options):
+    """ Start the fake API on a background thread; returns the server. """
+
+    server = make_server(port, latency, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def add_arguments(parser):
+    """ The fake API's knobs, shared with the benchmarks that start one. """
+
+    parser.add_argument('--latency', type=float, default=0.15, help='seconds per TMDB response')
+    parser.add_argument('--jitter', type=float, default=0, help='up to this many extra seconds')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of 500 responses')
+    parser.add_argument('--rate-limit-rate', type=float, default=0, help='share of 429 responses')
+
+
+def options(args):
+    """ serve() keywords from parsed add_arguments() flags. """
+
+    return {'jitter': args.jitter, 'error_rate': args.error_rate, 'rate_limit_rate': args.rate_limit_rate}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = make_server(args.port, args.latency, **options(args))
+    print(f'Fake TMDB on http://127.0.0.1:{args.port}/3/ ({args.latency * 1000:.0f}ms per call)')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""Benchmark the FavoriteMovies/FavoriteCasts queries before and after
+migrations/001_favorite_indexes.sql.
+
+Seeds a scratch database with millions of favorites, times each route's
+query and prints its plan without the indexes, then applies the migration
+and does the same again.
+
+    createdb MoviesBox_bench
+    python benchmarks/favorite_indexes.py --rows 2000000
+
+The tables of the target database are dropped and recreated.
+"""
+
+import os, sys, time, argparse, statistics
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from models import db, User, FavoriteCasts, FavoriteMovies
+
+MIGRATION = os.path.join(os.path.dirname(__file__), '..', 'migrations', '001_favorite_indexes.sql')
+NEW_INDEXES = ['ix_favorite_movies_user_id_pk', 'ix_favorite_movies_id_pk_reviewed',
+               'ix_favorite_movies_pk_reviewed', 'ix_favorite_casts_user_id_pk']
+
+# The query behind each route, as the app issues it
+QUERIES = {
+    '/reviews/<id>': """SELECT * FROM favorite_movies
+                        WHERE id = :movie_id AND review IS NOT NULL
+                        ORDER BY pk DESC""",
+    '/users/<id>/reviews': """SELECT * FROM favorite_movies
+                              WHERE user_id = :user_id AND review IS NOT NULL
+                              ORDER BY pk DESC""",
+    '/favorite_movies': """SELECT * FROM favorite_movies
+                           WHERE user_id = :user_id
+                           ORDER BY pk DESC""",
+    '/favorite_casts': """SELECT * FROM favorite_casts
+                          WHERE user_id = :user_id
+                          ORDER BY pk DESC""",
+    '/all_reviews (newest 5)': """SELECT * FROM favorite_movies
+                                  WHERE review IS NOT NULL
+                                  ORDER BY pk DESC LIMIT 5""",
+}
+
+
+def seed(engine, rows, users, movies, review_ratio):
+    """ Recreate the tables without the new indexes and fill them. """
+
+    tables = [User.__table__, FavoriteCasts.__table__, FavoriteMovies.__table__]
+    db.metadata.drop_all(engine, tables=tables)
+    db.metadata.create_all(engine, tables=tables)
+
+    with engine.begin() as conn:
+        for name in NEW_INDEXES:
+            conn.execute(text(f'DROP INDEX IF EXISTS {name}'))
+
+        conn.execute(text("""INSERT INTO users (id, username, password, email)
+                             SELECT g, 'user' || g, 'x', 'user' || g || '@example.com'
+                             FROM generate_series(1, :users) g"""), {'users': users})
+
+        # g // users is distinct for each user, and 104729 is coprime with
+        # the movie id range, so (user_id, id) never repeats
+        conn.execute(text("""INSERT INTO favorite_movies (id, title, review, user_id)
+                             SELECT 1 + ((g / :users) * 104729 + (g % :users) * 7) % :movies,
+                                    'movie',
+                                    CASE WHEN random() < :ratio THEN 'a review' END,
+                                    1 + g % :users
+                             FROM generate_series(0, :rows - 1) g"""),
+                     {'users': users, 'movies': movies, 'rows': rows, 'ratio': review_ratio})
+
+        conn.execute(text("""INSERT INTO favorite_casts (id, name, user_id)
+                             SELECT 1 + ((g / :users) * 104729 + (g % :users) * 7) % :movies,
+                                    'cast', 1 + g % :users
+                             FROM generate_series(0, :rows / 4 - 1) g"""),
+                     {'users': users, 'movies': movies, 'rows': rows})
+
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(text('VACUUM ANALYZE'))
+
+
+def apply_migration(engine):
+    with open(MIGRATION) as f:
+        sql = '\n'.join(line for line in f if not line.lstrip().startswith('--'))
+
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        for statement in sql.split(';'):
+            if statement.strip():
+                conn.execute(text(statement))
+
+
+def measure(engine, params, repeat):
+    """ Median time in ms and the EXPLAIN ANALYZE plan of each query. """
+
+    results = {}
+    with engine.connect() as conn:
+        for route, sql in QUERIES.items():
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                conn.execute(text(sql), params).fetchall()
+                timings.append((time.perf_counter() - start) * 1000)
+
+            plan = conn.execute(text('EXPLAIN (ANALYZE, BUFFERS) ' + sql), params).scalars().all()
+            results[route] = (statistics.median(timings), plan)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=os.environ.get('BENCH_DATABASE_URL',
+                                                                 'postgresql:///MoviesBox_bench'))
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--movies', type=int, default=200_000)
+    parser.add_argument('--review-ratio', type=float, default=0.1)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--plans', action='store_true', help='print the full query plans')
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+
+    print(f'Seeding {args.rows:,} favorite movies for {args.users:,} users ...')
+    seed(engine, args.rows, args.users, args.movies, args.review_ratio)
+
+    with engine.connect() as conn:
+        movie_id = conn.execute(text("""SELECT id FROM favorite_movies WHERE review IS NOT NULL
+                                        GROUP BY id ORDER BY count(*) DESC LIMIT 1""")).scalar()
+    params = {'movie_id': movie_id, 'user_id': args.users // 2}
+
+    before = measure(engine, params, args.repeat)
+    apply_migration(engine)
+    after = measure(engine, params, args.repeat)
+
+    print(f"\n{'route':<28}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+    for route in QUERIES:
+        b, a = before[route][0], after[route][0]
+        print(f'{route:<28}{b:>12.2f}{a:>12.2f}{b / a:>9.1f}x')
+
+    for route in QUERIES:
+        print(f'\n== {route}')
+        for label, results in (('before', before), ('after', after)):
+            plan = results[route][1]
+            print(f'-- {label}')
+            print('\n'.join(plan if args.plans else plan[:1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""TMDB calls made by a burst of concurrent requests for one cold movie.
+
+Starts benchmarks/fake_tmdb.py and the app under gunicorn (app.yaml's
+worker setup), then repeatedly fires --burst simultaneous requests at
+/movie_detail/<id> and /reviews/<id> for a movie no worker has cached.
+Prints the TMDB calls each burst caused and the burst's latency, once
+per cache setup:
+
+    memory         per-worker cache
+    sqlite         cache shared by the workers
+    sqlite+lease   shared cache, workers wait on one another's fills
+
+    createdb MoviesBox_bench
+    python benchmarks/herd.py --burst 64 --bursts 20
+
+--app-dir runs another checkout (git worktree add) instead, for a
+before/after pair.
+"""
+
+import os, sys, signal, argparse, tempfile, subprocess, threading, time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(__file__))
+import fake_tmdb
+from async_views import wait_until_up, percentile
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+# Environment of each cache setup, by label
+SETUPS = {
+    'memory': {'TMDB_CACHE_BACKEND': 'memory'},
+    'sqlite': {'TMDB_CACHE_BACKEND': 'sqlite'},
+    'sqlite+lease': {'TMDB_CACHE_BACKEND': 'sqlite', 'TMDB_CACHE_LEASE': '5'},
+}
+
+
+def burst(base_url, movie_id, size):
+    """ size simultaneous requests for one movie; returns their latencies. """
+
+    paths = [f'/movie_detail/{movie_id}', f'/reviews/{movie_id}']
+    start = threading.Barrier(size)
+
+    def fetch(i):
+        start.wait()
+        began = time.perf_counter()
+        urllib.request.urlopen(base_url + paths[i % len(paths)], timeout=30).read()
+        return time.perf_counter() - began
+
+    with ThreadPoolExecutor(size) as pool:
+        return list(pool.map(fetch, range(size)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=os.environ.get('BENCH_DATABASE_URL',
+                                                                 'postgresql:///MoviesBox_bench'))
+    parser.add_argument('--burst', type=int, default=64)
+    parser.add_argument('--bursts', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--app-dir', default=ROOT, help='checkout of the app to run')
+    parser.add_argument('--setups', nargs='+', default=list(SETUPS), choices=list(SETUPS))
+    fake_tmdb.add_arguments(parser)
+    args = parser.parse_args()
+
+    tmdb = fake_tmdb.serve(latency=args.latency, **fake_tmdb.options(args))
+    base_url = f'http://127.0.0.1:{args.port}'
+
+    print(f'{"cache":<14}{"TMDB calls/burst":>18}{"p50 ms":>9}{"p99 ms":>9}')
+    for label in args.setups:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, **SETUPS[label],
+                       DATABASE_URL=args.database_url,
+                       TMDB_API_BASE_URL=f'http://127.0.0.1:{tmdb.server_port}/3/',
+                       TMDB_CACHE_PATH=os.path.join(tmp, 'cache.sqlite3'))
+            app = subprocess.Popen(['gunicorn', '-b', f'127.0.0.1:{args.port}', '-w', str(args.workers),
+                                    '-k', 'gthread', '--threads', '16', 'app:app'],
+                                   cwd=args.app_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_until_up(base_url)
+                # Warm every worker's thread pool and connections on another movie
+                for _ in range(3):
+                    burst(base_url, 1, args.burst)
+
+                calls, latencies = [], []
+                for movie_id in range(1000, 1000 + args.bursts):
+                    tmdb.stats.reset()
+                    latencies += burst(base_url, movie_id, args.burst)
+                    calls.append(tmdb.stats.snapshot()['calls'])
+            finally:
+                app.send_signal(signal.SIGTERM)
+                app.wait()
+
+        latencies.sort()
+        print(f'{label:<14}{sum(calls) / len(calls):>18.1f}{percentile(latencies, 0.5):>9.0f}'
+              f'{percentile(latencies, 0.99):>9.0f}')
+
+    tmdb.shutdown()
+
+
+if __name__ == '__main__':
+    main()
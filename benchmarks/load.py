@@ -0,0 +1,271 @@
+"""Load-test MoviesBox against the fake TMDB API.
+
+Seeds bench users with favorites and reviews, starts benchmarks/fake_tmdb.py
+and the app under gunicorn, then has logged-in clients drive a weighted mix
+of routes: homepage search by title and by cast, suggestions, genre
+suggestions, movie and cast detail, favorites and reviews. Prints req/s,
+p50/p95/p99 and errors per route, and the TMDB calls the app made.
+
+    createdb MoviesBox_bench
+    python benchmarks/load.py --duration 30 --concurrency 32 --json before.json
+    # ... change something ...
+    python benchmarks/load.py --duration 30 --concurrency 32 --compare before.json
+
+The tables of the target database are dropped and recreated. The response
+cache stays on unless --cache none is given, so repeated runs measure a
+warm worker.
+"""
+
+import os, re, sys, json, time, random, signal, argparse, threading, subprocess
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+import requests
+from sqlalchemy import create_engine, insert
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import fake_tmdb
+from models import db, User, FavoriteCasts, FavoriteMovies, MovieMetadata, CastMetadata
+from api_requests import IMAGE_BASE_URL
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+PASSWORD = 'benchpassword'
+
+MOVIE_IDS = sorted(fake_tmdb.MOVIES)
+CAST_IDS = sorted(fake_tmdb.PEOPLE)
+GENRE_IDS = [genre['id'] for genre in fake_tmdb.GENRES['genres']]
+SEARCHES = [('matrix', 'overview'), ('john wick', 'overview'), ('the', 'overview'), ('keanu', 'soup')]
+
+CSRF_RE = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+def seed(engine, users, favorites, review_ratio):
+    """ Recreate the tables and give every bench user favorites with fresh metadata. """
+
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+
+    password = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt()).decode()
+    now = time.strftime('%Y-%m-%d %H:%M:%S')
+
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{'id': n, 'username': f'bench{n}', 'password': password,
+                                     'email': f'bench{n}@example.com'} for n in range(1, users + 1)])
+
+        movies, casts = [], []
+        for n in range(1, users + 1):
+            for id in random.sample(MOVIE_IDS, min(favorites, len(MOVIE_IDS))):
+                review = 'A benchmark review of this movie.' if random.random() < review_ratio else None
+                movies.append({'id': id, 'title': fake_tmdb.MOVIES[id]['title'], 'review': review, 'user_id': n})
+            for id in random.sample(CAST_IDS, min(favorites, len(CAST_IDS))):
+                casts.append({'id': id, 'name': fake_tmdb.PEOPLE[id], 'user_id': n})
+        conn.execute(insert(FavoriteMovies), movies)
+        conn.execute(insert(FavoriteCasts), casts)
+
+        conn.execute(insert(MovieMetadata), [{'id': id, 'title': movie['title'],
+                                              'img_url': IMAGE_BASE_URL + (movie['poster_path'] or ''),
+                                              'popularity': movie['popularity'], 'refreshed_at': now}
+                                             for id, movie in fake_tmdb.MOVIES.items()])
+        conn.execute(insert(CastMetadata), [{'id': id, 'name': name, 'img_url': None, 'refreshed_at': now}
+                                            for id, name in fake_tmdb.PEOPLE.items()])
+
+
+class Client:
+    """ One logged-in browser session. """
+
+    def __init__(self, base_url, user_id):
+        self.base_url = base_url
+        self.user_id = user_id
+        self.session = requests.Session()
+
+        page = self.session.get(base_url + '/login')
+        self.csrf_token = CSRF_RE.search(page.text)[1]
+        res = self.session.post(base_url + '/login', allow_redirects=False,
+                                data={'username': f'bench{user_id}', 'password': PASSWORD,
+                                      'csrf_token': self.csrf_token})
+        if res.status_code != 302:
+            raise RuntimeError(f'bench{user_id} could not log in')
+        # /suggestions shows the last search, so have one on record
+        self.search()
+
+    def get(self, path):
+        return self.session.get(self.base_url + path, allow_redirects=False).status_code == 200
+
+    def search(self):
+        title, content = random.choice(SEARCHES)
+        res = self.session.post(self.base_url + '/homepage', allow_redirects=False,
+                                data={'movie_title': title, 'content': content,
+                                      'csrf_token': self.csrf_token})
+        return res.status_code == 302
+
+
+# (route, weight, request made by a client)
+SCENARIOS = [
+    ('homepage', 4, lambda c: c.get('/homepage')),
+    ('search', 4, lambda c: c.search()),
+    ('suggestions', 4, lambda c: c.get('/suggestions')),
+    ('genre', 3, lambda c: c.get(f'/genre_suggestions/{random.choice(GENRE_IDS)}')),
+    ('movie_detail', 6, lambda c: c.get(f'/movie_detail/{random.choice(MOVIE_IDS)}')),
+    ('cast_detail', 3, lambda c: c.get(f'/cast_detail/{random.choice(CAST_IDS)}')),
+    ('favorite_movies', 3, lambda c: c.get('/favorite_movies')),
+    ('favorite_casts', 2, lambda c: c.get('/favorite_casts')),
+    ('movie_reviews', 3, lambda c: c.get(f'/reviews/{random.choice(MOVIE_IDS)}')),
+    ('user_reviews', 2, lambda c: c.get(f'/users/{c.user_id}/reviews')),
+    ('all_reviews', 2, lambda c: c.get('/all_reviews')),
+]
+
+
+def drive(base_url, users, concurrency, duration, only=None):
+    """ Run the mix from concurrency clients; returns {route: (latencies, errors)}. """
+
+    scenarios = [s for s in SCENARIOS if not only or s[0] in only]
+    names, weights = [s[0] for s in scenarios], [s[1] for s in scenarios]
+    calls = {s[0]: s[2] for s in scenarios}
+
+    results = defaultdict(lambda: ([], [0]))
+    lock = threading.Lock()
+    clients = [Client(base_url, n % users + 1) for n in range(concurrency)]
+    deadline = time.time() + duration
+
+    def run(client):
+        local = defaultdict(lambda: ([], [0]))
+        while time.time() < deadline:
+            route = random.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                ok = calls[route](client)
+            except requests.RequestException:
+                ok = False
+            if ok:
+                local[route][0].append(time.perf_counter() - start)
+            else:
+                local[route][1][0] += 1
+        with lock:
+            for route, (latencies, errors) in local.items():
+                results[route][0].extend(latencies)
+                results[route][1][0] += errors[0]
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(run, clients))
+
+    return {route: (sorted(latencies), errors[0]) for route, (latencies, errors) in results.items()}
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000 if values else float('nan')
+
+
+def summarize(results, duration, tmdb_stats):
+    rows = {}
+    for route, (latencies, errors) in sorted(results.items()):
+        rows[route] = {'requests': len(latencies), 'rps': len(latencies) / duration, 'errors': errors,
+                       'p50': percentile(latencies, 0.50), 'p95': percentile(latencies, 0.95),
+                       'p99': percentile(latencies, 0.99)}
+
+    everything = sorted(l for latencies, _ in results.values() for l in latencies)
+    total = sum(row['requests'] for row in rows.values())
+    rows['total'] = {'requests': total, 'rps': total / duration,
+                     'errors': sum(row['errors'] for row in rows.values()),
+                     'p50': percentile(everything, 0.50), 'p95': percentile(everything, 0.95),
+                     'p99': percentile(everything, 0.99)}
+
+    return {'routes': rows, 'tmdb': dict(tmdb_stats, per_request=tmdb_stats['calls'] / max(total, 1))}
+
+
+def report(summary, baseline=None):
+    print(f"\n{'route':<18}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for route, row in summary['routes'].items():
+        line = (f"{route:<18}{row['rps']:>9.1f}{row['p50']:>9.0f}{row['p95']:>9.0f}"
+                f"{row['p99']:>9.0f}{row['errors']:>8}")
+        before = baseline and baseline['routes'].get(route)
+        if before:
+            line += f"   req/s {row['rps'] - before['rps']:+.1f}, p95 {row['p95'] - before['p95']:+.0f}ms"
+        print(line)
+
+    tmdb = summary['tmdb']
+    print(f"\nTMDB calls: {tmdb['calls']} ({tmdb['per_request']:.2f} per request)")
+    for endpoint, count in sorted(tmdb['endpoints'].items()):
+        print(f'  {endpoint:<16}{count:>8}')
+    if tmdb['errors']:
+        print(f"  injected errors: {tmdb['errors']}")
+    if baseline:
+        print(f"  baseline: {baseline['tmdb']['calls']} ({baseline['tmdb']['per_request']:.2f} per request)")
+
+
+def wait_until_up(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(base_url + '/login', timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f'app did not start on {base_url}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=os.environ.get('BENCH_DATABASE_URL',
+                                                                 'postgresql:///MoviesBox_bench'))
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=5, help='seconds driven before measuring')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--favorites', type=int, default=12, help='favorite movies and casts per user')
+    parser.add_argument('--review-ratio', type=float, default=0.5)
+    parser.add_argument('--routes', nargs='*', choices=[s[0] for s in SCENARIOS], help='only these routes')
+    parser.add_argument('--cache', default='memory', choices=['memory', 'sqlite', 'none'],
+                        help='TMDB_CACHE_BACKEND of the app')
+    parser.add_argument('--env', default='production', help='MOVIESBOX_ENV of the app')
+    parser.add_argument('--gunicorn', default='-w 4 -k gthread --threads 16', help='worker arguments')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--app-dir', default=ROOT, help='checkout of the app to run')
+    parser.add_argument('--json', help='write the results here')
+    parser.add_argument('--compare', help='results of an earlier --json run to diff against')
+    fake_tmdb.add_arguments(parser)
+    args = parser.parse_args()
+
+    print(f'Seeding {args.users} users with {args.favorites} favorites each ...')
+    seed(create_engine(args.database_url), args.users, args.favorites, args.review_ratio)
+
+    tmdb = fake_tmdb.serve(latency=args.latency, **fake_tmdb.options(args))
+    tmdb_url = f'http://127.0.0.1:{tmdb.server_port}'
+    env = dict(os.environ,
+               DATABASE_URL=args.database_url,
+               TMDB_API_BASE_URL=tmdb_url + '/3/',
+               TMDB_CACHE_BACKEND=args.cache,
+               MOVIESBOX_ENV=args.env)
+    base_url = f'http://127.0.0.1:{args.port}'
+
+    app = subprocess.Popen(['gunicorn', '-b', f'127.0.0.1:{args.port}', *args.gunicorn.split(), 'app:app'],
+                           cwd=args.app_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up(base_url)
+        if args.warmup:
+            drive(base_url, args.users, args.concurrency, args.warmup, args.routes)
+
+        requests.get(tmdb_url + '/__reset')
+        results = drive(base_url, args.users, args.concurrency, args.duration, args.routes)
+        summary = summarize(results, args.duration, requests.get(tmdb_url + '/__stats').json())
+    finally:
+        app.send_signal(signal.SIGTERM)
+        app.wait()
+        tmdb.shutdown()
+
+    summary['config'] = {key: value for key, value in vars(args).items() if key not in ('json', 'compare')}
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(summary, baseline)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Build time, size and query latency of the movie_recommender index.
+
+Generates a synthetic corpus of --movies titles (overviews drawn from a
+Zipf-distributed vocabulary, cast and directors from shared pools, so
+neighbors overlap the way real ones do), builds the index and times
+movie_suggestions over random ids.
+
+With --workers, that many fresh processes then open the index and query
+every movie, once with the arrays memory-mapped and once read into each
+process's heap, and report their memory from /proc/self/smaps_rollup.
+PSS splits shared pages between the processes that map them.
+
+    python benchmarks/recommender.py --movies 100000 --workers 4
+"""
+
+import os, sys, time, argparse, resource, tempfile, multiprocessing
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import movie_recommender
+from movie_recommender import ARRAYS, Recommender, build, save
+
+
+def synthetic_corpus(n, seed=0):
+    rng = np.random.default_rng(seed)
+    vocab = np.array([f'word{i}' for i in range(30_000)])
+    people = np.array([f'Person {i}' for i in range(n // 4 + 10)])
+    genres = np.array(['Action', 'Comedy', 'Drama', 'Horror', 'Romance', 'Thriller', 'Science Fiction',
+                       'Animation', 'Crime', 'Documentary', 'Family', 'Fantasy', 'History', 'Music'])
+
+    def zipf_words(size):
+        return vocab[np.minimum(rng.zipf(1.3, size), len(vocab)) - 1]
+
+    return pd.DataFrame({
+        'id': np.arange(1, n + 1),
+        'title': [f'Movie {i}' for i in range(1, n + 1)],
+        'overview': [' '.join(zipf_words(rng.integers(15, 60))) for _ in range(n)],
+        'genres': [list(rng.choice(genres, rng.integers(1, 4), replace=False)) for _ in range(n)],
+        'cast': [list(rng.choice(people, 5)) for _ in range(n)],
+        'director': [[people[rng.integers(len(people))]] for _ in range(n)],
+        'keywords': [list(zipf_words(4)) for _ in range(n)],
+        'popularity': rng.random(n) * 100,
+    })
+
+
+def smaps_rollup():
+    """ Rss, Pss and private memory of this process, in MB. """
+
+    fields = {}
+    with open('/proc/self/smaps_rollup') as smaps:
+        for line in smaps:
+            name, _, value = line.partition(':')
+            if value.strip().endswith('kB'):
+                fields[name] = int(value.split()[0]) / 1024
+    return fields['Rss'], fields['Pss'], fields['Private_Clean'] + fields['Private_Dirty']
+
+
+def open_and_query(directory, mmap, barrier):
+    """ Worker: open the index, query every movie, report memory once all workers have. """
+
+    # numpy imports its file format code lazily; keep that out of the timing
+    np.load(os.path.join(directory, 'ids.npy'), mmap_mode='r')
+
+    baseline = smaps_rollup()
+    start = time.perf_counter()
+    if mmap:
+        recommender = Recommender.load(directory)
+    else:
+        recommender = Recommender({name: np.load(os.path.join(directory, f'{name}.npy')) for name in ARRAYS})
+    load_seconds = time.perf_counter() - start
+
+    for id in recommender.ids:
+        recommender.movie_suggestions(id)
+    barrier.wait()
+    return load_seconds, [after - before for after, before in zip(smaps_rollup(), baseline)]
+
+
+def compare_workers(directory, workers):
+    context = multiprocessing.get_context('spawn')
+    for mmap in (True, False):
+        barrier = context.Manager().Barrier(workers)
+        with context.Pool(workers) as pool:
+            results = pool.starmap(open_and_query, [(directory, mmap, barrier)] * workers)
+        load_ms = max(load for load, _ in results) * 1000
+        rss, pss, private = (sum(values) / workers for values in zip(*(memory for _, memory in results)))
+        print(f'{"memory-mapped" if mmap else "read to heap ":13}  {workers} workers, per worker: open {load_ms:6.1f} ms, '
+              f'+RSS {rss:6.1f} MB, +PSS {pss:6.1f} MB, +private {private:6.1f} MB')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--movies', type=int, default=100_000)
+    parser.add_argument('--k', type=int, default=movie_recommender.TOP_K)
+    parser.add_argument('--queries', type=int, default=100_000)
+    parser.add_argument('--workers', type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = synthetic_corpus(args.movies)
+
+    start = time.perf_counter()
+    index = build(corpus, args.k)
+    build_seconds = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = save(index, tmp)
+        size_mb = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)) / 1e6
+
+        start = time.perf_counter()
+        recommender = Recommender.load(directory)
+        load_seconds = time.perf_counter() - start
+
+        ids = np.random.default_rng(1).integers(1, args.movies + 1, args.queries)
+        timings = np.empty(args.queries)
+        for i, id in enumerate(ids):
+            start = time.perf_counter()
+            recommender.movie_suggestions(id)
+            timings[i] = time.perf_counter() - start
+
+        dense_gb = args.movies ** 2 * 8 / 1e9
+        print(f'movies              {args.movies:,}')
+        print(f'build               {build_seconds:.1f}s, peak RSS {peak_mb:,.0f} MB '
+              f'(a dense float64 cosine matrix would be {dense_gb:,.1f} GB)')
+        print(f'index on disk       {size_mb:.1f} MB')
+        print(f'open                {load_seconds * 1000:.1f} ms')
+        print(f'movie_suggestions   p50 {np.percentile(timings, 50) * 1e6:.1f} us, '
+              f'p99 {np.percentile(timings, 99) * 1e6:.1f} us')
+
+        if args.workers:
+            compare_workers(directory, args.workers)
+
+
+if __name__ == '__main__':
+    main()
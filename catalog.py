@@ -0,0 +1,259 @@
+"""Local catalog of TMDB movies for title search.
+
+TMDB publishes a daily export of every movie id, one JSON object per line:
+
+    {"adult": false, "id": 603, "original_title": "The Matrix", "popularity": 81.2, "video": false}
+
+ingest() upserts such a file into catalog_movies and then drops the movies
+it no longer lists. The person export ({"id": 6384, "name": "Keanu Reeves",
+"popularity": 45.1, ...}) goes the same way into catalog_people, for the
+autocomplete endpoint.
+
+The export only has original titles, so 千と千尋の神隠し couldn't be found as
+Spirited Away. localize() records TMDB's en-US title next to it: the app
+passes it the titles of the movies it fetches anyway, and `flask catalog
+localize` fetches them for the most popular movies still without one.
+
+search() matches the words of either title with the table's GIN tsvector
+index, the last word as a prefix, and ranks the hits by popularity. The
+homepage then answers title searches without calling TMDB; it still asks
+TMDB when the catalog has no match (e.g. a misspelling).
+
+That query has to sort every GIN match before its LIMIT, which takes
+~100 ms for a common word in a large catalog, so search() first asks the
+in-memory autocomplete index (autocomplete.PrefixIndex) of the most
+popular movies, which answers in well under a millisecond; only texts
+none of those movies match reach the SQL query.
+
+    flask catalog ingest                       # yesterday's export from files.tmdb.org
+    flask catalog ingest movie_ids.json.gz     # a downloaded or fixture file
+    flask catalog ingest --kind person         # yesterday's person export
+    flask catalog localize                     # en-US titles of popular movies
+"""
+
+import re, io, gzip, json, datetime, logging, urllib.request
+from typing import NamedTuple, Optional
+import click
+from flask.cli import AppGroup
+from sqlalchemy.dialects.postgresql import insert
+
+from models import db, CatalogMovie, CatalogPerson
+from api_requests import fetch_many, movie_base_url
+from tmdb_client import get_json
+
+
+logger = logging.getLogger(__name__)
+
+EXPORT_URL = 'http://files.tmdb.org/p/exports/{kind}_ids_{date:%m_%d_%Y}.json.gz'
+# Rows upserted per statement
+BATCH_ROWS = 10_000
+# Results of a search
+SEARCH_LIMIT = 12
+# Movies `flask catalog localize` fetches per run, and per batch of updates
+LOCALIZE_LIMIT = 20_000
+LOCALIZE_BATCH = 500
+
+WORD_RE = re.compile(r'\w+')
+
+
+class Export(NamedTuple):
+    """ Where one kind of TMDB export is stored. """
+
+    model: type
+    # Name column of the model, and the export field it is read from
+    column: str
+    field: str
+    # GIN index to merge pending entries into after an ingest
+    gin_index: Optional[str] = None
+
+
+EXPORTS = {
+    'movie': Export(CatalogMovie, 'title', 'original_title', 'ix_catalog_movies_titles_tsv'),
+    'person': Export(CatalogPerson, 'name', 'name'),
+}
+
+
+def open_export(source):
+    """ The decompressed lines of an export, from a url or a local path. """
+
+    if re.match(r'https?://', source):
+        raw = urllib.request.urlopen(source, timeout=60)
+    else:
+        raw = open(source, 'rb')
+
+    if source.endswith('.gz'):
+        raw = gzip.GzipFile(fileobj=raw)
+    return io.TextIOWrapper(raw, encoding='utf-8')
+
+
+def export_rows(lines, exported_on, export=EXPORTS['movie']):
+    """ Catalog rows of an export's lines, leaving out adult entries. """
+
+    for line in lines:
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        if entry.get('adult') or not entry.get(export.field):
+            continue
+        yield {'id': entry['id'], export.column: entry[export.field],
+               'popularity': entry.get('popularity') or 0, 'exported_on': exported_on}
+
+
+def batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ingest(lines, exported_on=None, batch_rows=BATCH_ROWS, kind='movie'):
+    """ Upsert an export's movies (or people), then delete the ones it left out.
+
+    Each batch commits on its own, so a large export never sits in one
+    transaction or in memory. Returns (rows upserted, rows deleted). """
+
+    exported_on = exported_on or datetime.date.today()
+    export = EXPORTS[kind]
+    model = export.model
+
+    upserted = 0
+    for batch in batches(export_rows(lines, exported_on, export), batch_rows):
+        # One statement can't upsert an id twice
+        batch = list({row['id']: row for row in batch}.values())
+        statement = insert(model).values(batch)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=[model.id],
+            set_={export.column: statement.excluded[export.column],
+                  'popularity': statement.excluded.popularity,
+                  'exported_on': statement.excluded.exported_on}))
+        db.session.commit()
+        upserted += len(batch)
+
+    # Only after a complete read: a failed download must not empty the catalog
+    deleted = 0
+    if upserted:
+        deleted = model.query.filter(model.exported_on < exported_on).delete()
+        # Bulk upserts park new index entries in GIN's unsorted pending list,
+        # which every search then scans; merge them into the index now
+        if export.gin_index:
+            db.session.execute(db.text("SELECT gin_clean_pending_list(:index)"),
+                               {'index': export.gin_index})
+        db.session.commit()
+
+    logger.info('catalog ingest: %d %s rows upserted, %d deleted', upserted, kind, deleted)
+    return upserted, deleted
+
+
+def localize(titles):
+    """ Record {movie_id: en-US title} as the catalog movies' localized titles.
+
+    Rows that already have the title aren't written. Returns how many
+    changed. """
+
+    changed = 0
+    for id, title in titles.items():
+        changed += db.session.execute(db.text("""
+            UPDATE catalog_movies SET localized_title = :title
+            WHERE id = :id AND localized_title IS DISTINCT FROM :title
+        """), {'id': int(id), 'title': title}).rowcount
+    db.session.commit()
+
+    return changed
+
+
+def fetch_title(id):
+    """ TMDB's en-US title of a movie. """
+
+    return get_json(movie_base_url(id))['title']
+
+
+def localize_popular(limit=LOCALIZE_LIMIT, batch_rows=LOCALIZE_BATCH):
+    """ Fetch and record the titles of the limit most popular movies without
+    one. Returns (movies fetched, titles recorded). """
+
+    ids = [id for id, in db.session.query(CatalogMovie.id)
+                                   .filter(CatalogMovie.localized_title.is_(None))
+                                   .order_by(CatalogMovie.popularity.desc(), CatalogMovie.id)
+                                   .limit(limit)]
+
+    fetched = changed = 0
+    for batch in batches(ids, batch_rows):
+        # Movies TMDB fails to return are tried again next run
+        titles = fetch_many(fetch_title, batch)
+        fetched += len(titles)
+        changed += localize(titles)
+
+    logger.info('catalog localize: %d movies fetched, %d titles recorded', fetched, changed)
+    return fetched, changed
+
+
+def tsquery(text):
+    """ A to_tsquery() string matching every word of text, the last one as a prefix. """
+
+    words = WORD_RE.findall(text.lower())
+    if not words:
+        return None
+
+    return ' & '.join(words[:-1] + [words[-1] + ':*'])
+
+
+def search(text, limit=SEARCH_LIMIT, index=None):
+    """ {movie_id: title} of the most popular catalog movies matching text in
+    either title; movies are listed by their localized title once known.
+
+    index, a PrefixIndex of the catalog's most popular movies, is tried
+    before the database. """
+
+    query = tsquery(text)
+    if query is None:
+        return {}
+
+    if index is not None:
+        matches = dict(index.search(text, limit))
+        if matches:
+            return matches
+
+    rows = db.session.execute(db.text("""
+        SELECT id, coalesce(localized_title, title) FROM catalog_movies
+        WHERE to_tsvector('simple', title || ' ' || coalesce(localized_title, '')) @@ to_tsquery('simple', :query)
+        ORDER BY popularity DESC, id
+        LIMIT :limit
+    """), {'query': query, 'limit': limit})
+
+    return dict(rows.all())
+
+
+cli = AppGroup('catalog', help='Maintain the local movie and person catalog used by search and autocomplete.')
+
+
+@cli.command('ingest')
+@click.argument('source', required=False)
+@click.option('--kind', type=click.Choice(list(EXPORTS)), default='movie', show_default=True)
+@click.option('--date', 'exported_on', type=click.DateTime(['%Y-%m-%d']),
+              help='date of the export; defaults to yesterday')
+def ingest_command(source, kind, exported_on):
+    """ Load a TMDB movie or person id export (a url or a path, .json or .json.gz). """
+
+    # TMDB publishes a day's export during the morning UTC; yesterday's is always there
+    exported_on = exported_on.date() if exported_on else datetime.date.today() - datetime.timedelta(days=1)
+    source = source or EXPORT_URL.format(kind=kind, date=exported_on)
+
+    with open_export(source) as lines:
+        upserted, deleted = ingest(lines, exported_on, kind=kind)
+
+    click.echo(f'{upserted} {kind} rows upserted, {deleted} deleted')
+
+
+@cli.command('localize')
+@click.option('--limit', default=LOCALIZE_LIMIT, show_default=True,
+              help='most popular movies without a localized title to fetch')
+def localize_command(limit):
+    """ Fetch TMDB's en-US titles of the most popular movies that lack one. """
+
+    fetched, changed = localize_popular(limit)
+
+    click.echo(f'{fetched} movies fetched, {changed} titles recorded')
@@ -0,0 +1,237 @@
+"""Incremental "users who saved X also saved Y" counts and user taste profiles.
+
+update() folds favorites rows added since its last run into two tables:
+
+    movie_co_favorites  (movie_id, other_id) -> users who saved both
+    user_tastes         (user_id, feature) -> weight, where a feature is
+                        'genre:<id>' or 'person:<id>' from the user's
+                        favorite movies' metadata and favorite casts
+
+Each source table is consumed in keyset chunks of pk ranges. A chunk's
+upserts and its watermark move commit in one transaction, so a chunk is
+counted exactly once. All the work happens in SQL, so memory use does
+not depend on the table size. A new favorite is paired only with its
+user's rows of a lower pk; every pair is therefore counted once, when
+its second row arrives.
+
+The watermark row is locked with SKIP LOCKED, so every worker can run
+update() on a timer and only one of them works on a source at a time.
+
+Only inserts are tracked. Deleted favorites, and rows whose insert
+commits after a higher pk has been consumed, stay out of sync until
+`flask co-favorites rebuild`.
+"""
+
+import datetime, logging
+import click
+from flask.cli import AppGroup
+
+from models import db, FavoritesWatermark
+
+
+logger = logging.getLogger(__name__)
+
+# New favorites rows consumed per transaction
+CHUNK_ROWS = 5000
+
+
+# Every pair of a new movie with its user's earlier movies, both ways round
+MOVIE_PAIRS = """
+    WITH pairs AS (
+        SELECT added.id AS movie_id, earlier.id AS other_id
+        FROM favorite_movies added
+        JOIN favorite_movies earlier
+          ON earlier.user_id = added.user_id AND earlier.pk < added.pk
+        WHERE added.pk > :low AND added.pk <= :high
+    )
+    INSERT INTO movie_co_favorites (movie_id, other_id, count)
+    SELECT movie_id, other_id, count(*)
+    FROM (SELECT movie_id, other_id FROM pairs
+          UNION ALL
+          SELECT other_id, movie_id FROM pairs) both_ways
+    GROUP BY movie_id, other_id
+    -- Key order touches each index page once per chunk
+    ORDER BY movie_id, other_id
+    ON CONFLICT (movie_id, other_id)
+    DO UPDATE SET count = movie_co_favorites.count + excluded.count
+"""
+
+# Genres and directors of new movies, from their stored metadata
+MOVIE_TASTES = """
+    INSERT INTO user_tastes (user_id, feature, weight)
+    SELECT favorite.user_id, features.feature, count(*)
+    FROM favorite_movies favorite
+    JOIN movie_metadata metadata ON metadata.id = favorite.id
+    CROSS JOIN LATERAL (
+        SELECT 'genre:' || (genre ->> 'id')
+        FROM json_array_elements(CASE WHEN json_typeof(metadata.genres) = 'array'
+                                      THEN metadata.genres END) genre
+        UNION ALL
+        SELECT 'person:' || director
+        FROM json_object_keys(CASE WHEN json_typeof(metadata.director) = 'object'
+                                   THEN metadata.director END) director
+    ) features (feature)
+    WHERE favorite.pk > :low AND favorite.pk <= :high
+    GROUP BY favorite.user_id, features.feature
+    ON CONFLICT (user_id, feature)
+    DO UPDATE SET weight = user_tastes.weight + excluded.weight
+"""
+
+CAST_TASTES = """
+    INSERT INTO user_tastes (user_id, feature, weight)
+    SELECT user_id, 'person:' || id, count(*)
+    FROM favorite_casts
+    WHERE pk > :low AND pk <= :high
+    GROUP BY user_id, id
+    ON CONFLICT (user_id, feature)
+    DO UPDATE SET weight = user_tastes.weight + excluded.weight
+"""
+
+# Source table -> statements applied to each chunk of its new rows
+SOURCES = {
+    'favorite_movies': (MOVIE_PAIRS, MOVIE_TASTES),
+    'favorite_casts': (CAST_TASTES,),
+}
+
+
+def utcnow():
+    return datetime.datetime.utcnow()
+
+
+def ensure_watermarks():
+    db.session.execute(db.text("""
+        INSERT INTO favorites_watermarks (source, last_pk)
+        SELECT source, 0 FROM unnest(CAST(:sources AS text[])) source
+        ON CONFLICT (source) DO NOTHING
+    """), {'sources': list(SOURCES)})
+    db.session.commit()
+
+
+def consume_chunk(source, chunk_rows=CHUNK_ROWS):
+    """ Fold the next chunk_rows new rows of source into the tables.
+
+    Returns the number of rows consumed; 0 when there were none, or when
+    another process holds the source. """
+
+    try:
+        low = db.session.execute(db.text("""
+            SELECT last_pk FROM favorites_watermarks
+            WHERE source = :source
+            FOR UPDATE SKIP LOCKED
+        """), {'source': source}).scalar()
+        if low is None:
+            db.session.rollback()
+            return 0
+
+        # The table name comes from SOURCES, never from input
+        rows, high = db.session.execute(db.text(f"""
+            SELECT count(*), max(pk) FROM (
+                SELECT pk FROM {source} WHERE pk > :low ORDER BY pk LIMIT :limit
+            ) chunk
+        """), {'low': low, 'limit': chunk_rows}).one()
+        if not rows:
+            db.session.rollback()
+            return 0
+
+        for statement in SOURCES[source]:
+            db.session.execute(db.text(statement), {'low': low, 'high': high})
+
+        db.session.execute(db.update(FavoritesWatermark)
+                           .where(FavoritesWatermark.source == source)
+                           .values(last_pk=high, updated_at=utcnow()))
+        db.session.commit()
+
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return rows
+
+
+def update(chunk_rows=CHUNK_ROWS):
+    """ Consume every favorites row added since the last run; returns {source: rows}. """
+
+    ensure_watermarks()
+
+    consumed = {}
+    for source in SOURCES:
+        consumed[source] = 0
+        while rows := consume_chunk(source, chunk_rows):
+            consumed[source] += rows
+
+    if any(consumed.values()):
+        logger.info('co-favorites consumed %s', consumed)
+    return consumed
+
+
+def rebuild(chunk_rows=CHUNK_ROWS):
+    """ Recount both tables from every favorites row. """
+
+    ensure_watermarks()
+
+    # Holding every watermark keeps timed runs out until the reset commits
+    db.session.execute(db.text("SELECT source FROM favorites_watermarks FOR UPDATE"))
+    db.session.execute(db.text("TRUNCATE movie_co_favorites, user_tastes"))
+    db.session.execute(db.update(FavoritesWatermark).values(last_pk=0, updated_at=utcnow()))
+    db.session.commit()
+
+    return update(chunk_rows)
+
+
+def also_saved(movie_id, limit=12):
+    """ [(id, title, users)] of the movies most often saved along with movie_id. """
+
+    try:
+        movie_id = int(movie_id)
+    except (TypeError, ValueError):
+        return []
+
+    rows = db.session.execute(db.text("""
+        SELECT co.other_id, metadata.title, co.count
+        FROM movie_co_favorites co
+        JOIN movie_metadata metadata ON metadata.id = co.other_id
+        WHERE co.movie_id = :movie_id
+        ORDER BY co.count DESC, co.other_id DESC
+        LIMIT :limit
+    """), {'movie_id': movie_id, 'limit': limit})
+
+    return [tuple(row) for row in rows]
+
+
+def user_taste(user_id, limit=20):
+    """ [(feature, weight)] of a user's profile, heaviest first. """
+
+    rows = db.session.execute(db.text("""
+        SELECT feature, weight FROM user_tastes
+        WHERE user_id = :user_id
+        ORDER BY weight DESC, feature
+        LIMIT :limit
+    """), {'user_id': user_id, 'limit': limit})
+
+    return [tuple(row) for row in rows]
+
+
+def run_update(app):
+    """ update() inside an app context, for a PeriodicTask thread. """
+
+    with app.app_context():
+        update()
+
+
+cli = AppGroup('co-favorites', help='Maintain the "also saved" counts and taste profiles.')
+
+
+@cli.command('update')
+@click.option('--chunk-rows', default=CHUNK_ROWS, show_default=True)
+def update_command(chunk_rows):
+    """ Fold in favorites added since the last run. """
+
+    click.echo(update(chunk_rows))
+
+
+@cli.command('rebuild')
+@click.option('--chunk-rows', default=CHUNK_ROWS, show_default=True)
+def rebuild_command(chunk_rows):
+    """ Recount everything from scratch. """
+
+    click.echo(rebuild(chunk_rows))
@@ -0,0 +1,111 @@
+"""Configuration profiles, selected with MOVIESBOX_ENV (or FLASK_ENV).
+
+    production   the default: no SQL echo, pooled connections, INFO logs
+    development  SQL echo and DEBUG logs
+    testing      the MoviesBox_test database, no SQL echo
+"""
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def env_flag(name, default):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes', 'on')
+
+
+class Config:
+    """ Settings shared by every profile. """
+
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgresql:///MoviesBox_db')
+    SQLALCHEMY_ECHO = False
+    SECRET_KEY = os.environ.get('SECRET_KEY', "Chicken6768")
+
+    # Connection pool of each worker process; pre-ping and recycle drop
+    # connections the database or a proxy closed while they sat idle
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': env_int('DB_POOL_SIZE', 10),
+        'max_overflow': env_int('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': env_int('DB_POOL_TIMEOUT', 10),
+        'pool_recycle': env_int('DB_POOL_RECYCLE', 30 * 60),
+        'pool_pre_ping': True,
+    }
+
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    DEBUG_TOOLBAR = False
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+
+    # Seconds before locally stored movie/cast metadata is refreshed from TMDB
+    MOVIE_METADATA_MAX_AGE = env_int('MOVIE_METADATA_MAX_AGE', 7 * 24 * 60 * 60)
+    CAST_METADATA_MAX_AGE = env_int('CAST_METADATA_MAX_AGE', 30 * 24 * 60 * 60)
+    # Seconds a worker may reuse the logged-in user's navbar fields; 0 disables
+    IDENTITY_CACHE_TTL = env_int('IDENTITY_CACHE_TTL', 60)
+    REVIEW_SAMPLE_TTL = env_int('REVIEW_SAMPLE_TTL', 30)
+    # Root of the neighbor index built by movie_recommender.py; title search
+    # falls back to TMDB without it
+    RECOMMENDER_INDEX = os.environ.get('RECOMMENDER_INDEX', 'data/recommender')
+    # Seconds between each worker's runs of co_favorites.update(); 0 leaves
+    # it to `flask co-favorites update`
+    CO_FAVORITES_INTERVAL = env_int('CO_FAVORITES_INTERVAL', 0)
+    # Seconds between each worker's rebuilds of the autocomplete index, and
+    # the most popular movies (and people) it holds
+    AUTOCOMPLETE_INTERVAL = env_int('AUTOCOMPLETE_INTERVAL', 6 * 60 * 60)
+    AUTOCOMPLETE_SIZE = env_int('AUTOCOMPLETE_SIZE', 200_000)
+    # Seconds a search's results stay at /suggestions?key=, and a worker
+    # reuses the cards it rendered for them
+    SUGGESTION_TTL = env_int('SUGGESTION_TTL', 24 * 60 * 60)
+    SUGGESTION_CARD_TTL = env_int('SUGGESTION_CARD_TTL', 10 * 60)
+    # Seconds a worker and CDNs reuse the movie and cast pages rendered for
+    # visitors who aren't logged in (browsers revalidate them); 0 disables
+    PAGE_CACHE_TTL = env_int('PAGE_CACHE_TTL', 5 * 60)
+    # Directory of the resized TMDB images served at /images/
+    IMAGE_CACHE_DIR = os.environ.get('IMAGE_CACHE_DIR', 'data/images')
+    # Rows per page on the favorites and reviews lists, and the most ?limit= may ask for
+    PAGE_SIZE = env_int('PAGE_SIZE', 24)
+    MAX_PAGE_SIZE = env_int('MAX_PAGE_SIZE', 100)
+    # Bearer token Prometheus sends to scrape /metrics; unset, the route is a 404
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+
+class ProductionConfig(Config):
+    """ What app.yaml deploys. """
+
+
+class DevelopmentConfig(Config):
+    """ Local runs: every SQL statement and debug log line on the console. """
+
+    DEBUG = True
+    SQLALCHEMY_ECHO = env_flag('SQLALCHEMY_ECHO', True)
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'DEBUG')
+    # Needs Flask-DebugToolbar installed
+    DEBUG_TOOLBAR = env_flag('DEBUG_TOOLBAR', False)
+
+
+class TestingConfig(Config):
+    """ The unit tests. """
+
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgresql:///MoviesBox_test')
+
+
+CONFIGS = {
+    'production': ProductionConfig,
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+}
+
+
+def get_config(name=None):
+    """ The profile called name, else the one MOVIESBOX_ENV or FLASK_ENV names. """
+
+    name = name or os.environ.get('MOVIESBOX_ENV') or os.environ.get('FLASK_ENV') or 'production'
+
+    try:
+        return CONFIGS[name.lower()]
+    except KeyError:
+        raise ValueError(f"unknown config {name!r}, expected one of {', '.join(CONFIGS)}") from None
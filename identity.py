@@ -0,0 +1,69 @@
+"""Current-user identity for MoviesBox, with a short-lived per-worker cache.
+
+Pages only need a few read-only fields of the logged-in user (id, username,
+profile image) to render the navbar, so those are kept in a small TTL cache
+keyed by user id instead of loading the User row on every request. Routes
+that change or delete the user load the row themselves and invalidate the
+cached entry.
+"""
+
+import threading
+from cachetools import TTLCache
+
+from models import User
+
+
+class UserIdentity:
+    """ Read-only snapshot of the fields pages need from a User. """
+
+    __slots__ = ('id', 'username', 'email', 'image_profile')
+
+    def __init__(self, id, username, email, image_profile):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.image_profile = image_profile
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username, user.email, user.image_profile)
+
+    def __repr__(self):
+        return f'<UserIdentity {self.id} {self.username}>'
+
+
+class IdentityCache:
+    """ Per-worker cache of UserIdentity by user id; a ttl of 0 disables it.
+
+    Invalidation only reaches the worker that handled the change, so other
+    workers may show an old username or picture for up to ttl seconds. """
+
+    def __init__(self, ttl, maxsize=1024):
+        self.ttl = ttl
+        self._data = TTLCache(maxsize, ttl) if ttl > 0 else None
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """ Identity of a user, or None if the user doesn't exist. """
+
+        if self._data is not None:
+            with self._lock:
+                identity = self._data.get(user_id)
+            if identity is not None:
+                return identity
+
+        user = User.query.get(user_id)
+        if user is None:
+            return None
+
+        identity = UserIdentity.from_user(user)
+        if self._data is not None:
+            with self._lock:
+                self._data[user_id] = identity
+
+        return identity
+
+    def invalidate(self, user_id):
+        if self._data is not None:
+            with self._lock:
+                self._data.pop(user_id, None)
@@ -0,0 +1,125 @@
+"""Resized copies of TMDB posters and profile pictures, served from local disk.
+
+Pages link TMDB images through the `image` template filter, which turns
+
+    https://image.tmdb.org/t/p/w500/pB8BM7pdSp6B6Ih7QZ4DrQ3PmJK.jpg
+
+into /images/card/pB8BM7pdSp6B6Ih7QZ4DrQ3PmJK.jpg. The first request for a
+file fetches TMDB's w500 copy once into <root>/source; each size is then
+encoded on first use, as WebP for browsers that accept it and JPEG for the
+rest, into <root>/<size>/. TMDB names image files after their content, so
+a file name never shows different pixels and the responses can be cached
+by browsers for a year without revalidation.
+
+Files are written to a temporary name and renamed into place, so workers
+sharing the directory never see a partial file; two workers that miss the
+same file at once may both fetch it.
+"""
+
+import os, re, io, tempfile, threading
+from PIL import Image
+
+from tmdb_client import get_image
+
+
+SOURCE_URL = 'https://image.tmdb.org/t/p/w500/{name}'
+
+# Largest width and height of each size: cast lists, cards, detail pages
+IMAGE_SIZES = {
+    'thumb': (185, 278),
+    'card': (342, 513),
+    'detail': (500, 750),
+}
+# Extension -> (Pillow format, mimetype, save options)
+FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+# Seconds browsers may keep a served image
+MAX_AGE = 365 * 24 * 60 * 60
+
+NAME_RE = re.compile(r'^[A-Za-z0-9_-]+\.(?:jpg|jpeg|png)$')
+TMDB_IMAGE_RE = re.compile(r'^https://image\.tmdb\.org/t/p/\w+/+([A-Za-z0-9_-]+\.(?:jpg|jpeg|png))$')
+
+
+def image_name(url):
+    """ TMDB file name of an image url, or None for any other url. """
+
+    match = TMDB_IMAGE_RE.match(url or '')
+    return match.group(1) if match else None
+
+
+def resize(data, size, fmt):
+    """ data, an encoded image, scaled to fit size and encoded as fmt. """
+
+    format, _, options = FORMATS[fmt]
+
+    with Image.open(io.BytesIO(data)) as image:
+        image.thumbnail(IMAGE_SIZES[size], Image.LANCZOS)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        out = io.BytesIO()
+        image.save(out, format, **options)
+
+    return out.getvalue()
+
+
+def write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class ImageStore:
+    """ TMDB images and their resized variants under one directory. """
+
+    # Threads making the same file wait for each other, per stripe of names
+    STRIPES = 64
+
+    def __init__(self, root):
+        self.root = root
+        self._locks = [threading.Lock() for _ in range(self.STRIPES)]
+
+    def path(self, name, size, fmt):
+        return os.path.join(self.root, size, f'{os.path.splitext(name)[0]}.{fmt}')
+
+    def source(self, name):
+        """ Bytes of TMDB's copy of name, fetched on first use; None if TMDB has none. """
+
+        path = os.path.join(self.root, 'source', name)
+        try:
+            with open(path, 'rb') as file:
+                return file.read()
+        except FileNotFoundError:
+            pass
+
+        data = get_image(SOURCE_URL.format(name=name))
+        if data is not None:
+            write_atomic(path, data)
+        return data
+
+    def variant(self, name, size, fmt):
+        """ Path of name at size as fmt, made on first use; None if TMDB has no such image. """
+
+        path = self.path(name, size, fmt)
+        if os.path.exists(path):
+            return path
+
+        with self._locks[hash(name) % self.STRIPES]:
+            if os.path.exists(path):
+                return path
+
+            data = self.source(name)
+            if data is None:
+                return None
+            write_atomic(path, resize(data, size, fmt))
+
+        return path
@@ -0,0 +1,209 @@
+"""Per-request timing of TMDB calls and SQL queries.
+
+Each request gets a RequestStats in a context variable. TMDB fetches
+(sync and async) and SQLAlchemy cursor executions add their count and
+duration to it, including work fanned out to other threads or the TMDB
+event loop, as long as it runs in a copy of the request's context.
+Durations are summed per call, so parallel calls can add up to more than
+the request took.
+
+At the end of the request the totals go out in a Server-Timing header,
+unless the response is public and may be stored by a shared cache, and
+into per-endpoint histograms, served in the Prometheus text format
+by render_metrics(). Histograms are per worker process, and only a
+scraper holding the configured bearer token may read them (see
+metrics_authorized).
+"""
+
+import time, hmac, threading, contextvars
+from contextlib import contextmanager
+from flask import request, g
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# What is timed within a request, in Server-Timing order
+KINDS = ('tmdb', 'sql')
+
+# Histogram buckets: seconds, and counts per request
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+_current = contextvars.ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    """ Counts and seconds spent per kind of work within one request. """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.counts = dict.fromkeys(KINDS, 0)
+        self.seconds = dict.fromkeys(KINDS, 0.0)
+        self._lock = threading.Lock()
+
+    def add(self, kind, seconds):
+        with self._lock:
+            self.counts[kind] += 1
+            self.seconds[kind] += seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def server_timing(self):
+        """ Value of the Server-Timing header. """
+
+        parts = [f'{kind};dur={self.seconds[kind] * 1000:.1f};desc="{self.counts[kind]} calls"'
+                 for kind in KINDS]
+        parts.append(f'total;dur={self.elapsed() * 1000:.1f}')
+        return ', '.join(parts)
+
+
+def record(kind, seconds):
+    stats = _current.get()
+    if stats is not None:
+        stats.add(kind, seconds)
+
+
+@contextmanager
+def timed(kind):
+    """ Add the duration of the block to the current request's stats. """
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(kind, time.perf_counter() - start)
+
+
+class Histogram:
+    """ A Prometheus histogram with one label, endpoint. """
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, endpoint, value):
+        counts, total = self.series.get(endpoint, (None, None))
+        if counts is None:
+            counts, total = [0] * (len(self.buckets) + 1), [0.0]
+            self.series[endpoint] = counts, total
+
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        counts[-1] += 1
+        total[0] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for endpoint, (counts, total) in sorted(self.series.items()):
+            label = f'endpoint="{endpoint}"'
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {counts[-1]}')
+            lines.append(f'{self.name}_sum{{{label}}} {total[0]}')
+            lines.append(f'{self.name}_count{{{label}}} {counts[-1]}')
+        return lines
+
+
+class Metrics:
+    """ The per-endpoint histograms of this process. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.duration = Histogram('moviesbox_request_duration_seconds',
+                                  'Time spent serving a request.', DURATION_BUCKETS)
+        self.kind_seconds = {kind: Histogram(f'moviesbox_{kind}_duration_seconds',
+                                             f'Time spent on {kind} calls per request.', DURATION_BUCKETS)
+                             for kind in KINDS}
+        self.kind_counts = {kind: Histogram(f'moviesbox_{kind}_calls',
+                                            f'Number of {kind} calls per request.', COUNT_BUCKETS)
+                            for kind in KINDS}
+
+    def observe(self, endpoint, stats):
+        with self._lock:
+            self.duration.observe(endpoint, stats.elapsed())
+            for kind in KINDS:
+                self.kind_seconds[kind].observe(endpoint, stats.seconds[kind])
+                self.kind_counts[kind].observe(endpoint, stats.counts[kind])
+
+    def render(self):
+        with self._lock:
+            histograms = [self.duration, *self.kind_seconds.values(), *self.kind_counts.values()]
+            return '\n'.join(line for histogram in histograms for line in histogram.render()) + '\n'
+
+
+metrics = Metrics()
+
+
+def render_metrics():
+    """ This process's histograms in the Prometheus text format. """
+
+    return metrics.render()
+
+
+def metrics_authorized(token):
+    """ Does the current request carry token as its bearer token? Never, without a token. """
+
+    if not token:
+        return False
+
+    scheme, _, given = request.headers.get('Authorization', '').partition(' ')
+    return scheme.lower() == 'bearer' and hmac.compare_digest(given.encode(), token.encode())
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    record('sql', time.perf_counter() - conn.info['query_start'].pop())
+
+
+def _handle_error(context):
+    # A failed query never reaches after_cursor_execute; drop its start time
+    # so the next query on the connection isn't timed from it
+    starts = context.connection.info.get('query_start') if context.connection is not None else None
+    if starts:
+        record('sql', time.perf_counter() - starts.pop())
+
+
+def _start_request():
+    g._request_stats_token = _current.set(RequestStats())
+
+
+def _finish_request(response):
+    stats = _current.get()
+    if stats is not None:
+        # A shared cache would hand this request's timings to other visitors
+        if not response.cache_control.public:
+            response.headers['Server-Timing'] = stats.server_timing()
+        metrics.observe(request.endpoint or 'unmatched', stats)
+    return response
+
+
+def _reset_request(exc):
+    token = g.pop('_request_stats_token', None)
+    if token is not None:
+        _current.reset(token)
+
+
+def instrument_sql():
+    """ Time every SQL query of any engine. """
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+
+def instrument_app(app):
+    """ Time every request of app and every SQL query within it. """
+
+    instrument_sql()
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_reset_request)
@@ -0,0 +1,162 @@
+"""Local store of movie and person metadata for the favorites pages.
+
+Rows are written when a movie or person is added to favorites and refreshed
+in the background once older than the configured staleness window, so the
+favorites pages render from the database instead of one TMDB call per row.
+"""
+
+import datetime
+from flask import current_app
+
+from models import db, FavoriteMovies, FavoriteCasts, MovieMetadata, CastMetadata
+from api_requests import get_movie_details_many, fetch_many, get_cast_detail
+from pagination import keyset_paginate
+
+
+# Default staleness windows, in seconds
+MOVIE_METADATA_MAX_AGE = 7 * 24 * 60 * 60
+CAST_METADATA_MAX_AGE = 30 * 24 * 60 * 60
+
+
+def utcnow():
+    return datetime.datetime.utcnow()
+
+
+def is_stale(row, config_key, default):
+    max_age = current_app.config.get(config_key, default)
+    return row.refreshed_at < utcnow() - datetime.timedelta(seconds=max_age)
+
+
+def parse_release_date(release_date):
+    """ Turn get_movie_detail's 'Month DD, YYYY' back into a date. """
+
+    try:
+        return datetime.datetime.strptime(release_date, "%B %d, %Y").date()
+    except (TypeError, ValueError):
+        return None
+
+
+def save_movie_metadata(id, detail):
+    """ Insert or update the metadata of a movie from get_movie_detail's output. """
+
+    runtime = detail['runtime'] if isinstance(detail['runtime'], int) else None
+
+    return db.session.merge(MovieMetadata(
+        id=int(id),
+        title=detail['title'],
+        img_url=detail['img_url'],
+        popularity=detail['popularity'],
+        runtime=runtime,
+        genres=detail['genres'],
+        director={str(key): name for key, name in detail['director'].items()},
+        release_date=parse_release_date(detail['release_date']),
+        refreshed_at=utcnow(),
+    ))
+
+
+def save_cast_metadata(id, detail):
+    """ Insert or update the metadata of a person from get_cast_detail's output. """
+
+    return db.session.merge(CastMetadata(
+        id=int(id),
+        name=detail['name'],
+        img_url=detail['img_url'],
+        refreshed_at=utcnow(),
+    ))
+
+
+def movie_info(row):
+    """ The dict favorite_movies.html expects for one movie. """
+
+    release_date = row.release_date.strftime("%B %d, %Y") if row.release_date else 'Unknown'
+
+    return {
+        row.id: {
+            'title': row.title,
+            'img_url': row.img_url,
+            'popularity': row.popularity,
+            'runtime': row.runtime or "No information available.",
+            'genres': row.genres or [],
+            'director': row.director or {},
+            'release_date': release_date,
+        }
+    }
+
+
+def cast_info(row):
+    """ The dict favorite_casts.html expects for one person. """
+
+    return {
+        row.id: {
+            'name': row.name,
+            'img_url': row.img_url,
+        }
+    }
+
+
+def refresh_movie_metadata(ids):
+    """ Fetch movies from TMDB and store their metadata. """
+
+    rows = [save_movie_metadata(id, detail) for id, detail in get_movie_details_many(ids).items()]
+    info = {row.id: movie_info(row) for row in rows}
+    db.session.commit()
+
+    return info
+
+
+def refresh_cast_metadata(ids):
+    """ Fetch people from TMDB and store their metadata. """
+
+    rows = [save_cast_metadata(id, cast[id]) for id, cast in fetch_many(get_cast_detail, ids).items()]
+    info = {row.id: cast_info(row) for row in rows}
+    db.session.commit()
+
+    return info
+
+
+def favorites_info(favorite_model, metadata_model, user_id, to_info, refresh,
+                   max_age_key, max_age, queue, page_args):
+    """ One page of a user's favorites with their metadata, newest first.
+
+    The page is read with a single query. Rows never stored before are
+    fetched now; stale ones are served as they are and handed to the
+    background queue for a refresh. Only rows on the page are looked at. """
+
+    query = db.session.query(favorite_model.pk, favorite_model.id, metadata_model) \
+                      .outerjoin(metadata_model, metadata_model.id == favorite_model.id) \
+                      .filter(favorite_model.user_id == user_id)
+
+    page = keyset_paginate(query, favorite_model.pk, **(page_args or {}))
+    rows = [(row.id, row[2]) for row in page.items]
+
+    # Build the page data before any commit expires the loaded rows
+    info = {id: to_info(metadata) for id, metadata in rows if metadata is not None}
+    stale = [id for id, metadata in rows
+             if metadata is not None and is_stale(metadata, max_age_key, max_age)]
+    missing = [id for id, metadata in rows if metadata is None]
+
+    if missing:
+        info.update(refresh(missing))
+
+    if stale and queue is not None:
+        queue.submit(refresh, stale, key=(metadata_model.__tablename__, tuple(stale)))
+
+    page.items = [info[id] for id, metadata in rows if id in info]
+
+    return page
+
+
+def get_favorite_movies_info(user_id, queue=None, page_args=None):
+    """ A page of metadata of a user's favorite movies. """
+
+    return favorites_info(FavoriteMovies, MovieMetadata, user_id, movie_info,
+                          refresh_movie_metadata, 'MOVIE_METADATA_MAX_AGE',
+                          MOVIE_METADATA_MAX_AGE, queue, page_args)
+
+
+def get_favorite_casts_info(user_id, queue=None, page_args=None):
+    """ A page of metadata of a user's favorite casts. """
+
+    return favorites_info(FavoriteCasts, CastMetadata, user_id, cast_info,
+                          refresh_cast_metadata, 'CAST_METADATA_MAX_AGE',
+                          CAST_METADATA_MAX_AGE, queue, page_args)
@@ -0,0 +1,27 @@
+-- Local copies of TMDB movie and person details behind the favorites pages
+-- (metadata_store.py); co_favorites.py reads movie_metadata as well.
+--
+-- Apply with:  psql MoviesBox_db -f migrations/000_metadata.sql
+-- before 002_co_favorites.sql (numbered 000 so it sorts first). The tables
+-- start empty: favorites without a row are fetched from TMDB on first view.
+--
+-- Fresh databases get the same tables from db.create_all() (models.py).
+
+CREATE TABLE IF NOT EXISTS movie_metadata (
+    id           integer PRIMARY KEY,
+    title        text NOT NULL,
+    img_url      text,
+    popularity   double precision,
+    runtime      integer,
+    genres       json,
+    director     json,
+    release_date date,
+    refreshed_at timestamp NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS cast_metadata (
+    id           integer PRIMARY KEY,
+    name         text NOT NULL,
+    img_url      text,
+    refreshed_at timestamp NOT NULL
+);
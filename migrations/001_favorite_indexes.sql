@@ -0,0 +1,28 @@
+-- Indexes for the FavoriteMovies / FavoriteCasts access paths.
+--
+-- Apply with:  psql MoviesBox_db -f migrations/001_favorite_indexes.sql
+--
+-- CONCURRENTLY keeps the tables writable while the indexes build; it can't
+-- run inside a transaction, so don't wrap this file in BEGIN/COMMIT.
+-- Fresh databases get the same indexes from db.create_all() (models.py).
+
+-- favorite_movies, /users/<id>/reviews: WHERE user_id = ? ORDER BY pk DESC
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_favorite_movies_user_id_pk
+    ON favorite_movies (user_id, pk);
+
+-- /reviews/<id>: WHERE id = ? AND review IS NOT NULL ORDER BY pk DESC
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_favorite_movies_id_pk_reviewed
+    ON favorite_movies (id, pk)
+    WHERE review IS NOT NULL;
+
+-- /all_reviews: WHERE review IS NOT NULL ORDER BY pk DESC
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_favorite_movies_pk_reviewed
+    ON favorite_movies (pk)
+    WHERE review IS NOT NULL;
+
+-- favorite_casts: WHERE user_id = ? ORDER BY pk DESC
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_favorite_casts_user_id_pk
+    ON favorite_casts (user_id, pk);
+
+ANALYZE favorite_movies;
+ANALYZE favorite_casts;
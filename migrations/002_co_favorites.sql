@@ -0,0 +1,31 @@
+-- Tables of the "also saved" counts and user taste profiles (co_favorites.py).
+--
+-- Apply with:  psql MoviesBox_db -f migrations/002_co_favorites.sql
+-- after 000_metadata.sql, whose movie_metadata table the updates read,
+-- then fill them once with:  flask co-favorites rebuild
+--
+-- Fresh databases get the same tables from db.create_all() (models.py).
+
+CREATE TABLE IF NOT EXISTS favorites_watermarks (
+    source     text PRIMARY KEY,
+    last_pk    integer NOT NULL DEFAULT 0,
+    updated_at timestamp
+);
+
+CREATE TABLE IF NOT EXISTS movie_co_favorites (
+    movie_id integer NOT NULL,
+    other_id integer NOT NULL,
+    count    integer NOT NULL,
+    PRIMARY KEY (movie_id, other_id)
+);
+
+-- also_saved(): WHERE movie_id = ? ORDER BY count DESC, other_id DESC
+CREATE INDEX IF NOT EXISTS ix_movie_co_favorites_movie_id_count
+    ON movie_co_favorites (movie_id, count, other_id);
+
+CREATE TABLE IF NOT EXISTS user_tastes (
+    user_id integer NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    feature text NOT NULL,
+    weight  double precision NOT NULL,
+    PRIMARY KEY (user_id, feature)
+);
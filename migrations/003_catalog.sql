@@ -0,0 +1,17 @@
+-- Local movie catalog searched by title on the homepage (catalog.py).
+--
+-- Apply with:  psql MoviesBox_db -f migrations/003_catalog.sql
+-- then load it (daily) with:  flask catalog ingest
+--
+-- Fresh databases get the same table from db.create_all() (models.py).
+
+CREATE TABLE IF NOT EXISTS catalog_movies (
+    id          integer PRIMARY KEY,
+    title       text NOT NULL,
+    popularity  double precision NOT NULL DEFAULT 0,
+    exported_on date NOT NULL
+);
+
+-- search(): to_tsvector('simple', title) @@ to_tsquery('simple', ?)
+CREATE INDEX IF NOT EXISTS ix_catalog_movies_title_tsv
+    ON catalog_movies USING gin (to_tsvector('simple', title));
@@ -0,0 +1,13 @@
+-- People of TMDB's daily export, suggested by /autocomplete (catalog.py, autocomplete.py).
+--
+-- Apply with:  psql MoviesBox_db -f migrations/004_catalog_people.sql
+-- then load it (daily) with:  flask catalog ingest --kind person
+--
+-- Fresh databases get the same table from db.create_all() (models.py).
+
+CREATE TABLE IF NOT EXISTS catalog_people (
+    id          integer PRIMARY KEY,
+    name        text NOT NULL,
+    popularity  double precision NOT NULL DEFAULT 0,
+    exported_on date NOT NULL
+);
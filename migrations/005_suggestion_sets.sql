@@ -0,0 +1,15 @@
+-- Search results shown at /suggestions?key= (suggestion_store.py).
+--
+-- Apply with:  psql MoviesBox_db -f migrations/005_suggestion_sets.sql
+--
+-- Fresh databases get the same table from db.create_all() (models.py).
+
+CREATE TABLE IF NOT EXISTS suggestion_sets (
+    key       text PRIMARY KEY,
+    movie_ids json NOT NULL,
+    saved_at  timestamp NOT NULL
+);
+
+-- purge(): DELETE WHERE saved_at < ?
+CREATE INDEX IF NOT EXISTS ix_suggestion_sets_saved_at
+    ON suggestion_sets (saved_at);
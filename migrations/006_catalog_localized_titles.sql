@@ -0,0 +1,20 @@
+-- Localized (en-US) titles of catalog movies, searched together with the
+-- export's original titles (catalog.py).
+--
+-- Apply with:  psql MoviesBox_db -f migrations/006_catalog_localized_titles.sql
+-- then fill in the most popular movies' titles (daily, after the ingest) with:
+--     flask catalog localize
+-- Pages that fetch a movie from TMDB record its title as well.
+--
+-- CONCURRENTLY can't run inside a transaction, so don't wrap this file in
+-- BEGIN/COMMIT.
+-- Fresh databases get the same column and index from db.create_all() (models.py).
+
+ALTER TABLE catalog_movies ADD COLUMN IF NOT EXISTS localized_title text;
+
+-- search(): to_tsvector('simple', title || ' ' || coalesce(localized_title, '')) @@ to_tsquery('simple', ?)
+-- Built before the old index is dropped, so searches keep an index meanwhile.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_catalog_movies_titles_tsv
+    ON catalog_movies USING gin (to_tsvector('simple', title || ' ' || coalesce(localized_title, '')));
+
+DROP INDEX CONCURRENTLY IF EXISTS ix_catalog_movies_title_tsv;
@@ -1,5 +1,6 @@
 """SQLAlchemy models for MoviesBox."""
 
+import math, random
 from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import validates
@@ -115,6 +116,8 @@ class FavoriteCasts(db.Model):
     # However, different users can still add the same person to their favorite casts. 
     __table_args__ = (
         db.UniqueConstraint('user_id', 'id', name='uq_favorite_casts_user_id_id'),
+        # A user's casts, newest first
+        db.Index('ix_favorite_casts_user_id_pk', 'user_id', 'pk'),
     )
 
 
@@ -157,14 +160,343 @@ class  FavoriteMovies(db.Model):
             raise ValueError("movie id cannot be empty.")
         return value
 
+    # Tables with at most this many reviews are sampled from all their pks
+    SAMPLE_SCAN_LIMIT = 1000
+
+    @classmethod
+    def sample_reviewed(cls, k):
+        """ Pick up to k reviewed rows uniformly at random and return their pks.
+
+        Draws random pks between the lowest and highest reviewed one in the
+        database and keeps those that are reviewed rows, which every reviewed
+        row is equally likely to be. Each draw is sized from the planner's
+        row count of the partial ix_favorite_movies_pk_reviewed index to find
+        about twice the rows still missing, and probes that index once per
+        drawn pk, so its cost doesn't grow with the table; draws repeat,
+        larger each time, until k rows are found. Tables with few reviews are
+        read whole, and fewer than k reviews are all returned. """
+
+        if k <= 0:
+            return []
+
+        low, high = db.session.query(db.func.min(cls.pk), db.func.max(cls.pk)) \
+                              .filter(cls.review.isnot(None)) \
+                              .one()
+        if low is None:
+            return []
+
+        # -1 until the table is first analyzed
+        reviewed = db.session.execute(db.text(
+            "SELECT reltuples FROM pg_class WHERE relname = 'ix_favorite_movies_pk_reviewed'"
+        )).scalar() or -1
+
+        if reviewed <= cls.SAMPLE_SCAN_LIMIT:
+            pks = [pk for pk, in db.session.query(cls.pk)
+                                           .filter(cls.review.isnot(None))
+                                           .limit(cls.SAMPLE_SCAN_LIMIT + 1)]
+            if len(pks) <= cls.SAMPLE_SCAN_LIMIT:
+                return random.sample(pks, min(k, len(pks)))
+            # Stale statistics: there are at least this many
+            reviewed = len(pks)
+
+        picked = set()
+        span = high - low + 1
+        while len(picked) < k:
+            draws = math.ceil((k - len(picked)) * span / reviewed * 2)
+            if draws >= span:
+                # Fewer reviews than counted: read them all
+                pks = [pk for pk, in db.session.query(cls.pk).filter(cls.review.isnot(None))]
+                return random.sample(pks, min(k, len(pks)))
+
+            picked.update(db.session.execute(db.text("""
+                SELECT pk FROM favorite_movies
+                WHERE review IS NOT NULL AND pk = ANY(ARRAY(
+                    SELECT :low + floor(random() * :span)::int FROM generate_series(1, :draws)
+                ))
+            """), {'low': low, 'span': span, 'draws': draws}).scalars())
+            # Found too few: fewer reviews than counted, draw more
+            reviewed /= 2
+
+        return random.sample(sorted(picked), k)
+
     # With this unique constraint in place, the same user is not be able to add the same movie multiple times. 
     # However, different users can still add the same film to their favorite movies. 
+    # The other indexes follow the pages' access paths; see migrations/001_favorite_indexes.sql.
     __table_args__ = (
         db.UniqueConstraint('user_id', 'id', name='uq_favorite_movies_user_id_id'),
+        # A user's movies and reviews, newest first
+        db.Index('ix_favorite_movies_user_id_pk', 'user_id', 'pk'),
+        # Reviews of one movie, newest first
+        db.Index('ix_favorite_movies_id_pk_reviewed', 'id', 'pk',
+                 postgresql_where=db.text('review IS NOT NULL')),
+        # All reviewed rows by pk
+        db.Index('ix_favorite_movies_pk_reviewed', 'pk',
+                 postgresql_where=db.text('review IS NOT NULL')),
     )
 
     user = db.relationship('User')
 
+##########################################################################
+class MovieMetadata(db.Model):
+    """ Local copy of a movie's TMDB details, shared by all users' favorites. """
+
+    __tablename__ = 'movie_metadata'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    title = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    img_url = db.Column(
+        db.Text,
+    )
+
+    popularity = db.Column(
+        db.Float,
+        default=0,
+    )
+
+    runtime = db.Column(
+        db.Integer,
+    )
+
+    genres = db.Column(
+        db.JSON,
+        default=list,
+    )
+
+    director = db.Column(
+        db.JSON,
+        default=dict,
+    )
+
+    release_date = db.Column(
+        db.Date,
+    )
+
+    refreshed_at = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+
+
+##########################################################################
+class CastMetadata(db.Model):
+    """ Local copy of a person's TMDB details, shared by all users' favorites. """
+
+    __tablename__ = 'cast_metadata'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    name = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    img_url = db.Column(
+        db.Text,
+    )
+
+    refreshed_at = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+
+
+##########################################################################
+class FavoritesWatermark(db.Model):
+    """ The last favorites row co_favorites.py has folded in, per source table. """
+
+    __tablename__ = 'favorites_watermarks'
+
+    source = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    last_pk = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    updated_at = db.Column(
+        db.DateTime,
+    )
+
+
+
+##########################################################################
+class MovieCoFavorite(db.Model):
+    """ How many users saved both movie_id and other_id; stored both ways round. """
+
+    __tablename__ = 'movie_co_favorites'
+
+    movie_id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    other_id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    count = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        # The most co-saved movies of one movie
+        db.Index('ix_movie_co_favorites_movie_id_count', 'movie_id', 'count', 'other_id'),
+    )
+
+
+
+##########################################################################
+class UserTaste(db.Model):
+    """ One weighted feature of a user's taste profile, e.g. 'genre:878' or 'person:6384'. """
+
+    __tablename__ = 'user_tastes'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    feature = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    weight = db.Column(
+        db.Float,
+        nullable=False,
+    )
+
+
+
+##########################################################################
+class CatalogMovie(db.Model):
+    """ One movie of TMDB's daily id export, searched by title on the homepage. """
+
+    __tablename__ = 'catalog_movies'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    # The export's original_title
+    title = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    # TMDB's title in the app's language (en-US), which the export lacks;
+    # NULL until catalog.localize() records it
+    localized_title = db.Column(
+        db.Text,
+    )
+
+    popularity = db.Column(
+        db.Float,
+        nullable=False,
+        default=0,
+    )
+
+    # Date of the last export that listed the movie
+    exported_on = db.Column(
+        db.Date,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        # No popularity index on purpose: with one, the planner walks it for
+        # ORDER BY popularity LIMIT and filters rows, which takes seconds
+        # when a word pair is rarer than it estimates.
+        # Words of both titles; catalog.search() queries the same expression
+        db.Index('ix_catalog_movies_titles_tsv',
+                 db.text("to_tsvector('simple', title || ' ' || coalesce(localized_title, ''))"),
+                 postgresql_using='gin'),
+    )
+
+
+
+##########################################################################
+class CatalogPerson(db.Model):
+    """ One person of TMDB's daily id export, suggested by the autocomplete endpoint. """
+
+    __tablename__ = 'catalog_people'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    name = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    popularity = db.Column(
+        db.Float,
+        nullable=False,
+        default=0,
+    )
+
+    # Date of the last export that listed the person
+    exported_on = db.Column(
+        db.Date,
+        nullable=False,
+    )
+
+
+
+##########################################################################
+class SuggestionSet(db.Model):
+    """ The movie ids of one search's results, shown at /suggestions?key=. """
+
+    __tablename__ = 'suggestion_sets'
+
+    # Hash of movie_ids (suggestion_store.set_key)
+    key = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    movie_ids = db.Column(
+        db.JSON,
+        nullable=False,
+    )
+
+    # Last time a search produced the set; it expires SUGGESTION_TTL later
+    saved_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        index=True,
+    )
+
+
+
 ##########################################################################
 def connect_db(app):
     """Connect this database to provided Flask app."""
@@ -0,0 +1,407 @@
+"""Content-based movie recommendations from a precomputed neighbor index.
+
+Offline, build() turns a movie corpus into two sets of features:
+- TF-IDF over each overview
+- a "soup" of genres, top cast, director and keywords
+It keeps the K most similar movies of every movie. Similarities are
+computed one block of rows at a time, so the dense N x N cosine matrix
+never exists and the build scales to hundreds of thousands of titles.
+
+An index is saved as a directory of .npy arrays (ids sorted, int32
+neighbor rows, float32 scores, titles as one UTF-8 blob plus offsets).
+The arrays are memory-mapped, not read. Opening an index therefore takes
+the same time at any size, and every gunicorn worker shares the same
+pages of the OS page cache; a worker's resident memory does not grow by
+a copy of the index.
+
+Each build is written to a new version directory under the index root,
+then published by atomically repointing the root's `current` symlink.
+get_recommender() notices the new target on its next call. Workers still
+reading the old version keep a valid mapping, because unlinked files
+live on until they are unmapped.
+
+    python movie_recommender.py build corpus.csv data/recommender
+
+The corpus is a CSV with the columns id, title, overview, genres, cast,
+director, keywords and popularity; list columns are '|' separated.
+"""
+
+import os, re, sys, json, time, bisect, shutil, argparse, logging, threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Neighbors kept per movie
+TOP_K = 30
+# Cast members of a movie that go into its soup
+SOUP_CAST = 3
+# Relative weight of the overview and soup features in the similarity
+OVERVIEW_WEIGHT = 0.5
+SOUP_WEIGHT = 0.5
+# Working memory of one block of rows in a build; each similarity costs
+# about 16 bytes between the sparse product, its dense copy and the
+# argpartition indices
+BLOCK_BYTES = 512 * 1024 * 1024
+BYTES_PER_SIMILARITY = 16
+
+LIST_COLUMNS = ('genres', 'cast', 'director', 'keywords')
+
+# On-disk layout of a version directory; bumped when it changes
+FORMAT = 1
+# Versions kept under an index root, the current one included
+KEEP_VERSIONS = 3
+ARRAYS = ('ids', 'neighbors', 'scores', 'titles', 'title_offsets', 'keys', 'key_offsets', 'key_rows')
+
+
+def load_corpus(path):
+    """ The corpus CSV as a DataFrame with list columns split and blanks filled. """
+
+    # Build-time dependencies are imported here, so web workers that only
+    # serve suggestions never load pandas, scipy or scikit-learn
+    import pandas as pd
+
+    corpus = pd.read_csv(path, dtype={'id': np.int64}, keep_default_na=False)
+    corpus = corpus.drop_duplicates('id').reset_index(drop=True)
+
+    for column in LIST_COLUMNS:
+        if column not in corpus:
+            corpus[column] = ''
+        corpus[column] = corpus[column].astype(str).map(lambda value: [v for v in value.split('|') if v])
+    if 'popularity' not in corpus:
+        corpus['popularity'] = 0.0
+    corpus['overview'] = corpus['overview'].astype(str)
+
+    return corpus
+
+
+def soup_token(name):
+    """ One token per name, so 'Keanu Reeves' never matches 'Keanu Smith'. """
+
+    return re.sub(r'\W+', '', name.lower())
+
+
+def make_soup(movie):
+    names = (movie['genres'] + movie['cast'][:SOUP_CAST] + movie['director'] * 2 + movie['keywords'])
+    return ' '.join(soup_token(name) for name in names)
+
+
+def feature_matrix(corpus):
+    """ L2-normalized rows whose dot products are the weighted cosine similarities. """
+
+    from scipy import sparse
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.preprocessing import normalize
+
+    overview = TfidfVectorizer(stop_words='english', sublinear_tf=True, min_df=2, max_df=0.5,
+                               max_features=200_000, dtype=np.float32)
+    soup = TfidfVectorizer(token_pattern=r'\S+', min_df=1, dtype=np.float32)
+
+    blocks = []
+    for weight, vectorizer, texts in ((OVERVIEW_WEIGHT, overview, corpus['overview']),
+                                      (SOUP_WEIGHT, soup, corpus.apply(make_soup, axis=1))):
+        try:
+            blocks.append(normalize(vectorizer.fit_transform(texts)) * np.sqrt(weight))
+        except ValueError:
+            # Every document empty, or min_df left no terms (tiny corpora)
+            logger.warning('no %s features', 'overview' if vectorizer is overview else 'soup')
+
+    return normalize(sparse.hstack(blocks, format='csr'))
+
+
+def top_k_neighbors(features, k, block_bytes=BLOCK_BYTES):
+    """ Row indices and scores of the k most similar rows of each row, best first.
+
+    Rows are scored against the whole matrix one block at a time; a block
+    is sized so scoring it fits in block_bytes. """
+
+    n = features.shape[0]
+    k = max(0, min(k, n - 1))
+    block = max(1, block_bytes // (BYTES_PER_SIMILARITY * max(n, 1)))
+    transposed = features.T.tocsc()
+
+    neighbors = np.empty((n, k), dtype=np.int32)
+    scores = np.empty((n, k), dtype=np.float32)
+    if k == 0:
+        return neighbors, scores
+
+    for start in range(0, n, block):
+        stop = min(start + block, n)
+        sims = (features[start:stop] @ transposed).toarray().astype(np.float32, copy=False)
+        # Never recommend a movie for itself
+        sims[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+
+        top = np.argpartition(sims, n - k, axis=1)[:, n - k:] if k < n - 1 else np.argsort(sims, axis=1)[:, 1:]
+        top_scores = np.take_along_axis(sims, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+
+        neighbors[start:stop] = np.take_along_axis(top, order, axis=1)
+        scores[start:stop] = np.take_along_axis(top_scores, order, axis=1)
+
+    return neighbors, scores
+
+
+def build(corpus, k=TOP_K, block_bytes=BLOCK_BYTES):
+    """ The neighbor index of a corpus, as a dict of arrays. """
+
+    features = feature_matrix(corpus)
+    neighbors, scores = top_k_neighbors(features, k, block_bytes)
+
+    return {
+        'ids': corpus['id'].to_numpy(np.int64),
+        'titles': corpus['title'].astype(str).to_numpy(dtype=object),
+        'popularity': corpus['popularity'].astype(np.float32).to_numpy(),
+        'neighbors': neighbors,
+        'scores': scores,
+    }
+
+
+def pack_strings(strings):
+    """ strings as one UTF-8 blob and the offsets of each string in it. """
+
+    encoded = [string.encode() for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(data) for data in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def index_arrays(index):
+    """ The arrays of a version directory, rows in id order. """
+
+    order = np.argsort(index['ids'], kind='stable')
+    position = np.empty_like(order)
+    position[order] = np.arange(len(order))
+
+    titles = [str(title) for title in index['titles'][order]]
+    popularity = index['popularity'][order]
+
+    # Normalized titles, sorted, for find(); the most popular movie wins
+    # a shared title
+    best = {}
+    for row in np.argsort(-popularity, kind='stable'):
+        best.setdefault(normalize_title(titles[row]), int(row))
+    keys = sorted(best)
+
+    arrays = {
+        'ids': index['ids'][order].astype(np.int64),
+        'neighbors': position[index['neighbors'][order]].astype(np.int32),
+        'scores': index['scores'][order].astype(np.float32),
+        'key_rows': np.array([best[key] for key in keys], dtype=np.int32),
+    }
+    arrays['titles'], arrays['title_offsets'] = pack_strings(titles)
+    arrays['keys'], arrays['key_offsets'] = pack_strings(keys)
+
+    return arrays
+
+
+def save(index, root, keep=KEEP_VERSIONS):
+    """ Write index as a new version under root and make it the current one.
+
+    Returns the version directory. """
+
+    versions = os.path.join(root, 'versions')
+    os.makedirs(versions, exist_ok=True)
+
+    # Names sort by build time
+    version = f"{time.strftime('%Y%m%dT%H%M%S')}.{time.time_ns() % 10 ** 9:09d}"
+    tmp = os.path.join(versions, f'.{version}.tmp')
+    os.makedirs(tmp)
+
+    arrays = index_arrays(index)
+    for name in ARRAYS:
+        np.save(os.path.join(tmp, f'{name}.npy'), arrays[name])
+    with open(os.path.join(tmp, 'manifest.json'), 'w') as manifest:
+        json.dump({'format': FORMAT, 'movies': len(arrays['ids']),
+                   'k': arrays['neighbors'].shape[1]}, manifest)
+
+    directory = os.path.join(versions, version)
+    os.rename(tmp, directory)
+
+    # A symlink can't be overwritten in place, but rename() over one is atomic
+    link = os.path.join(root, f'.current.{os.getpid()}')
+    os.symlink(os.path.join('versions', version), link)
+    os.replace(link, os.path.join(root, 'current'))
+
+    prune(root, keep)
+    return directory
+
+
+def prune(root, keep=KEEP_VERSIONS):
+    """ Remove all but the keep newest versions under root, never the current one. """
+
+    versions = os.path.join(root, 'versions')
+    current = current_version(root)
+    names = sorted((name for name in os.listdir(versions) if not name.startswith('.')), reverse=True)
+
+    for name in names[keep:]:
+        if name != current:
+            shutil.rmtree(os.path.join(versions, name), ignore_errors=True)
+
+
+def current_version(root):
+    """ Name of the version root's current symlink points to, or None. """
+
+    try:
+        return os.path.basename(os.readlink(os.path.join(root, 'current')))
+    except OSError:
+        return None
+
+
+class Strings:
+    """ A read-only sequence over a blob and offsets written by pack_strings. """
+
+    def __init__(self, blob, offsets):
+        self.blob = memoryview(blob)
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return str(self.blob[self.offsets[i]:self.offsets[i + 1]], 'utf-8')
+
+    def take(self, rows):
+        """ The strings at rows, as a list. """
+
+        starts, ends = self.offsets[rows].tolist(), self.offsets[rows + 1].tolist()
+        return [str(self.blob[start:end], 'utf-8') for start, end in zip(starts, ends)]
+
+
+class Recommender:
+    """ A memory-mapped neighbor index. """
+
+    def __init__(self, arrays):
+        self.ids = arrays['ids']
+        self.neighbors = arrays['neighbors']
+        self.scores = arrays['scores']
+        self.titles = Strings(arrays['titles'], arrays['title_offsets'])
+        self.keys = Strings(arrays['keys'], arrays['key_offsets'])
+        self.key_rows = arrays['key_rows']
+
+    @classmethod
+    def load(cls, directory):
+        """ Map the index in a version directory; nothing is read up front. """
+
+        with open(os.path.join(directory, 'manifest.json')) as manifest:
+            format = json.load(manifest).get('format')
+        if format != FORMAT:
+            raise ValueError(f'index format {format}, expected {FORMAT}')
+
+        # Plain ndarray views of the maps: indexing an np.memmap costs several
+        # times more, and the views keep the mappings open
+        return cls({name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r').view(np.ndarray)
+                    for name in ARRAYS})
+
+    def row(self, id):
+        row = int(np.searchsorted(self.ids, id))
+        return row if row < len(self.ids) and self.ids[row] == id else None
+
+    def __contains__(self, id):
+        return self.row(int(id)) is not None
+
+    def title(self, id):
+        row = self.row(int(id))
+        if row is None:
+            raise KeyError(id)
+        return self.titles[row]
+
+    def find(self, title):
+        """ Id of the movie called title, or None. """
+
+        key = normalize_title(title)
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return int(self.ids[self.key_rows[i]])
+        return None
+
+    def movie_suggestions(self, id, limit=12, min_score=0.0):
+        """ {movie_id: title} of the movies most similar to id, best first. """
+
+        row = self.row(int(id))
+        if row is None:
+            return {}
+
+        # Scores are sorted, so the first one at or below min_score ends the list
+        scores = self.scores[row]
+        count = min(limit, int(np.count_nonzero(scores > min_score)))
+        rows = self.neighbors[row, :count]
+
+        return dict(zip(self.ids[rows].tolist(), self.titles.take(rows)))
+
+
+def normalize_title(title):
+    return ' '.join(re.sub(r'[^\w\s]', ' ', str(title).lower()).split())
+
+
+_recommender = None
+_recommender_version = None
+_recommender_lock = threading.Lock()
+
+
+def get_recommender(root):
+    """ The current index under root, or None if there is none.
+
+    The current symlink is read on every call, so a newly published
+    version is picked up without restarting the worker. A version that
+    fails to load is not recorded, so the next call tries it again; the
+    version loaded before it keeps being served meanwhile. """
+
+    global _recommender, _recommender_version
+
+    version = (root, current_version(root))
+    if version != _recommender_version:
+        with _recommender_lock:
+            if version != _recommender_version:
+                if version[1] is None:
+                    logger.warning('no recommender index at %s; using TMDB search', root)
+                    _recommender, _recommender_version = None, version
+                else:
+                    try:
+                        recommender = Recommender.load(os.path.join(root, 'current'))
+                    except (OSError, ValueError):
+                        logger.warning('unreadable recommender index at %s; retrying on the next call',
+                                       root, exc_info=True)
+                        if _recommender_version is None or _recommender_version[0] != root:
+                            _recommender = None
+                    else:
+                        _recommender, _recommender_version = recommender, version
+
+    return _recommender
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = sub.add_parser('build', help='build the neighbor index of a corpus')
+    build_parser.add_argument('corpus')
+    build_parser.add_argument('root', help='index root; the build becomes its current version')
+    build_parser.add_argument('--k', type=int, default=TOP_K)
+    build_parser.add_argument('--keep', type=int, default=KEEP_VERSIONS, help='versions to keep')
+
+    query_parser = sub.add_parser('query', help='show the suggestions for a title')
+    query_parser.add_argument('root')
+    query_parser.add_argument('title')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        corpus = load_corpus(args.corpus)
+        index = build(corpus, args.k)
+        directory = save(index, args.root, args.keep)
+        logger.info('indexed %d movies, %d neighbors each, in %.1fs; %s is current',
+                    len(corpus), index['neighbors'].shape[1], time.perf_counter() - start, directory)
+    else:
+        recommender = get_recommender(args.root)
+        if recommender is None:
+            sys.exit(f'no index at {args.root}')
+        id = recommender.find(args.title)
+        if id is None:
+            sys.exit(f'{args.title!r} is not in the index')
+        for movie_id, title in recommender.movie_suggestions(id).items():
+            print(movie_id, title)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Whole-page caching of detail pages for visitors who aren't logged in.
+
+PageCache.cached wraps a GET view. For an anonymous visitor (no user and no
+pending flash messages in the session) the rendered page is kept per worker
+for ttl seconds, keyed by path and query string, so repeat views skip TMDB
+and Jinja. Every page gets a strong ETag, the hash of its body, and an
+If-None-Match that matches it is answered with 304 and no body.
+
+Anonymous pages are sent "public, max-age=0, s-maxage=ttl": a CDN keeps
+one copy per url for every visitor, whatever cookies they send, while
+browsers revalidate theirs, so a visitor who has just logged in isn't shown
+the page they saw before. Pages of logged-in users are "private, no-cache"
+and "Vary: Cookie". A CDN tells the two apart by the LOGIN_COOKIE marker
+that mark_login keeps in step with the session, and should bypass its cache
+for requests that carry it. Public pages go out without the request's
+Server-Timing header (see instrumentation.py), which a CDN would otherwise
+replay to every visitor.
+"""
+
+import hashlib, threading
+from functools import wraps
+from flask import Response, request, session, make_response
+from cachetools import TTLCache
+
+
+class Page:
+    """ A rendered page: what a cache hit sends again. """
+
+    __slots__ = ('body', 'mimetype', 'etag')
+
+    def __init__(self, body, mimetype):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+
+
+class PageCache:
+    """ Rendered pages of anonymous visitors, per worker. """
+
+    # Set while a visitor is logged in; it only steers caches, so nothing trusts it
+    LOGIN_COOKIE = 'logged_in'
+
+    def __init__(self, ttl, user_key, maxsize=1024):
+        self.ttl = ttl
+        self.user_key = user_key
+        self._pages = TTLCache(maxsize=maxsize, ttl=ttl) if ttl > 0 else None
+        self._lock = threading.Lock()
+
+    def is_anonymous(self):
+        """ Would any visitor without a session see the same page? """
+
+        # `in` doesn't mark the session accessed, which would add Vary: Cookie
+        return self.user_key not in session and '_flashes' not in session
+
+    def mark_login(self, response):
+        """ after_request hook: set LOGIN_COOKIE while the visitor is logged in, drop it after. """
+
+        logged_in = self.user_key in session
+        if logged_in and self.LOGIN_COOKIE not in request.cookies:
+            response.set_cookie(self.LOGIN_COOKIE, '1', httponly=True, samesite='Lax')
+        elif not logged_in and self.LOGIN_COOKIE in request.cookies:
+            response.delete_cookie(self.LOGIN_COOKIE, httponly=True, samesite='Lax')
+        return response
+
+    def clear(self):
+        if self._pages is not None:
+            with self._lock:
+                self._pages.clear()
+
+    def respond(self, page, anonymous):
+        """ page as a response to the current request, 304 if the client has it. """
+
+        response = Response(page.body, mimetype=page.mimetype)
+        response.set_etag(page.etag)
+
+        if anonymous and self._pages is not None:
+            response.cache_control.public = True
+            response.cache_control.max_age = 0
+            response.cache_control.s_maxage = self.ttl
+            # The page doesn't depend on the session, so reading it elsewhere
+            # in the request mustn't split the CDN's copy by cookie
+            session.accessed = False
+        else:
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            response.vary.add('Cookie')
+
+        return response.make_conditional(request)
+
+    def cached(self, view):
+        """ Decorate an async GET view. """
+
+        @wraps(view)
+        async def wrapper(*args, **kwargs):
+            anonymous = self.is_anonymous()
+            key = request.full_path
+
+            page = None
+            if anonymous and self._pages is not None:
+                with self._lock:
+                    page = self._pages.get(key)
+
+            if page is None:
+                response = make_response(await view(*args, **kwargs))
+                # Redirects, errors and streamed bodies go out as they are
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+
+                page = Page(response.get_data(), response.mimetype)
+                if anonymous and self._pages is not None:
+                    with self._lock:
+                        self._pages[key] = page
+
+            return self.respond(page, anonymous)
+
+        return wrapper
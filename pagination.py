@@ -0,0 +1,75 @@
+"""Keyset pagination for lists ordered by a descending integer key.
+
+Pages are addressed by the key of the last (or first) row shown instead of
+an offset, so every page is one index range scan no matter how deep it is.
+"""
+
+from flask import request, url_for, current_app
+
+
+class Page:
+    """ One page of rows plus the cursors of its neighbours. """
+
+    def __init__(self, items, limit, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.limit = limit
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def url(self, **cursor):
+        """ Url of this view with a cursor; limit is kept if it was given. """
+
+        args = dict(request.view_args or {}, **cursor)
+        if 'limit' in request.args:
+            args['limit'] = self.limit
+        return url_for(request.endpoint, **args)
+
+    @property
+    def next_url(self):
+        return self.url(after=self.next_cursor) if self.next_cursor is not None else None
+
+    @property
+    def prev_url(self):
+        return self.url(before=self.prev_cursor) if self.prev_cursor is not None else None
+
+
+def page_args():
+    """ after/before/limit from the query string, with limit clamped to MAX_PAGE_SIZE. """
+
+    limit = request.args.get('limit', current_app.config['PAGE_SIZE'], type=int)
+
+    return {
+        'after': request.args.get('after', type=int),
+        'before': request.args.get('before', type=int),
+        'limit': max(1, min(limit, current_app.config['MAX_PAGE_SIZE'])),
+    }
+
+
+def keyset_paginate(query, key, after=None, before=None, limit=24):
+    """ One page of query ordered by key descending.
+
+    after returns the rows that come after that key (the next page), before
+    the rows that come before it (the previous page). Rows may be model
+    instances or result rows, as long as they expose the key by name. """
+
+    key_of = lambda row: getattr(row, key.key)
+
+    if before is not None:
+        rows = query.filter(key > before).order_by(key.asc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit][::-1]
+
+        return Page(rows, limit,
+                    next_cursor=key_of(rows[-1]) if rows else None,
+                    prev_cursor=key_of(rows[0]) if has_more else None)
+
+    if after is not None:
+        query = query.filter(key < after)
+
+    rows = query.order_by(key.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    return Page(rows, limit,
+                next_cursor=key_of(rows[-1]) if has_more else None,
+                prev_cursor=key_of(rows[0]) if after is not None and rows else None)
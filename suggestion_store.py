@@ -0,0 +1,86 @@
+"""Server-side storage of search results for the suggestions page.
+
+A homepage search saves the movie ids it found in suggestion_sets under a
+short key and redirects to /suggestions?key=<key>, so neither the cookie
+session nor the url carries the results themselves. The key is a hash of
+the ids, so the same results always get the same key: a repeated search
+refreshes its row instead of adding one, and its cards can be reused from
+the card cache of the worker that serves it.
+
+Sets expire SUGGESTION_TTL seconds after the last search that produced
+them; every PURGE_EVERY saves a worker deletes the expired rows.
+"""
+
+import base64, hashlib, datetime, threading
+from flask import current_app
+from sqlalchemy.dialects.postgresql import insert
+
+from models import db, SuggestionSet
+
+
+# Default lifetime of a set, in seconds
+SUGGESTION_TTL = 24 * 60 * 60
+# Delete expired sets once every this many saves
+PURGE_EVERY = 100
+
+_saves = 0
+_saves_lock = threading.Lock()
+
+
+def utcnow():
+    return datetime.datetime.utcnow()
+
+
+def expiry():
+    """ Oldest saved_at of a live set. """
+
+    ttl = current_app.config.get('SUGGESTION_TTL', SUGGESTION_TTL)
+    return utcnow() - datetime.timedelta(seconds=ttl)
+
+
+def set_key(movie_ids):
+    """ 16 url-safe characters identifying a list of movie ids. """
+
+    digest = hashlib.sha256(','.join(map(str, movie_ids)).encode()).digest()
+    return base64.urlsafe_b64encode(digest)[:16].decode()
+
+
+def save(movie_ids):
+    """ Store a search's movie ids, in order; returns their key. """
+
+    global _saves
+
+    movie_ids = [int(id) for id in movie_ids]
+    key = set_key(movie_ids)
+
+    statement = insert(SuggestionSet).values(key=key, movie_ids=movie_ids, saved_at=utcnow())
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=[SuggestionSet.key],
+        set_={'saved_at': statement.excluded.saved_at}))
+    db.session.commit()
+
+    with _saves_lock:
+        _saves += 1
+        due = _saves % PURGE_EVERY == 0
+    if due:
+        purge()
+
+    return key
+
+
+def load(key):
+    """ The movie ids saved under key, or None once they have expired. """
+
+    row = SuggestionSet.query.filter(SuggestionSet.key == key,
+                                     SuggestionSet.saved_at >= expiry()).first()
+
+    return row.movie_ids if row else None
+
+
+def purge():
+    """ Delete expired sets; returns how many. """
+
+    deleted = SuggestionSet.query.filter(SuggestionSet.saved_at < expiry()).delete()
+    db.session.commit()
+
+    return deleted
@@ -0,0 +1,310 @@
+"""API requests tests."""
+
+# python3 -m unittest test_api_requests.py
+# to run all tests at once -> python -m unittest discover
+
+import os, time, copy, threading
+from unittest import TestCase
+from unittest.mock import patch
+import httpx
+
+import api_requests
+from api_requests import fetch_many, get_movie_details_many, cast_detail, cast_titles, CastCredit
+from tmdb_cache import MemoryBackend, ResponseCache
+from tmdb_client import TMDBError
+import tmdb_async
+
+
+def fake_movie_detail(id):
+    """ Stand-in for get_movie_detail; ids ending in 0 fail. """
+
+    if str(id).endswith('0'):
+        raise KeyError('title')
+    # Later ids answer first, so ordering can't come from completion order
+    time.sleep(0.01 * (5 - int(id) % 5))
+    return {id: {'title': f'movie {id}', 'img_url': '', 'popularity': 1.0}}
+
+
+class FetchManyTestCase(TestCase):
+    """ Test the parallel batch fetch. """
+
+    def test_fetch_many_preserves_order(self):
+        """ Are results returned in input order without duplicates? """
+
+        results = fetch_many(lambda id: id * 2, [3, 1, 2, 1])
+
+        self.assertEqual(list(results.items()), [(3, 6), (1, 2), (2, 4)])
+
+    def test_movie_details_many_skips_failures(self):
+        """ Does one failing id leave the other results intact? """
+
+        with patch.object(api_requests, 'get_movie_detail', side_effect=fake_movie_detail):
+            movies = get_movie_details_many([11, 10, 12, 13])
+
+        self.assertEqual(list(movies.keys()), [11, 12, 13])
+        self.assertEqual(movies[12]['title'], 'movie 12')
+
+
+class TrendingSnapshotTestCase(TestCase):
+    """ Test the background-refreshed trending list. """
+
+    def test_reads_never_call_tmdb(self):
+        """ Is the homepage carousel built without a TMDB call? """
+
+        snapshot = api_requests.TrendingSnapshot(3600)
+        snapshot.results = [{'id': id, 'title': f'movie {id}', 'poster_path': f'/{id}.jpg'}
+                            for id in range(1, 21)]
+
+        with patch.object(api_requests, 'trending_snapshot', snapshot), \
+             patch.object(snapshot.task, 'start'), \
+             patch.object(api_requests, 'get_trending_movies') as get_trending_movies:
+            trending = api_requests.get_trending_movies_info()
+
+        get_trending_movies.assert_not_called()
+        self.assertEqual(len(trending), 10)
+
+    def test_empty_snapshot(self):
+        """ Is an empty carousel returned before the first refresh lands? """
+
+        snapshot = api_requests.TrendingSnapshot(3600)
+
+        with patch.object(api_requests, 'trending_snapshot', snapshot), \
+             patch.object(snapshot.task, 'start'):
+            self.assertEqual(api_requests.get_trending_movies_info(), {})
+
+    def test_failed_refresh_keeps_last_results(self):
+        """ Does a TMDB error leave the previous list in place? """
+
+        snapshot = api_requests.TrendingSnapshot(3600)
+        snapshot.results = [{'id': 1}]
+
+        with patch.object(api_requests, 'get_trending_movies',
+                          return_value={'success': False, 'status_message': 'down'}):
+            with self.assertRaises(ValueError):
+                snapshot.refresh()
+
+        self.assertEqual(snapshot.results, [{'id': 1}])
+
+
+class GenreRegistryTestCase(TestCase):
+    """ Test the genre id -> name registry. """
+
+    def setUp(self):
+        """ Load a registry from a fake genre list. """
+
+        self.registry = api_requests.GenreRegistry(3600)
+        genres = {'genres': [{'id': 28, 'name': 'Action'}, {'id': 35, 'name': 'Comedy'}]}
+        with patch.object(api_requests, 'get_genres', return_value=genres):
+            self.registry.refresh()
+
+    def test_ids_by_genre_makes_one_request(self):
+        """ Does a genre page only call discover? """
+
+        discover = {'results': [{'id': 603}, {'id': 604}]}
+
+        with patch.object(api_requests, 'genre_registry', self.registry), \
+             patch.object(self.registry.task, 'start'), \
+             patch.object(api_requests, 'cached_get_json', return_value=discover) as fetch:
+            movie_info = api_requests.get_ids_by_genre('35')
+
+        self.assertEqual(movie_info, [[603, 604], ['Comedy']])
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(fetch.call_args[0][0], 'discover')
+
+    def test_unknown_genre(self):
+        """ Are unknown or malformed ids looked up without errors? """
+
+        with patch.object(self.registry.task, 'start'):
+            self.assertIsNone(self.registry.name('99'))
+            self.assertIsNone(self.registry.name('drama'))
+
+
+class GenreRegistryLoadTestCase(TestCase):
+    """ Test lookups while the genre list can't be loaded. """
+
+    def test_failed_load_does_not_block_lookups(self):
+        """ Once the first load fails, are lookups answered right away? """
+
+        registry = api_requests.GenreRegistry(3600)
+
+        with patch.object(api_requests, 'get_genres', side_effect=TMDBError('TMDB is down')):
+            start = time.perf_counter()
+            self.assertIsNone(registry.name('28'))
+            self.assertIsNone(registry.name('35'))
+
+        self.assertLess(time.perf_counter() - start, 1)
+
+    def test_slow_load_is_waited_for_once(self):
+        """ Does only the first lookup wait for a load that hangs, and later ones see it land? """
+
+        registry = api_requests.GenreRegistry(3600)
+        release = threading.Event()
+
+        def get_genres():
+            release.wait(5)
+            return {'genres': [{'id': 28, 'name': 'Action'}]}
+
+        with patch.object(api_requests, 'get_genres', get_genres), \
+             patch.object(registry, 'LOAD_TIMEOUT', 0.1):
+            start = time.perf_counter()
+            self.assertIsNone(registry.name('28'))
+            self.assertGreaterEqual(time.perf_counter() - start, 0.1)
+
+            start = time.perf_counter()
+            self.assertIsNone(registry.name('28'))
+            self.assertLess(time.perf_counter() - start, 0.05)
+
+            release.set()
+            for _ in range(100):
+                if registry.names:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(registry.name('28'), 'Action')
+
+
+class MovieSummaryTestCase(TestCase):
+    """ Test the slim movie card fetch. """
+
+    def setUp(self):
+        """ Swap in an empty cache. """
+
+        self.cache = ResponseCache(MemoryBackend(16))
+        patcher = patch.object(api_requests, 'cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_summary_requests_base_resource(self):
+        """ Is the movie fetched without append_to_response? """
+
+        base = {'title': 'The Matrix', 'poster_path': '/matrix.jpg', 'popularity': 81.234}
+
+        with patch.object(api_requests, 'get_json', return_value=base) as get_json:
+            movie = api_requests.get_movie_summary(603)
+
+        self.assertNotIn('append_to_response', get_json.call_args[0][0])
+        self.assertEqual(movie, {603: {'title': 'The Matrix',
+                                       'img_url': api_requests.IMAGE_BASE_URL + '/matrix.jpg',
+                                       'popularity': 81.23}})
+
+    def test_summary_reuses_full_payload(self):
+        """ Is a cached full detail payload used instead of a new request? """
+
+        full = {'title': 'The Matrix', 'poster_path': None, 'popularity': 0, 'credits': {}}
+        self.cache.set('movie', api_requests.cache_key(api_requests.movie_url(603)), full)
+
+        with patch.object(api_requests, 'get_json') as get_json:
+            movie = api_requests.get_movie_summary(603)
+
+        get_json.assert_not_called()
+        self.assertEqual(movie[603]['img_url'], "/static/images/noImage.jpg")
+
+
+def person(popularities):
+    """ A TMDB person payload with one credit per popularity. """
+
+    credits = [{'id': i, 'title': f'movie {i}', 'character': f'role {i}', 'poster_path': f'/{i}.jpg',
+                'popularity': popularity} for i, popularity in enumerate(popularities)]
+    return {'name': 'Keanu Reeves', 'biography': '', 'images': {'profiles': []},
+            'movie_credits': {'cast': credits}}
+
+
+class CastCreditsTestCase(TestCase):
+    """ Test ranking a person's filmography. """
+
+    def test_top_credits_scaled_to_most_popular(self):
+        """ Are the most popular credits kept, best first, as percentages? """
+
+        resp = person([10.0, 40.0, 0.0, 20.0])
+        original = copy.deepcopy(resp)
+
+        movies = cast_detail(6384, resp, limit=3)[6384]['movies']
+
+        self.assertEqual(movies, [CastCredit(1, 'movie 1', 'role 1', '/1.jpg', 100),
+                                  CastCredit(3, 'movie 3', 'role 3', '/3.jpg', 50),
+                                  CastCredit(0, 'movie 0', 'role 0', '/0.jpg', 25)])
+        # The (possibly cached) payload is left as it was
+        self.assertEqual(resp, original)
+
+    def test_unpopular_and_empty_filmographies(self):
+        """ Are all-zero and empty filmographies handled? """
+
+        self.assertEqual([movie.popularity for movie in cast_detail(1, person([0, 0]))[1]['movies']], [0, 0])
+        self.assertEqual(cast_detail(1, person([]))[1]['movies'], [])
+
+    def test_partial_selection_matches_sort(self):
+        """ Does the numpy path pick the same credits as a stable sort, ties included? """
+
+        popularities = [(i * 7919) % 13 for i in range(3000)]
+        resp = person(popularities)
+        expected = sorted(range(3000), key=lambda i: popularities[i], reverse=True)[:12]
+
+        self.assertEqual([movie.id for movie in cast_detail(1, resp)[1]['movies']], expected)
+        self.assertEqual(list(cast_titles(resp)), expected)
+        self.assertEqual(cast_titles(resp)[expected[0]], f'movie {expected[0]}')
+
+
+class AsyncFetchTestCase(TestCase):
+    """ Test the coroutine fetches used by the async views. """
+
+    def setUp(self):
+        """ Swap in an empty cache. """
+
+        self.cache = ResponseCache(MemoryBackend(16))
+        patcher = patch.object(api_requests, 'cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_summaries_many_skips_failures(self):
+        """ Are summaries returned in input order, leaving out failed ids? """
+
+        async def get_json_async(url):
+            if '/movie/10?' in url:
+                raise TMDBError('down')
+            id = int(url.split('/movie/')[1].split('?')[0])
+            return {'title': f'movie {id}', 'poster_path': None, 'popularity': id}
+
+        with patch.object(api_requests, 'get_json_async', get_json_async):
+            movies = tmdb_async.run(api_requests.get_movie_summaries_many_async([12, 10, 11, 12]))
+
+        self.assertEqual(list(movies.keys()), [12, 11])
+        self.assertEqual(movies[11]['title'], 'movie 11')
+
+    def test_async_error_responses(self):
+        """ Are a 503 left after the retries and a body that isn't JSON surfaced as TMDBError? """
+
+        bodies = {'/3/busy': (503, b'<html>Service Unavailable</html>'), '/3/html': (200, b'<html></html>')}
+        calls = []
+
+        def handler(request):
+            calls.append(request.url.path)
+            status, body = bodies[request.url.path]
+            return httpx.Response(status, content=body)
+
+        async def fetch(url):
+            with patch.object(tmdb_async, 'get_client',
+                              return_value=httpx.AsyncClient(transport=httpx.MockTransport(handler))):
+                return await tmdb_async.get_json_async(url)
+
+        with patch.dict(os.environ, {'TMDB_MAX_RETRIES': '2', 'TMDB_BACKOFF_FACTOR': '0'}):
+            for path in bodies:
+                with self.assertRaises(TMDBError):
+                    tmdb_async.run(fetch('https://api.themoviedb.org' + path))
+
+        self.assertEqual(calls, ['/3/busy'] * 3 + ['/3/html'])
+
+    def test_async_fetch_shares_cache(self):
+        """ Does an async fetch fill the cache the sync path reads? """
+
+        full = {'title': 'The Matrix', 'images': {'posters': []}, 'popularity': 1,
+                'overview': '', 'runtime': 136, 'genres': [], 'release_date': '',
+                'credits': {'cast': [], 'crew': []}, 'videos': {'results': []}}
+
+        async def get_json_async(url):
+            return full
+
+        with patch.object(api_requests, 'get_json_async', get_json_async):
+            movie = tmdb_async.run(api_requests.get_movie_detail_async(603))
+
+        with patch.object(api_requests, 'get_json') as get_json:
+            self.assertEqual(api_requests.get_movie_detail(603), movie)
+        get_json.assert_not_called()
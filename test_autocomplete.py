@@ -0,0 +1,138 @@
+"""Autocomplete tests."""
+
+# createdb MoviesBox_test
+# FLASK_ENV=production python3 -m unittest test_autocomplete.py
+# to run all tests at once -> python -m unittest discover
+
+import os
+from unittest import TestCase
+from models import db, CatalogMovie, CatalogPerson
+
+# Set an environmental variable to use a different database for tests before importing app
+os.environ['DATABASE_URL'] = "postgresql:///MoviesBox_test"
+
+from app import app, autocomplete_index
+from autocomplete import PrefixIndex, normalize
+
+app.config['SQLALCHEMY_ECHO'] = False
+
+db.create_all()
+
+
+# Most popular first
+MOVIES = [
+    (603, 'The Matrix'),
+    (245891, 'John Wick'),
+    (13, 'Forrest Gump'),
+    (604, 'The Matrix Reloaded'),
+    (194, 'Amélie'),
+    (11216, 'Tora! Tora! Tora!'),
+    (605, 'The Matrix Revolutions'),
+]
+
+
+class PrefixIndexTestCase(TestCase):
+    """ Test prefix lookups. """
+
+    def test_normalize(self):
+        """ Are names casefolded, stripped of accents and split into words? """
+
+        self.assertEqual(normalize("  Amélie:  THE Movie! "), 'amelie the movie')
+        self.assertEqual(normalize('*&|!'), '')
+
+    def test_matches_any_word_by_popularity(self):
+        """ Does a prefix match the start of any word, most popular first? """
+
+        index = PrefixIndex(MOVIES)
+
+        self.assertEqual([id for id, _ in index.suggest('mat')], [603, 604, 605])
+        self.assertEqual(index.suggest('the matrix r'), [(604, 'The Matrix Reloaded'), (605, 'The Matrix Revolutions')])
+        self.assertEqual(index.suggest('AME'), [(194, 'Amélie')])
+        self.assertEqual(index.suggest('mat', limit=1), [(603, 'The Matrix')])
+        self.assertEqual(index.suggest('atrix'), [])
+        self.assertEqual(index.suggest('!'), [])
+        self.assertEqual(PrefixIndex().suggest('mat'), [])
+
+    def test_search_matches_words_in_any_order(self):
+        """ Does search() fall back to names holding every word, the last as a prefix? """
+
+        index = PrefixIndex(MOVIES)
+
+        self.assertEqual(index.search('the matrix'), index.suggest('the matrix'))
+        self.assertEqual(index.search('matrix the rel'), [(604, 'The Matrix Reloaded')])
+        self.assertEqual(index.search('matr the'), [])
+        self.assertEqual(index.search('wick gump'), [])
+
+    def test_other_names(self):
+        """ Is an entry found by any of its names, and listed by the first? """
+
+        index = PrefixIndex([(129, 'Spirited Away', '千と千尋の神隠し'), (603, 'The Matrix', 'The Matrix')])
+
+        self.assertEqual(index.suggest('千と'), [(129, 'Spirited Away')])
+        self.assertEqual(index.suggest('spir'), [(129, 'Spirited Away')])
+        self.assertEqual(index.search('away spir'), [(129, 'Spirited Away')])
+        self.assertEqual(index.search('千と千尋の神隠し spir'), [])
+        self.assertEqual(index.suggest('matrix'), [(603, 'The Matrix')])
+
+    def test_lists_an_entry_once(self):
+        """ Is a name with a repeated word suggested only once? """
+
+        self.assertEqual(PrefixIndex(MOVIES).suggest('tora'), [(11216, 'Tora! Tora! Tora!')])
+
+    def test_precomputed_prefixes_match_scans(self):
+        """ Do prefixes answered from the precomputed table match a full scan? """
+
+        movies = [(id, f'{word} {id % 7}') for id, word in
+                  enumerate(['the', 'then', 'them', 'theory', 'a', 'an', 'and'] * 40)]
+        scanned = PrefixIndex(movies, scan_limit=len(movies) * 10)
+        precomputed = PrefixIndex(movies, scan_limit=5)
+
+        self.assertEqual(scanned.top, {})
+        self.assertIn('the', precomputed.top)
+        for prefix in ['t', 'th', 'the', 'then', 'theo', 'a', 'an', '3', 'the 3', 'x']:
+            self.assertEqual(precomputed.suggest(prefix), scanned.suggest(prefix), prefix)
+
+
+class AutocompleteViewTestCase(TestCase):
+    """ Test the autocomplete endpoint. """
+
+    def setUp(self):
+        """ Build the indexes from a small catalog. """
+
+        CatalogMovie.query.delete()
+        CatalogPerson.query.delete()
+        for popularity, (id, title) in enumerate(reversed(MOVIES)):
+            db.session.add(CatalogMovie(id=id, title=title, popularity=popularity, exported_on='2026-01-01'))
+        db.session.add(CatalogPerson(id=6384, name='Keanu Reeves', popularity=40, exported_on='2026-01-01'))
+        db.session.commit()
+
+        autocomplete_index.rebuild()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """ Clean up any failed transaction. """
+
+        db.session.rollback()
+
+    def test_autocomplete(self):
+        """ Are movies and people suggested as JSON? """
+
+        resp = self.client.get('/autocomplete?q=kea')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json, {'movies': [], 'people': [{'id': 6384, 'name': 'Keanu Reeves'}]})
+
+        resp = self.client.get('/autocomplete?q=matrix&kind=movie&limit=2')
+        self.assertEqual(resp.json, {'movies': [{'id': 603, 'title': 'The Matrix'},
+                                                {'id': 604, 'title': 'The Matrix Reloaded'}]})
+
+        # Movies with an English title are listed by it and found by both
+        amelie = CatalogMovie.query.get(194)
+        amelie.title, amelie.localized_title = "Le Fabuleux Destin d'Amélie Poulain", 'Amélie'
+        db.session.commit()
+        autocomplete_index.rebuild()
+        for q in ('fabuleux', 'amel'):
+            resp = self.client.get(f'/autocomplete?q={q}&kind=movie')
+            self.assertEqual(resp.json, {'movies': [{'id': 194, 'title': 'Amélie'}]}, q)
+
+        resp = self.client.get('/autocomplete?q=matrix&kind=series')
+        self.assertEqual(resp.status_code, 400)
@@ -0,0 +1,145 @@
+"""Movie catalog tests."""
+
+# createdb MoviesBox_test
+# FLASK_ENV=production python3 -m unittest test_catalog.py
+# to run all tests at once -> python -m unittest discover
+
+import os, json, datetime
+from unittest import TestCase
+from unittest.mock import patch
+from models import db, CatalogMovie, CatalogPerson
+
+# Set an environmental variable to use a different database for tests before importing app
+os.environ['DATABASE_URL'] = "postgresql:///MoviesBox_test"
+
+from app import app
+import catalog
+from catalog import ingest, search, tsquery, localize, localize_popular
+from autocomplete import PrefixIndex
+
+app.config['SQLALCHEMY_ECHO'] = False
+
+db.create_all()
+
+
+def export(*movies):
+    """ Lines of a TMDB movie id export. """
+
+    return [json.dumps({'adult': adult, 'id': id, 'original_title': title, 'popularity': popularity,
+                        'video': False}) + '\n'
+            for id, title, popularity, adult in movies]
+
+
+EXPORT = export(
+    (603, 'The Matrix', 80.0, False),
+    (604, 'The Matrix Reloaded', 40.0, False),
+    (605, 'The Matrix Revolutions', 35.0, False),
+    (245891, 'John Wick', 60.0, False),
+    (13, 'Forrest Gump', 50.0, False),
+    (99, 'Matrix Adult', 99.0, True),
+)
+
+
+class CatalogTestCase(TestCase):
+    """ Test ingesting and searching the catalog. """
+
+    def setUp(self):
+        """ Ingest the sample export into an empty catalog. """
+
+        CatalogMovie.query.delete()
+        db.session.commit()
+
+        self.day = datetime.date(2026, 1, 1)
+        ingest(EXPORT, self.day, batch_rows=2)
+
+    def tearDown(self):
+        """ Clean up any failed transaction. """
+
+        db.session.rollback()
+
+    def test_search_ranks_by_popularity(self):
+        """ Are matches of every word listed by popularity, adult titles left out? """
+
+        self.assertEqual(list(search('matrix')), [603, 604, 605])
+        self.assertEqual(search('Matrix reloaded'), {604: 'The Matrix Reloaded'})
+        self.assertEqual(list(search('matrix', limit=1)), [603])
+
+    def test_last_word_is_a_prefix(self):
+        """ Do partial last words match, and earlier ones only in full? """
+
+        self.assertEqual(list(search('the matr')), [603, 604, 605])
+        self.assertEqual(search('forr gump'), {})
+        self.assertEqual(search('*&|!'), {})
+        self.assertEqual(tsquery("John Wick's"), "john & wick & s:*")
+
+    def test_search_asks_the_index_first(self):
+        """ Are index matches returned as they are, and misses searched in the table? """
+
+        index = PrefixIndex([(603, 'The Matrix')])
+
+        self.assertEqual(search('matrix', index=index), {603: 'The Matrix'})
+        self.assertEqual(search('forrest', index=index), {13: 'Forrest Gump'})
+
+    def test_reingest_updates_and_drops(self):
+        """ Does the next export update popularity and drop missing movies? """
+
+        upserted, deleted = ingest(export((604, 'The Matrix Reloaded', 90.0, False),
+                                          (603, 'The Matrix', 80.0, False)),
+                                   self.day + datetime.timedelta(days=1))
+
+        self.assertEqual((upserted, deleted), (2, 3))
+        self.assertEqual(list(search('matrix')), [604, 603])
+        self.assertEqual(search('wick'), {})
+
+    def test_localized_titles(self):
+        """ Is a movie exported under its original title found, and listed, by its English one? """
+
+        ingest(export((129, '千と千尋の神隠し', 70.0, False)), self.day)
+
+        self.assertEqual(search('spirited away'), {})
+        self.assertEqual(localize({129: 'Spirited Away', 603: 'The Matrix'}), 2)
+        self.assertEqual(localize({129: 'Spirited Away'}), 0)
+
+        self.assertEqual(search('spirited aw'), {129: 'Spirited Away'})
+        self.assertEqual(search('千と千尋の神隠し'), {129: 'Spirited Away'})
+        self.assertEqual(search('matrix', limit=1), {603: 'The Matrix'})
+
+        # The next export keeps the recorded title
+        ingest(export((129, '千と千尋の神隠し', 75.0, False)), self.day + datetime.timedelta(days=1))
+        self.assertEqual(search('spirited'), {129: 'Spirited Away'})
+
+    def test_localize_popular(self):
+        """ Are the most popular movies without a title fetched, and failures left for the next run? """
+
+        localize({603: 'The Matrix'})
+        fetched = []
+
+        def fetch_title(id):
+            fetched.append(id)
+            if id == 13:
+                raise OSError('TMDB is down')
+            return {245891: 'John Wick', 604: 'The Matrix Reloaded'}[id]
+
+        with patch.object(catalog, 'fetch_title', fetch_title):
+            self.assertEqual(localize_popular(limit=3, batch_rows=2), (2, 2))
+
+        self.assertEqual(sorted(fetched), [13, 604, 245891])
+        self.assertEqual(CatalogMovie.query.get(604).localized_title, 'The Matrix Reloaded')
+        self.assertIsNone(CatalogMovie.query.get(13).localized_title)
+
+    def test_empty_export_keeps_catalog(self):
+        """ Is the catalog left alone when an export yields nothing? """
+
+        self.assertEqual(ingest([], self.day + datetime.timedelta(days=1)), (0, 0))
+        self.assertEqual(CatalogMovie.query.count(), 5)
+
+    def test_ingest_people(self):
+        """ Are person exports stored by name in catalog_people? """
+
+        CatalogPerson.query.delete()
+        lines = [json.dumps({'adult': False, 'id': 6384, 'name': 'Keanu Reeves', 'popularity': 40.0}) + '\n',
+                 json.dumps({'adult': True, 'id': 1, 'name': 'Someone', 'popularity': 1.0}) + '\n']
+
+        self.assertEqual(ingest(lines, self.day, kind='person'), (1, 0))
+        self.assertEqual(CatalogPerson.query.get(6384).name, 'Keanu Reeves')
+        self.assertEqual(CatalogMovie.query.count(), 5)
@@ -0,0 +1,134 @@
+"""Co-favorites pipeline tests."""
+
+# createdb MoviesBox_test
+# FLASK_ENV=production python3 -m unittest test_co_favorites.py
+# to run all tests at once -> python -m unittest discover
+
+import os, datetime
+from unittest import TestCase
+from models import db, User, FavoriteCasts, FavoriteMovies, MovieMetadata, MovieCoFavorite, UserTaste
+
+# Set an environmental variable to use a different database for tests before importing app
+os.environ['DATABASE_URL'] = "postgresql:///MoviesBox_test"
+
+from app import app
+import co_favorites
+from co_favorites import update, rebuild, also_saved, user_taste
+
+app.config['SQLALCHEMY_ECHO'] = False
+
+db.create_all()
+
+
+def metadata(id, title, genre_ids=(), director_id=None):
+    return MovieMetadata(id=id, title=title, popularity=10.0,
+                         genres=[{'id': genre, 'name': str(genre)} for genre in genre_ids],
+                         director={str(director_id): 'Someone'} if director_id else {},
+                         refreshed_at=datetime.datetime.utcnow())
+
+
+class CoFavoritesTestCase(TestCase):
+    """ Test the incremental co-favorites counts and taste profiles. """
+
+    def setUp(self):
+        """ Three users, movie metadata and an empty pipeline. """
+
+        User.query.delete()
+        MovieMetadata.query.delete()
+        db.session.execute(db.text("TRUNCATE movie_co_favorites, user_tastes, favorites_watermarks"))
+        db.session.commit()
+
+        for id in (1, 2, 3):
+            user = User.signup(username=f'user{id}', email=f'user{id}@test.com',
+                               password='hashed_psw', image_profile=None)
+            user.id = id
+        db.session.add_all([
+            metadata(603, 'The Matrix', (28, 878), 9340),
+            metadata(604, 'The Matrix Reloaded', (28, 878), 9340),
+            metadata(13, 'Forrest Gump', (18,), 24),
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        """ Clean up any failed transaction. """
+
+        db.session.rollback()
+
+    def save(self, user_id, *movie_ids):
+        db.session.add_all(FavoriteMovies(id=id, title=str(id), user_id=user_id) for id in movie_ids)
+        db.session.commit()
+
+    def counts(self):
+        return {(row.movie_id, row.other_id): row.count for row in MovieCoFavorite.query.all()}
+
+    def test_pairs_are_counted_once_across_runs(self):
+        """ Are pairs counted both ways round, once, however the rows are chunked? """
+
+        self.save(1, 603, 604)
+        self.save(2, 603)
+        update(chunk_rows=1)
+
+        # User 2's second movie pairs with the one consumed in the last run
+        self.save(2, 604, 13)
+        self.assertEqual(update(chunk_rows=2), {'favorite_movies': 2, 'favorite_casts': 0})
+        self.assertEqual(update(), {'favorite_movies': 0, 'favorite_casts': 0})
+
+        counts = self.counts()
+        self.assertEqual(counts[(603, 604)], 2)
+        self.assertEqual(counts[(604, 603)], 2)
+        self.assertEqual(counts[(13, 603)], 1)
+        self.assertNotIn((603, 603), counts)
+
+    def test_also_saved(self):
+        """ Are the most co-saved movies listed first, with their titles? """
+
+        self.save(1, 603, 604, 13)
+        self.save(2, 603, 604)
+        self.save(3, 603)
+        update()
+
+        self.assertEqual(also_saved(603), [(604, 'The Matrix Reloaded', 2), (13, 'Forrest Gump', 1)])
+        self.assertEqual(also_saved(603, limit=1), [(604, 'The Matrix Reloaded', 2)])
+        self.assertEqual(also_saved('not-an-id'), [])
+
+    def test_taste_profile(self):
+        """ Do favorite movies add their genres and director, and casts their person? """
+
+        self.save(1, 603, 604)
+        db.session.add(FavoriteCasts(id=6384, name='Keanu Reeves', user_id=1))
+        db.session.commit()
+        update()
+
+        taste = dict(user_taste(1))
+        self.assertEqual(taste['genre:28'], 2)
+        self.assertEqual(taste['person:9340'], 2)
+        self.assertEqual(taste['person:6384'], 1)
+        self.assertEqual(user_taste(2), [])
+
+    def test_rebuild_drops_deleted_favorites(self):
+        """ Does a rebuild recount from the rows that are left? """
+
+        self.save(1, 603, 604)
+        update()
+        FavoriteMovies.query.filter_by(user_id=1, id=604).delete()
+        db.session.commit()
+
+        rebuild()
+
+        self.assertEqual(self.counts(), {})
+        self.assertEqual(dict(user_taste(1))['genre:28'], 1)
+
+    def test_locked_source_is_skipped(self):
+        """ Does a run skip a source another process is working on? """
+
+        self.save(1, 603, 604)
+        co_favorites.ensure_watermarks()
+
+        other = db.engine.connect()
+        self.addCleanup(other.close)
+        transaction = other.begin()
+        other.execute(db.text("SELECT * FROM favorites_watermarks WHERE source = 'favorite_movies' FOR UPDATE"))
+
+        self.assertEqual(update()['favorite_movies'], 0)
+        transaction.rollback()
+        self.assertEqual(update()['favorite_movies'], 2)
@@ -0,0 +1,42 @@
+"""Configuration profile tests."""
+
+# python3 -m unittest test_config.py
+# to run all tests at once -> python -m unittest discover
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from config import get_config, ProductionConfig, DevelopmentConfig, TestingConfig
+
+
+class ConfigTestCase(TestCase):
+    """ Test picking a configuration profile. """
+
+    def test_production_is_default(self):
+        """ Is production used when no environment is named? """
+
+        with patch.dict(os.environ, clear=True):
+            self.assertIs(get_config(), ProductionConfig)
+
+    def test_env_selects_profile(self):
+        """ Does MOVIESBOX_ENV win over FLASK_ENV? """
+
+        with patch.dict(os.environ, {'MOVIESBOX_ENV': 'Testing', 'FLASK_ENV': 'development'}):
+            self.assertIs(get_config(), TestingConfig)
+        with patch.dict(os.environ, {'FLASK_ENV': 'development'}, clear=True):
+            self.assertIs(get_config(), DevelopmentConfig)
+
+    def test_unknown_profile(self):
+        """ Is a misspelled profile an error rather than a silent default? """
+
+        with self.assertRaises(ValueError):
+            get_config('prod')
+
+    def test_production_is_quiet_and_pooled(self):
+        """ Does production turn SQL echo off and keep pooled connections healthy? """
+
+        self.assertFalse(ProductionConfig.SQLALCHEMY_ECHO)
+        self.assertFalse(getattr(ProductionConfig, 'DEBUG', False))
+        self.assertTrue(ProductionConfig.SQLALCHEMY_ENGINE_OPTIONS['pool_pre_ping'])
+        self.assertGreater(ProductionConfig.SQLALCHEMY_ENGINE_OPTIONS['pool_recycle'], 0)
@@ -6,6 +6,8 @@
 
 import os
 from unittest import TestCase
+from unittest.mock import patch
+from sqlalchemy import event
 from models import db, User, FavoriteCasts, FavoriteMovies
 from sqlalchemy.exc import IntegrityError
 
@@ -197,4 +199,77 @@ class FavoriteModelTestCase(TestCase):
         db.session.commit()
 
         self.assertEqual(len(FavoriteMovies.query.all()), 0)
-        self.assertEqual(len(FavoriteCasts.query.all()), 0)
\ No newline at end of file
+        self.assertEqual(len(FavoriteCasts.query.all()), 0)
+
+
+    def test_sample_reviewed(self):
+        """ Does review sampling return distinct reviewed rows only? """
+
+        for pk in range(1000, 1040):
+            db.session.add(FavoriteMovies(
+                                    id = pk,
+                                    title = 'Movie',
+                                    review = 'A review' if pk % 2 else None,
+                                    user_id = self.user.id,
+                                    pk = pk,
+                                ))
+        db.session.commit()
+
+        pks = FavoriteMovies.sample_reviewed(5)
+
+        self.assertEqual(len(pks), 5)
+        self.assertEqual(len(set(pks)), 5)
+        self.assertTrue(all(pk % 2 for pk in pks))
+
+    def test_sample_reviewed_uniform(self):
+        """ Is a review after a gap in the pks picked no more often than the rest? """
+
+        for pk in [1000, 1001, 1002, 1003, 2000]:
+            db.session.add(FavoriteMovies(id = pk, title = 'Movie', review = 'A review',
+                                          user_id = self.user.id, pk = pk))
+        db.session.commit()
+        db.session.execute(db.text('ANALYZE favorite_movies'))
+
+        with patch.object(FavoriteMovies, 'SAMPLE_SCAN_LIMIT', 0):
+            picks = [pk for _ in range(200) for pk in FavoriteMovies.sample_reviewed(1)]
+
+        self.assertEqual(len(picks), 200)
+        self.assertLess(picks.count(2000), 80)
+
+    def test_sample_reviewed_sparse(self):
+        """ With 1 review per 100 rows, are a few small lookups enough? """
+
+        db.session.add_all(FavoriteMovies(id = pk, title = 'Movie',
+                                          review = 'A review' if pk % 100 == 0 else None,
+                                          user_id = self.user.id, pk = pk)
+                           for pk in range(1, 10001))
+        db.session.commit()
+        db.session.execute(db.text('ANALYZE favorite_movies'))
+
+        statements = []
+        def record_draws(conn, cursor, statement, parameters, context, executemany):
+            statements.append(parameters.get('draws', 0) if isinstance(parameters, dict) else 0)
+        event.listen(db.engine, 'before_cursor_execute', record_draws)
+        self.addCleanup(event.remove, db.engine, 'before_cursor_execute', record_draws)
+
+        with patch.object(FavoriteMovies, 'SAMPLE_SCAN_LIMIT', 10):
+            for _ in range(20):
+                statements.clear()
+                pks = FavoriteMovies.sample_reviewed(5)
+
+                self.assertEqual(len(set(pks)), 5)
+                self.assertTrue(all(pk % 100 == 0 for pk in pks))
+                # Bounds, row count, then draws of about 1000 pks, rarely more than two
+                self.assertLessEqual(len(statements), 5)
+                self.assertLess(statements[2], 1100)
+
+    def test_sample_reviewed_few_reviews(self):
+        """ Are all reviews returned when there are fewer than requested? """
+
+        self.assertEqual(FavoriteMovies.sample_reviewed(5), [])
+
+        db.session.add(FavoriteMovies(id = 272, title = 'Batman Begins', review = 'Great',
+                                      user_id = self.user.id, pk = 1000))
+        db.session.commit()
+
+        self.assertEqual(FavoriteMovies.sample_reviewed(5), [1000])
@@ -0,0 +1,73 @@
+"""Image proxy tests."""
+
+# python3 -m unittest test_image_proxy.py
+# to run all tests at once -> python -m unittest discover
+
+import io, os, tempfile
+from unittest import TestCase
+from unittest.mock import patch
+from PIL import Image
+
+import image_proxy
+from image_proxy import ImageStore, image_name, resize
+
+
+def poster(width=500, height=750, format='JPEG', mode='RGB'):
+    """ Bytes of a plain poster-sized image. """
+
+    out = io.BytesIO()
+    Image.new(mode, (width, height), 'teal').save(out, format)
+    return out.getvalue()
+
+
+class ImageProxyTestCase(TestCase):
+    """ Test resizing and storing TMDB images. """
+
+    def setUp(self):
+        """ An empty store in a temporary directory. """
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = ImageStore(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_image_name(self):
+        """ Are only TMDB image urls recognized? """
+
+        self.assertEqual(image_name('https://image.tmdb.org/t/p/w500/pB8BM7pdSp6B6Ih7QZ4DrQ3PmJK.jpg'),
+                         'pB8BM7pdSp6B6Ih7QZ4DrQ3PmJK.jpg')
+        self.assertEqual(image_name('https://image.tmdb.org/t/p/w500//abc.png'), 'abc.png')
+        self.assertIsNone(image_name('/static/images/noImage.jpg'))
+        self.assertIsNone(image_name('https://image.tmdb.org/t/p/w500/../secret.jpg'))
+        self.assertIsNone(image_name(None))
+
+    def test_resize(self):
+        """ Are images scaled down to fit their size, in the asked format? """
+
+        with Image.open(io.BytesIO(resize(poster(), 'card', 'webp'))) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (342, 513)))
+
+        with Image.open(io.BytesIO(resize(poster(100, 150, 'PNG', 'RGBA'), 'thumb', 'jpg'))) as image:
+            self.assertEqual((image.format, image.size), ('JPEG', (100, 150)))
+
+    def test_fetches_each_image_once(self):
+        """ Is TMDB asked once per image, whatever the sizes and formats used? """
+
+        with patch.object(image_proxy, 'get_image', return_value=poster()) as get_image:
+            paths = {self.store.variant('abc.jpg', size, fmt)
+                     for size in ('thumb', 'card') for fmt in ('webp', 'jpg')}
+            self.assertEqual(self.store.variant('abc.jpg', 'card', 'jpg'),
+                             os.path.join(self.tmp.name, 'card', 'abc.jpg'))
+
+        get_image.assert_called_once_with('https://image.tmdb.org/t/p/w500/abc.jpg')
+        self.assertEqual(len(paths), 4)
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+
+    def test_missing_image(self):
+        """ Is nothing stored when TMDB has no such image? """
+
+        with patch.object(image_proxy, 'get_image', return_value=None):
+            self.assertIsNone(self.store.variant('missing.jpg', 'card', 'webp'))
+
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, 'card')))
@@ -0,0 +1,143 @@
+"""Instrumentation tests."""
+
+# python3 -m unittest test_instrumentation.py
+# to run all tests at once -> python -m unittest discover
+
+import time
+from unittest import TestCase
+from unittest.mock import patch
+from flask import Flask
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+import api_requests
+import instrumentation
+import tmdb_async
+from instrumentation import RequestStats, Histogram, timed, metrics_authorized
+from tmdb_cache import MemoryBackend, ResponseCache
+
+
+class RequestStatsTestCase(TestCase):
+    """ Test recording into the current request's stats. """
+
+    def setUp(self):
+        """ Run each test as if inside a request. """
+
+        self.stats = RequestStats()
+        token = instrumentation._current.set(self.stats)
+        self.addCleanup(instrumentation._current.reset, token)
+
+    def test_timed_records_count_and_duration(self):
+        """ Is a timed block counted, with its duration? """
+
+        with timed('tmdb'):
+            time.sleep(0.01)
+
+        self.assertEqual(self.stats.counts['tmdb'], 1)
+        self.assertGreaterEqual(self.stats.seconds['tmdb'], 0.01)
+        self.assertRegex(self.stats.server_timing(),
+                         r'^tmdb;dur=\d+\.\d;desc="1 calls", sql;dur=0.0;desc="0 calls", total;dur=')
+
+    def test_fetch_many_threads_record_into_request(self):
+        """ Are fetches fanned out to the thread pool counted for the request? """
+
+        def fetch(id):
+            with timed('tmdb'):
+                return id
+
+        api_requests.fetch_many(fetch, [1, 2, 3])
+
+        self.assertEqual(self.stats.counts['tmdb'], 3)
+
+    def test_async_fetches_record_into_request(self):
+        """ Are coroutines on the TMDB loop counted for the request? """
+
+        async def get_json_async(url):
+            with timed('tmdb'):
+                return {'title': 'movie', 'poster_path': None, 'popularity': 1}
+
+        with patch.object(api_requests, 'get_json_async', get_json_async), \
+             patch.object(api_requests, 'cache', ResponseCache(MemoryBackend(8))):
+            tmdb_async.run(api_requests.get_movie_summaries_many_async([1, 2]))
+
+        self.assertEqual(self.stats.counts['tmdb'], 2)
+
+    def test_sql_queries_recorded(self):
+        """ Is every cursor execution counted as sql? """
+
+        instrumentation.instrument_sql()
+
+        engine = create_engine('sqlite://')
+        with engine.connect() as conn:
+            conn.execute(text('SELECT 1'))
+            conn.execute(text('SELECT 2'))
+
+        self.assertEqual(self.stats.counts['sql'], 2)
+
+    def test_failed_sql_query_recorded(self):
+        """ Is a query that raises counted, without leaving its start time behind? """
+
+        instrumentation.instrument_sql()
+
+        engine = create_engine('sqlite://')
+        with engine.connect() as conn:
+            with self.assertRaises(OperationalError):
+                conn.execute(text('SELECT * FROM missing'))
+            self.assertEqual(conn.info['query_start'], [])
+
+        self.assertEqual(self.stats.counts['sql'], 1)
+
+    def test_nothing_recorded_outside_requests(self):
+        """ Is work outside a request ignored? """
+
+        instrumentation._current.set(None)
+        with timed('tmdb'):
+            pass
+
+        self.assertEqual(self.stats.counts['tmdb'], 0)
+
+
+class HistogramTestCase(TestCase):
+    """ Test the Prometheus text rendering. """
+
+    def test_render_cumulative_buckets(self):
+        """ Are buckets cumulative, with +Inf, sum and count per endpoint? """
+
+        histogram = Histogram('x_seconds', 'Some seconds.', (0.1, 1))
+        histogram.observe('home', 0.05)
+        histogram.observe('home', 0.5)
+        histogram.observe('home', 3)
+
+        self.assertEqual(histogram.render(), [
+            '# HELP x_seconds Some seconds.',
+            '# TYPE x_seconds histogram',
+            'x_seconds_bucket{endpoint="home",le="0.1"} 1',
+            'x_seconds_bucket{endpoint="home",le="1"} 2',
+            'x_seconds_bucket{endpoint="home",le="+Inf"} 3',
+            'x_seconds_sum{endpoint="home"} 3.55',
+            'x_seconds_count{endpoint="home"} 3',
+        ])
+
+
+class MetricsAuthorizedTestCase(TestCase):
+    """ Test who may read /metrics. """
+
+    def check(self, token, authorization=None):
+        headers = {'Authorization': authorization} if authorization else {}
+        with Flask(__name__).test_request_context('/metrics', headers=headers):
+            return metrics_authorized(token)
+
+    def test_bearer_token(self):
+        """ Is only the configured bearer token let in? """
+
+        self.assertTrue(self.check('secret', 'Bearer secret'))
+        self.assertTrue(self.check('secret', 'bearer secret'))
+        self.assertFalse(self.check('secret', 'Bearer other'))
+        self.assertFalse(self.check('secret', 'Basic secret'))
+        self.assertFalse(self.check('secret'))
+
+    def test_no_token_configured(self):
+        """ Is everyone kept out when no token is set? """
+
+        self.assertFalse(self.check('', 'Bearer '))
+        self.assertFalse(self.check(''))
@@ -0,0 +1,98 @@
+"""Metadata store tests."""
+
+# createdb MoviesBox_test
+# FLASK_ENV=production python3 -m unittest test_metadata_store.py
+# to run all tests at once -> python -m unittest discover
+
+import os, datetime
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+from models import db, User, FavoriteCasts, FavoriteMovies, MovieMetadata, CastMetadata
+
+# Set an environmental variable to use a different database for tests before importing app
+os.environ['DATABASE_URL'] = "postgresql:///MoviesBox_test"
+
+from app import app
+import metadata_store
+from metadata_store import get_favorite_movies_info, get_favorite_casts_info
+
+app.config['SQLALCHEMY_ECHO'] = False
+
+db.create_all()
+
+
+def movie_detail(id):
+    return {'title': f'Movie {id}', 'img_url': f'/img/{id}.jpg', 'popularity': 50.0,
+            'overview': '', 'runtime': 120, 'genres': [{'id': 28, 'name': 'Action'}],
+            'casts': [], 'director': {9: 'Someone'}, 'release_date': 'March 31, 1999',
+            'video_url': None}
+
+
+class MetadataStoreTestCase(TestCase):
+    """ Test the favorites metadata store. """
+
+    def setUp(self):
+        """ Add a user with two favorite movies and one cast. """
+
+        User.query.delete()
+        MovieMetadata.query.delete()
+        CastMetadata.query.delete()
+
+        self.user = User.signup(username="testuser", email="test@test.com",
+                                password="hashed_psw", image_profile=None)
+        self.user.id = 1111
+        db.session.commit()
+
+        db.session.add_all([
+            FavoriteMovies(id=603, title='The Matrix', user_id=1111),
+            FavoriteMovies(id=604, title='The Matrix Reloaded', user_id=1111),
+            FavoriteCasts(id=6384, name='Keanu Reeves', user_id=1111),
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        """ Clean up any failed transaction. """
+
+        db.session.rollback()
+
+    def test_missing_metadata_is_fetched_once(self):
+        """ Are movies without metadata fetched, stored and then read locally? """
+
+        fetch = MagicMock(side_effect=lambda ids: {id: movie_detail(id) for id in ids})
+
+        with patch.object(metadata_store, 'get_movie_details_many', fetch):
+            first = get_favorite_movies_info(1111).items
+            second = get_favorite_movies_info(1111).items
+
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertEqual([list(movie) for movie in second], [[604], [603]])
+        self.assertEqual(second[1][603]['title'], 'Movie 603')
+        self.assertEqual(second[1][603]['release_date'], 'March 31, 1999')
+
+    def test_stale_metadata_is_queued(self):
+        """ Is stale metadata served as-is and refreshed in the background? """
+
+        db.session.add(CastMetadata(id=6384, name='Keanu Reeves', img_url='/img/k.jpg',
+                                    refreshed_at=datetime.datetime(2000, 1, 1)))
+        db.session.commit()
+        queue = MagicMock()
+
+        with patch.object(metadata_store, 'fetch_many') as fetch:
+            casts = get_favorite_casts_info(1111, queue=queue).items
+
+        fetch.assert_not_called()
+        self.assertEqual(casts, [{6384: {'name': 'Keanu Reeves', 'img_url': '/img/k.jpg'}}])
+        queue.submit.assert_called_once()
+
+    def test_only_visible_page_is_fetched(self):
+        """ Is metadata only fetched for the favorites on the requested page? """
+
+        fetch = MagicMock(side_effect=lambda ids: {id: movie_detail(id) for id in ids})
+
+        with patch.object(metadata_store, 'get_movie_details_many', fetch):
+            page = get_favorite_movies_info(1111, page_args={'after': None, 'before': None, 'limit': 1})
+
+        fetch.assert_called_once_with([604])
+        self.assertIsNotNone(page.next_cursor)
+        self.assertIsNone(page.prev_cursor)
@@ -0,0 +1,143 @@
+"""Movie recommender tests."""
+
+# python3 -m unittest test_movie_recommender.py
+# to run all tests at once -> python -m unittest discover
+
+import os, tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+import movie_recommender
+from movie_recommender import Recommender, build, save, top_k_neighbors, get_recommender
+
+
+CORPUS = pd.DataFrame([
+    {'id': 603, 'title': 'The Matrix', 'popularity': 80.0,
+     'overview': 'A hacker learns the world is a simulation run by machines and joins the rebels.',
+     'genres': ['Action', 'Science Fiction'], 'cast': ['Keanu Reeves', 'Laurence Fishburne', 'Carrie-Anne Moss'],
+     'director': ['Lana Wachowski'], 'keywords': ['simulation', 'hacker']},
+    {'id': 604, 'title': 'The Matrix Reloaded', 'popularity': 40.0,
+     'overview': 'The rebels fight the machines as the simulation closes in on the last human city.',
+     'genres': ['Action', 'Science Fiction'], 'cast': ['Keanu Reeves', 'Laurence Fishburne', 'Carrie-Anne Moss'],
+     'director': ['Lana Wachowski'], 'keywords': ['simulation']},
+    {'id': 245891, 'title': 'John Wick', 'popularity': 60.0,
+     'overview': 'A retired hitman seeks vengeance for the killing of his dog.',
+     'genres': ['Action', 'Thriller'], 'cast': ['Keanu Reeves', 'Michael Nyqvist'],
+     'director': ['Chad Stahelski'], 'keywords': ['hitman', 'revenge']},
+    {'id': 13, 'title': 'Forrest Gump', 'popularity': 50.0,
+     'overview': 'A kind man from Alabama witnesses decades of American history.',
+     'genres': ['Comedy', 'Drama', 'Romance'], 'cast': ['Tom Hanks', 'Robin Wright'],
+     'director': ['Robert Zemeckis'], 'keywords': ['history']},
+])
+
+
+class TopKTestCase(TestCase):
+    """ Test the blockwise neighbor search. """
+
+    def test_blocks_match_dense_cosine(self):
+        """ Do small blocks find the same neighbors as the full cosine matrix? """
+
+        features = normalize(sparse.random(50, 40, density=0.2, format='csr', random_state=7))
+        neighbors, scores = top_k_neighbors(features, 5, block_bytes=4 * 50 * 3)
+
+        dense = (features @ features.T).toarray()
+        np.fill_diagonal(dense, -np.inf)
+        expected = np.sort(dense, axis=1)[:, ::-1][:, :5]
+
+        np.testing.assert_allclose(scores, expected, rtol=1e-5)
+        self.assertFalse((neighbors == np.arange(50)[:, None]).any())
+
+    def test_k_larger_than_corpus(self):
+        """ Is k capped at the number of other movies? """
+
+        features = normalize(sparse.random(3, 4, density=1, format='csr', random_state=1))
+        neighbors, scores = top_k_neighbors(features, 10)
+
+        self.assertEqual(neighbors.shape, (3, 2))
+
+
+class RecommenderTestCase(TestCase):
+    """ Test building, saving and querying an index. """
+
+    def setUp(self):
+        """ Build and save the sample corpus. """
+
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.root = os.path.join(self.dir.name, 'recommender')
+
+        self.directory = save(build(CORPUS, k=3), self.root)
+        self.recommender = Recommender.load(self.directory)
+
+    def test_sequel_is_most_similar(self):
+        """ Is the sequel suggested first, and the movie itself never? """
+
+        suggestions = self.recommender.movie_suggestions(603)
+
+        self.assertEqual(list(suggestions)[0], 604)
+        self.assertEqual(suggestions[604], 'The Matrix Reloaded')
+        self.assertNotIn(603, suggestions)
+
+    def test_limit_and_unknown_id(self):
+        """ Are suggestions capped, and unknown ids answered with nothing? """
+
+        self.assertEqual(len(self.recommender.movie_suggestions(603, limit=1)), 1)
+        self.assertEqual(self.recommender.movie_suggestions(999), {})
+        self.assertEqual(self.recommender.movie_suggestions(1), {})
+        self.assertNotIn(999, self.recommender)
+
+    def test_find_by_title(self):
+        """ Are titles matched regardless of case and punctuation? """
+
+        self.assertEqual(self.recommender.find('the MATRIX!'), 603)
+        self.assertEqual(self.recommender.title(245891), 'John Wick')
+        self.assertIsNone(self.recommender.find('Matrix 4'))
+
+    def test_arrays_are_memory_mapped(self):
+        """ Are the arrays mapped from disk instead of read into the heap? """
+
+        self.assertIsInstance(self.recommender.neighbors.base, np.memmap)
+        self.assertFalse(self.recommender.neighbors.flags.writeable)
+        self.assertEqual(self.recommender.neighbors.dtype, np.int32)
+        self.assertEqual(self.recommender.scores.dtype, np.float32)
+
+    def test_missing_index(self):
+        """ Is a missing index reported as None instead of raising? """
+
+        self.assertIsNone(get_recommender(os.path.join(self.dir.name, 'missing')))
+
+    def test_failed_load_is_retried(self):
+        """ Is the loaded version kept through a failed load of a new one, which is retried? """
+
+        self.assertEqual(get_recommender(self.root).find('John Wick'), 245891)
+
+        renamed = CORPUS.assign(title=CORPUS['title'].replace('John Wick', 'John Wick: Chapter 1'))
+        save(build(renamed, k=3), self.root)
+
+        with patch.object(Recommender, 'load', side_effect=OSError('Stale file handle')):
+            self.assertEqual(get_recommender(self.root).find('John Wick'), 245891)
+
+        self.assertEqual(get_recommender(self.root).find('John Wick Chapter 1'), 245891)
+
+    def test_new_version_is_picked_up(self):
+        """ Does get_recommender switch to a newly published version, and
+        are old versions pruned? """
+
+        self.assertEqual(get_recommender(self.root).find('John Wick'), 245891)
+
+        renamed = CORPUS.assign(title=CORPUS['title'].replace('John Wick', 'John Wick: Chapter 1'))
+        for _ in range(movie_recommender.KEEP_VERSIONS + 1):
+            save(build(renamed, k=3), self.root)
+
+        recommender = get_recommender(self.root)
+        self.assertEqual(recommender.find('John Wick Chapter 1'), 245891)
+        self.assertIsNone(recommender.find('John Wick'))
+        self.assertEqual(len(os.listdir(os.path.join(self.root, 'versions'))), movie_recommender.KEEP_VERSIONS)
+        # The old mapping still works after its files are gone
+        self.assertFalse(os.path.exists(self.directory))
+        self.assertEqual(self.recommender.find('John Wick'), 245891)
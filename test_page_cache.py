@@ -0,0 +1,152 @@
+"""Page cache tests."""
+
+# python3 -m unittest test_page_cache.py
+# to run all tests at once -> python -m unittest discover
+
+from unittest import TestCase
+from flask import Flask, session, flash, redirect, render_template_string
+
+from instrumentation import instrument_app
+from page_cache import PageCache
+
+
+def make_app(ttl=60):
+    """ An app with one cached detail page, and routes to log in and flash. """
+
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.renders = []
+    app.page_cache = page_cache = PageCache(ttl, 'curr_user')
+    app.after_request(page_cache.mark_login)
+
+    @app.before_request
+    def read_session():
+        # As extensions may, on any request
+        session.get('csrf_token')
+
+    @app.route('/movie_detail/<id>')
+    @page_cache.cached
+    async def show_movie_detail(id):
+        app.renders.append(id)
+        if id == 'gone':
+            return redirect('/')
+        return render_template_string('{% for m in get_flashed_messages() %}{{ m }} {% endfor %}movie {{ id }}', id=id)
+
+    @app.route('/login')
+    def login():
+        session['curr_user'] = 1
+        return 'ok'
+
+    @app.route('/logout')
+    def logout():
+        session.pop('curr_user', None)
+        return 'ok'
+
+    @app.route('/form')
+    def form():
+        session['csrf_token'] = 'token'
+        return 'ok'
+
+    @app.route('/flash')
+    def flash_message():
+        flash('Movie added')
+        return 'ok'
+
+    return app
+
+
+class PageCacheTestCase(TestCase):
+    """ Test caching pages of anonymous visitors. """
+
+    def setUp(self):
+        self.app = make_app()
+        self.client = self.app.test_client()
+
+    def test_anonymous_pages_are_cached(self):
+        """ Is an anonymous page rendered once per url and marked public? """
+
+        first = self.client.get('/movie_detail/603')
+        second = self.app.test_client().get('/movie_detail/603')
+        self.client.get('/movie_detail/603?page=2')
+
+        self.assertEqual(self.app.renders, ['603', '603'])
+        self.assertEqual(second.data, b'movie 603')
+        self.assertEqual(first.headers['ETag'], second.headers['ETag'])
+        self.assertEqual(first.headers['Cache-Control'], 'public, max-age=0, s-maxage=60')
+        self.assertNotIn('Vary', first.headers)
+
+    def test_session_cookies_share_public_pages(self):
+        """ Does a visitor with a session but no login get the shared page, without Vary: Cookie? """
+
+        self.client.get('/movie_detail/603')
+        self.client.get('/form')
+        resp = self.client.get('/movie_detail/603')
+
+        self.assertEqual(self.app.renders, ['603'])
+        self.assertEqual(resp.headers['Cache-Control'], 'public, max-age=0, s-maxage=60')
+        self.assertNotIn('Vary', resp.headers)
+        self.assertNotIn('Set-Cookie', resp.headers)
+
+    def test_login_cookie(self):
+        """ Is the login marker set at login, kept, and dropped at logout? """
+
+        self.assertNotIn('Set-Cookie', self.client.get('/movie_detail/603').headers)
+
+        self.assertIn('logged_in=1', ' '.join(self.client.get('/login').headers.getlist('Set-Cookie')))
+        resp = self.client.get('/movie_detail/603')
+        self.assertNotIn('logged_in', ' '.join(resp.headers.getlist('Set-Cookie')))
+        self.assertEqual(resp.headers['Vary'], 'Cookie')
+
+        cookies = ' '.join(self.client.get('/logout').headers.getlist('Set-Cookie'))
+        self.assertIn('logged_in=;', cookies)
+        self.assertIsNone(self.client.get_cookie('logged_in'))
+
+    def test_if_none_match(self):
+        """ Is a page the client already has answered with an empty 304? """
+
+        etag = self.client.get('/movie_detail/603').headers['ETag']
+        resp = self.client.get('/movie_detail/603', headers={'If-None-Match': etag})
+
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b'')
+
+    def test_logged_in_and_flashes_skip_the_cache(self):
+        """ Do logged-in users and pending flash messages get freshly rendered, private pages? """
+
+        self.client.get('/movie_detail/603')
+
+        self.client.get('/flash')
+        resp = self.client.get('/movie_detail/603')
+        self.assertEqual(resp.data, b'Movie added movie 603')
+        self.assertEqual(resp.headers['Cache-Control'], 'private, no-cache')
+
+        self.client.get('/login')
+        resp = self.client.get('/movie_detail/603')
+        self.assertEqual(resp.headers['Cache-Control'], 'private, no-cache')
+        self.assertEqual(self.client.get('/movie_detail/603', headers={'If-None-Match': resp.headers['ETag']}).status_code, 304)
+
+        self.assertEqual(self.app.renders, ['603'] * 4)
+
+    def test_redirects_and_disabled_cache(self):
+        """ Are redirects passed through, and nothing kept with a ttl of 0? """
+
+        self.assertEqual(self.client.get('/movie_detail/gone').status_code, 302)
+
+        app = make_app(ttl=0)
+        app.test_client().get('/movie_detail/603')
+        resp = app.test_client().get('/movie_detail/603')
+        self.assertEqual(app.renders, ['603', '603'])
+        self.assertEqual(resp.headers['Cache-Control'], 'private, no-cache')
+
+    def test_public_pages_have_no_server_timing(self):
+        """ Is the request's Server-Timing kept off pages a CDN may store? """
+
+        instrument_app(self.app)
+
+        resp = self.client.get('/movie_detail/603')
+        self.assertEqual(resp.headers['Cache-Control'], 'public, max-age=0, s-maxage=60')
+        self.assertNotIn('Server-Timing', resp.headers)
+
+        self.client.get('/login')
+        resp = self.client.get('/movie_detail/603')
+        self.assertIn('Server-Timing', resp.headers)
@@ -0,0 +1,58 @@
+"""Suggestion store tests."""
+
+# createdb MoviesBox_test
+# FLASK_ENV=production python3 -m unittest test_suggestion_store.py
+# to run all tests at once -> python -m unittest discover
+
+import os, datetime
+from unittest import TestCase
+from models import db, SuggestionSet
+
+# Set an environmental variable to use a different database for tests before importing app
+os.environ['DATABASE_URL'] = "postgresql:///MoviesBox_test"
+
+from app import app
+from suggestion_store import save, load, purge, set_key
+
+app.config['SQLALCHEMY_ECHO'] = False
+
+db.create_all()
+
+
+class SuggestionStoreTestCase(TestCase):
+    """ Test storing search results server-side. """
+
+    def setUp(self):
+        """ Start from an empty store. """
+
+        SuggestionSet.query.delete()
+        db.session.commit()
+
+    def tearDown(self):
+        """ Clean up any failed transaction. """
+
+        db.session.rollback()
+
+    def test_save_and_load(self):
+        """ Are ids stored in order under a short key shared by equal results? """
+
+        key = save({603: 'The Matrix', 604: 'The Matrix Reloaded', 13: 'Forrest Gump'})
+
+        self.assertEqual(len(key), 16)
+        self.assertEqual(load(key), [603, 604, 13])
+        self.assertEqual(save(['603', '604', '13']), key)
+        self.assertNotEqual(set_key([604, 603, 13]), key)
+        self.assertEqual(SuggestionSet.query.count(), 1)
+        self.assertIsNone(load('unknown'))
+
+    def test_expired_sets(self):
+        """ Are sets past SUGGESTION_TTL neither loaded nor kept by purge()? """
+
+        old = save([603])
+        SuggestionSet.query.get(old).saved_at -= datetime.timedelta(seconds=app.config['SUGGESTION_TTL'] + 1)
+        db.session.commit()
+        new = save([604])
+
+        self.assertIsNone(load(old))
+        self.assertEqual(purge(), 1)
+        self.assertEqual(load(new), [604])
@@ -0,0 +1,274 @@
+"""TMDB response cache tests."""
+
+# python3 -m unittest test_tmdb_cache.py
+# to run all tests at once -> python -m unittest discover
+
+import os, time, asyncio, tempfile, threading
+from unittest import TestCase
+from unittest.mock import patch
+
+import api_requests
+import tmdb_async
+from tmdb_cache import MemoryBackend, SQLiteBackend, ResponseCache
+from tmdb_client import TMDBError
+
+
+class ResponseCacheTestCase(TestCase):
+    """ Test the cache with both backends. """
+
+    def setUp(self):
+        """ Create a fresh cache for each backend. """
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.backends = [
+            MemoryBackend(2),
+            SQLiteBackend(os.path.join(self.tmpdir.name, 'cache.sqlite3'), 2),
+        ]
+
+    def tearDown(self):
+        """ Remove the sqlite file. """
+
+        self.tmpdir.cleanup()
+
+    def test_get_returns_copies(self):
+        """ Can a caller mutate a payload without corrupting the cache? """
+
+        for backend in self.backends:
+            cache = ResponseCache(backend)
+            cache.set('movie', '603', {'title': 'The Matrix', 'genres': []})
+
+            payload = cache.get('movie', '603')
+            payload['genres'].append('Action')
+
+            self.assertEqual(cache.get('movie', '603'), {'title': 'The Matrix', 'genres': []})
+
+    def test_hits_and_misses(self):
+        """ Are hits and misses counted per endpoint? """
+
+        for backend in self.backends:
+            cache = ResponseCache(backend)
+            cache.get('movie', '603')
+            cache.set('movie', '603', {'title': 'The Matrix'})
+            cache.get('movie', '603')
+            cache.get('person', '6384')
+
+            self.assertEqual(cache.stats(), {'movie': {'hits': 1, 'misses': 1},
+                                             'person': {'hits': 0, 'misses': 1}})
+
+    def test_ttl_zero_disables_endpoint(self):
+        """ Is an endpoint with a zero TTL never stored? """
+
+        for backend in self.backends:
+            cache = ResponseCache(backend, ttls={'search': 0})
+            cache.set('search', 'matrix', {'results': []})
+
+            self.assertIsNone(cache.get('search', 'matrix'))
+
+    def test_lru_eviction(self):
+        """ Is the least recently used entry evicted first? """
+
+        for backend in self.backends:
+            cache = ResponseCache(backend)
+            cache.set('movie', '1', {'id': 1})
+            cache.set('movie', '2', {'id': 2})
+            cache.get('movie', '1')
+            cache.set('movie', '3', {'id': 3})
+            if isinstance(backend, SQLiteBackend):
+                backend.evict()
+
+            self.assertIsNotNone(cache.get('movie', '1'))
+            self.assertIsNone(cache.get('movie', '2'))
+            self.assertIsNotNone(cache.get('movie', '3'))
+
+    def test_sqlite_lease(self):
+        """ Is a fill lease exclusive until it is released or runs out? """
+
+        backend = self.backends[1]
+
+        self.assertTrue(backend.lease('movie:1', 60))
+        self.assertFalse(backend.lease('movie:1', 60))
+        self.assertTrue(backend.lease('movie:2', 60))
+
+        backend.release('movie:1')
+        self.assertTrue(backend.lease('movie:1', 0.05))
+        time.sleep(0.1)
+        self.assertTrue(backend.lease('movie:1', 60))
+
+
+class CachedGetJsonTestCase(TestCase):
+    """ Test the cache wiring in api_requests. """
+
+    def setUp(self):
+        """ Swap in an empty cache. """
+
+        self.cache = ResponseCache(MemoryBackend(16))
+        patcher = patch.object(api_requests, 'cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_second_call_served_from_cache(self):
+        """ Does a repeated fetch skip the API? """
+
+        with patch.object(api_requests, 'get_json', return_value={'id': 603}) as get_json:
+            api_requests.get_movie(603)
+            api_requests.get_movie(603)
+
+        self.assertEqual(get_json.call_count, 1)
+
+    def test_error_payload_not_cached(self):
+        """ Are TMDB error payloads fetched again next time? """
+
+        error = {'success': False, 'status_code': 34}
+        with patch.object(api_requests, 'get_json', return_value=error) as get_json:
+            api_requests.get_movie(1)
+            api_requests.get_movie(1)
+
+        self.assertEqual(get_json.call_count, 2)
+
+    def test_cache_key_drops_api_key(self):
+        """ Is the api key kept out of cache keys? """
+
+        key = api_requests.cache_key('https://x/movie/1?api_key=secret&language=en')
+        self.assertEqual(key, 'https://x/movie/1?language=en')
+
+
+class SingleFlightTestCase(TestCase):
+    """ Test that concurrent misses of one url share a single fetch. """
+
+    def setUp(self):
+        """ Swap in an empty cache and a slow, counting TMDB. """
+
+        self.cache = ResponseCache(MemoryBackend(16))
+        patcher = patch.object(api_requests, 'cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.calls = 0
+        self.error = None
+
+        def get_json(url):
+            self.calls += 1
+            time.sleep(0.2)
+            if self.error:
+                raise self.error
+            return {'id': 603, 'reviews': []}
+
+        async def get_json_async(url):
+            self.calls += 1
+            await asyncio.sleep(0.2)
+            return {'id': 603, 'reviews': []}
+
+        for name, fake in (('get_json', get_json), ('get_json_async', get_json_async)):
+            patcher = patch.object(api_requests, name, fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def in_threads(self, func, count=8):
+        results, errors = [], []
+
+        def call():
+            try:
+                results.append(func())
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_threads_share_one_fetch(self):
+        """ Do concurrent threads make one request and each get their own copy? """
+
+        results, errors = self.in_threads(lambda: api_requests.get_movie(603))
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(result == {'id': 603, 'reviews': []} for result in results))
+        self.assertEqual(len({id(result) for result in results}), 8)
+        self.assertEqual(len(api_requests.flights), 0)
+
+    def test_coroutines_and_threads_share_one_fetch(self):
+        """ Does a thread join a fetch a coroutine on the TMDB loop started? """
+
+        async def many():
+            return await asyncio.gather(*(api_requests.get_movie_async(603) for _ in range(5)))
+
+        future = tmdb_async.submit(many())
+        time.sleep(0.05)
+        results, errors = self.in_threads(lambda: api_requests.get_movie(603), count=3)
+
+        self.assertEqual(len(future.result()), 5)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(self.calls, 1)
+
+    def test_failure_reaches_every_waiter(self):
+        """ Does every waiter see the leader's error, and the next call try again? """
+
+        self.error = TMDBError('rate limited')
+        results, errors = self.in_threads(lambda: api_requests.get_movie(603), count=4)
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(len(errors), 4)
+
+        self.error = None
+        self.assertEqual(api_requests.get_movie(603)['id'], 603)
+        self.assertEqual(self.calls, 2)
+
+
+class CacheLeaseTestCase(TestCase):
+    """ Test waiting on another worker's fill through the shared cache. """
+
+    def setUp(self):
+        """ A sqlite cache, as a second worker would open it too. """
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        path = os.path.join(self.tmpdir.name, 'cache.sqlite3')
+        self.cache = ResponseCache(SQLiteBackend(path, 16))
+        self.other_worker = ResponseCache(SQLiteBackend(path, 16))
+
+        for name, value in (('cache', self.cache), ('CACHE_LEASE', 2), ('LEASE_POLL', 0.01)):
+            patcher = patch.object(api_requests, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.url = api_requests.movie_url(603)
+        self.key = api_requests.cache_key(self.url)
+
+    def test_waits_for_other_workers_fill(self):
+        """ Is a url another worker is fetching read from the cache once it lands? """
+
+        self.assertTrue(self.other_worker.lease('movie', self.key, 2))
+
+        def land():
+            time.sleep(0.1)
+            self.other_worker.set('movie', self.key, {'id': 603})
+            self.other_worker.release('movie', self.key)
+        threading.Thread(target=land).start()
+
+        with patch.object(api_requests, 'get_json') as get_json:
+            self.assertEqual(api_requests.get_movie(603), {'id': 603})
+        get_json.assert_not_called()
+
+    def test_fetches_when_other_worker_gives_up(self):
+        """ Does a waiter fetch itself once the lease is released without a fill? """
+
+        self.assertTrue(self.other_worker.lease('movie', self.key, 2))
+
+        def give_up():
+            time.sleep(0.1)
+            self.other_worker.release('movie', self.key)
+        threading.Thread(target=give_up).start()
+
+        start = time.monotonic()
+        with patch.object(api_requests, 'get_json', return_value={'id': 603}) as get_json:
+            self.assertEqual(api_requests.get_movie(603), {'id': 603})
+
+        self.assertEqual(get_json.call_count, 1)
+        self.assertLess(time.monotonic() - start, 1)
+        # Its own lease is released again
+        self.assertTrue(self.other_worker.lease('movie', self.key, 2))
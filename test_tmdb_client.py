@@ -0,0 +1,68 @@
+"""TMDB client tests."""
+
+# python3 -m unittest test_tmdb_client.py
+# to run all tests at once -> python -m unittest discover
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+import requests
+import tmdb_client
+from tmdb_client import get_session, get_json, make_session, TMDBError, RETRY_STATUSES
+
+
+class TMDBClientTestCase(TestCase):
+    """ Test the pooled TMDB session. """
+
+    def test_session_is_reused(self):
+        """ Does every call in a process share one session? """
+
+        self.assertIs(get_session(), get_session())
+
+    def test_session_recreated_after_fork(self):
+        """ Is a session inherited from another process discarded? """
+
+        session = get_session()
+
+        with patch.object(tmdb_client.os, 'getpid', return_value=os.getpid() + 1):
+            self.assertIsNot(get_session(), session)
+
+    def test_session_pool_and_retries(self):
+        """ Does the adapter honor the configured pool size and retry policy? """
+
+        settings = dict(tmdb_client.client_settings(), pool_size=7, max_retries=2)
+        adapter = make_session(settings).get_adapter('https://api.themoviedb.org/3/')
+
+        self.assertEqual(adapter._pool_maxsize, 7)
+        self.assertEqual(adapter.max_retries.total, 2)
+        self.assertEqual(tuple(adapter.max_retries.status_forcelist), RETRY_STATUSES)
+
+    def test_get_json_connection_error(self):
+        """ Are connection failures surfaced as TMDBError? """
+
+        with patch.object(requests.Session, 'get', side_effect=requests.ConnectionError):
+            with self.assertRaises(TMDBError):
+                get_json('https://api.themoviedb.org/3/movie/603')
+
+    def test_get_json_error_status(self):
+        """ Is a 503 with an HTML body, left after the retries, surfaced as TMDBError? """
+
+        res = requests.Response()
+        res.status_code = 503
+        res._content = b'<html><body>Service Unavailable</body></html>'
+
+        with patch.object(requests.Session, 'get', return_value=res):
+            with self.assertRaises(TMDBError):
+                get_json('https://api.themoviedb.org/3/movie/603')
+
+    def test_get_json_not_json(self):
+        """ Is a 200 whose body isn't JSON surfaced as TMDBError? """
+
+        res = requests.Response()
+        res.status_code = 200
+        res._content = b'<html></html>'
+
+        with patch.object(requests.Session, 'get', return_value=res):
+            with self.assertRaises(TMDBError):
+                get_json('https://api.themoviedb.org/3/movie/603')
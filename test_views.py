@@ -4,14 +4,18 @@
 # FLASK_ENV=production python3 -m unittest test_views.py
 # to run all tests at once -> python -m unittest discover
 
-import os
+import io, os, tempfile
 from unittest import TestCase
+from unittest.mock import patch
+from PIL import Image
+from sqlalchemy import event
 from models import db, User, FavoriteCasts, FavoriteMovies
 
 # Set an environmental variable to use a different database for tests before importing app
 os.environ['DATABASE_URL'] = "postgresql:///MoviesBox_test"
 
-from app import app, CURR_USER_KEY
+from app import app, CURR_USER_KEY, identity_cache, review_sample_cache, image_store
+import image_proxy
 
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['TESTING'] = True
@@ -135,6 +139,42 @@ class ViewTestCase(TestCase):
             self.assertIn('<div class="card-header"><b>Avatar: The Way of Water</b></div>', html)
 
 
+    def test_show_suggestions_expired(self):
+        """ Are unknown or expired suggestion keys sent back to the homepage? """
+
+        with self.client as c:
+            resp = c.get("/suggestions?key=unknown", follow_redirects=True)
+
+            self.assertEqual(resp.status_code, 200)
+            html = resp.get_data(as_text=True)
+            self.assertIn('These suggestions have expired, please search again.', html)
+
+
+    def test_show_image(self):
+        """ Are TMDB images served resized, cacheable for good, in a format the browser takes? """
+
+        with tempfile.TemporaryDirectory() as tmp, \
+             patch.object(image_store, 'root', tmp), \
+             patch.object(image_proxy, 'get_image', return_value=self.poster()):
+
+            resp = self.client.get('/images/card/abc.jpg', headers={'Accept': 'image/webp,*/*'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.mimetype, 'image/webp')
+            self.assertIn('immutable', resp.headers['Cache-Control'])
+            self.assertIn('Accept', resp.headers['Vary'])
+
+            resp = self.client.get('/images/card/abc.jpg')
+            self.assertEqual(resp.mimetype, 'image/jpeg')
+
+        self.assertEqual(self.client.get('/images/huge/abc.jpg').status_code, 404)
+        self.assertEqual(self.client.get('/images/card/abc.exe').status_code, 404)
+
+    def poster(self):
+        out = io.BytesIO()
+        Image.new('RGB', (500, 750), 'teal').save(out, 'JPEG')
+        return out.getvalue()
+
+
     def test_show_movie_detail(self):
         """ Test the show movie detail view. """
 
@@ -358,4 +398,105 @@ class ViewTestCase(TestCase):
             resp = c.get(f"/favorite_casts/{self.casttest.id}/delete", follow_redirects=True)
             self.assertEqual(resp.status_code, 200)
             html = resp.get_data(as_text=True)
-            self.assertIn('<div class="alert alert-danger">Please sign up or login</div>', html)
\ No newline at end of file
+            self.assertIn('<div class="alert alert-danger">Please sign up or login</div>', html)
+
+
+    def test_edit_profile_refreshes_navbar(self):
+        """ Does the navbar show the new username right after a profile edit? """
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.get("/login")
+
+            profile = {"username": "renamed", "email": "test@test.com",
+                       "password": "hashed_psw", "image_profile": ""}
+            resp = c.post("/users/edit", data=profile, follow_redirects=True)
+
+            self.assertEqual(resp.status_code, 200)
+            html = resp.get_data(as_text=True)
+            self.assertIn('renamed', html)
+            self.assertNotIn('testuser', html)
+
+
+    def test_cached_identity_skips_user_query(self):
+        """ Is the logged-in user read from the identity cache instead of the db? """
+
+        statements = []
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            identity_cache.invalidate(self.testuser.id)
+            c.get("/login")
+
+            event.listen(db.engine, "before_cursor_execute", record)
+            try:
+                resp = c.get("/login")
+            finally:
+                event.remove(db.engine, "before_cursor_execute", record)
+
+            self.assertIn('testuser', resp.get_data(as_text=True))
+            self.assertEqual(statements, [])
+
+
+    def test_show_all_reviews(self):
+        """ Does the reviews page render with fewer than five reviews? """
+
+        review_sample_cache.clear()
+
+        with self.client as c:
+            resp = c.get("/all_reviews")
+
+            self.assertEqual(resp.status_code, 200)
+            html = resp.get_data(as_text=True)
+            self.assertIn('Batman Begins is a great movie', html)
+
+
+    def test_user_reviews_pagination(self):
+        """ Can a user page through their reviews with next/previous links? """
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.get(f'/users/{self.testuser.id}/reviews?limit=1')
+            html = resp.get_data(as_text=True)
+            self.assertNotIn('Batman Begins is a great movie', html)
+            self.assertIn(f'href="/users/{self.testuser.id}/reviews?after=1001&amp;limit=1"', html)
+
+            resp = c.get(f'/users/{self.testuser.id}/reviews?after=1001&limit=1')
+            html = resp.get_data(as_text=True)
+            self.assertIn('Batman Begins is a great movie', html)
+            self.assertIn(f'href="/users/{self.testuser.id}/reviews?before=1000&amp;limit=1"', html)
+            self.assertNotIn('Next &raquo;', html)
+
+
+    def test_server_timing_and_metrics(self):
+        """ Are a request's SQL queries reported and aggregated per endpoint? """
+
+        identity_cache.invalidate(self.testuser.id)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.get(f'/users/{self.testuser.id}/reviews')
+            timing = resp.headers['Server-Timing']
+            self.assertIn('tmdb;dur=0.0;desc="0 calls"', timing)
+            self.assertRegex(timing, r'sql;dur=[\d.]+;desc="[1-9]\d* calls"')
+
+            # Hidden without the scraper's token
+            self.assertEqual(c.get('/metrics').status_code, 404)
+
+            with patch.dict(app.config, METRICS_TOKEN='scrape-me'):
+                self.assertEqual(c.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code, 404)
+                resp = c.get('/metrics', headers={'Authorization': 'Bearer scrape-me'})
+            text = resp.get_data(as_text=True)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('moviesbox_request_duration_seconds_count{endpoint="show_user_reviews"}', text)
+            self.assertIn('moviesbox_sql_calls_bucket{endpoint="show_user_reviews",le="0"} 0', text)
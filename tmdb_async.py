@@ -0,0 +1,133 @@
+"""Asyncio client for the TMDB API.
+
+Each worker process runs one event loop on a daemon thread, with one pooled
+httpx.AsyncClient on it. Coroutines from any request thread are handed to
+that loop, so every in-flight TMDB call of the process shares one set of
+keep-alive connections and a fan-out costs coroutines, not threads.
+"""
+
+import os, asyncio, contextvars, threading
+from concurrent.futures import Future
+import httpx
+
+from tmdb_client import TMDBError, RETRY_STATUSES, client_settings, decode_json
+from instrumentation import timed
+
+
+_loop = None
+_client = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+
+def get_loop():
+    """ The TMDB event loop of this process, started on first use. """
+
+    global _loop, _client, _loop_pid
+
+    pid = os.getpid()
+    if _loop is None or _loop_pid != pid:
+        with _loop_lock:
+            if _loop is None or _loop_pid != pid:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='tmdb-async', daemon=True).start()
+                _client = None
+                _loop = loop
+                _loop_pid = pid
+
+    return _loop
+
+
+def make_client(settings=None):
+    """ An AsyncClient sized and timed like the sync session. """
+
+    settings = settings or client_settings()
+
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=settings['pool_size'],
+                            max_keepalive_connections=settings['pool_size']),
+        timeout=httpx.Timeout(settings['read_timeout'], connect=settings['connect_timeout']),
+        headers={'Accept': 'application/json'},
+    )
+
+
+def get_client():
+    """ The AsyncClient of this process; only call from the TMDB loop. """
+
+    global _client
+
+    if _client is None:
+        _client = make_client()
+    return _client
+
+
+def retry_delay(res, attempt, backoff_factor):
+    """ Seconds to wait before the next attempt, honoring Retry-After. """
+
+    retry_after = res.headers.get('Retry-After') if res is not None else None
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return backoff_factor * (2 ** attempt)
+
+
+async def get_json_async(url):
+    """ GET a TMDB url, retrying with backoff on 429/5xx and connection errors. """
+
+    settings = client_settings()
+    client = get_client()
+
+    for attempt in range(settings['max_retries'] + 1):
+        res = None
+        try:
+            with timed('tmdb'):
+                res = await client.get(url)
+        except httpx.TransportError as e:
+            if attempt == settings['max_retries']:
+                raise TMDBError('not connected to internet or movidb issue') from e
+        else:
+            if res.status_code not in RETRY_STATUSES or attempt == settings['max_retries']:
+                return decode_json(res)
+
+        await asyncio.sleep(retry_delay(res, attempt, settings['backoff_factor']))
+
+
+def submit(coro):
+    """ Schedule coro on the TMDB loop and return a concurrent Future.
+
+    The caller's context variables (Flask's request and app contexts among
+    them) are copied into the task. """
+
+    loop = get_loop()
+    context = contextvars.copy_context()
+    future = Future()
+
+    def done(task):
+        if task.cancelled():
+            future.cancel()
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
+
+    def start():
+        # Tasks copy the current context when created, so create it inside ours
+        task = context.run(loop.create_task, coro)
+        task.add_done_callback(done)
+
+    loop.call_soon_threadsafe(start)
+    return future
+
+
+def run(coro):
+    """ Run coro on the TMDB loop and block the calling thread for its result. """
+
+    return submit(coro).result()
+
+
+async def wait(coro):
+    """ Await coro, running on the TMDB loop, from any other event loop.
+
+    This is what async views use: the view's own loop only waits on a future
+    while the HTTP work shares the process-wide connection pool. """
+
+    return await asyncio.wrap_future(submit(coro))
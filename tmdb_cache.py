@@ -0,0 +1,274 @@
+"""Response cache for TMDB payloads.
+
+Payloads are stored as JSON text so callers always get a fresh copy they are
+free to mutate. Two backends are available:
+
+* memory -- a per-process TTL + LRU cache (cachetools).
+* sqlite -- a file shared by every gunicorn worker on the machine.
+
+SingleFlight and the fill leases keep a cold key from being fetched by
+every caller that misses it at once.
+"""
+
+import os, json, sqlite3, threading, time
+from collections import Counter
+from concurrent.futures import Future
+from cachetools import TLRUCache
+
+
+# Seconds a payload stays fresh, per TMDB endpoint
+DEFAULT_TTLS = {
+    'movie': 6 * 60 * 60,
+    'movie_summary': 6 * 60 * 60,
+    'person': 24 * 60 * 60,
+    'discover': 60 * 60,
+    'trending': 60 * 60,
+    'genres': 24 * 60 * 60,
+    'search': 60 * 60,
+}
+
+
+class MemoryBackend:
+    """ In-process cache with per-entry TTL and LRU eviction. """
+
+    def __init__(self, maxsize):
+        self._data = TLRUCache(maxsize, ttu=lambda key, value, now: now + value[0])
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+        return entry[1] if entry else None
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (ttl, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def lease(self, key, ttl):
+        # One process: SingleFlight already has a single filler per key
+        return True
+
+    def release(self, key):
+        pass
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteBackend:
+    """ Cache stored in a SQLite file, shared by all workers on a machine.
+
+    Entries expire on read; once the table grows past maxsize the least
+    recently read entries are evicted. """
+
+    # Run the eviction query once every this many writes
+    EVICT_EVERY = 100
+
+    def __init__(self, path, maxsize):
+        self.path = path
+        self.maxsize = maxsize
+        self._local = threading.local()
+        self._writes = 0
+
+        with self._connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS tmdb_cache (
+                                key TEXT PRIMARY KEY,
+                                value TEXT NOT NULL,
+                                expires_at REAL NOT NULL,
+                                accessed_at REAL NOT NULL)""")
+            conn.execute("""CREATE INDEX IF NOT EXISTS ix_tmdb_cache_accessed_at
+                            ON tmdb_cache (accessed_at)""")
+            conn.execute("""CREATE TABLE IF NOT EXISTS tmdb_leases (
+                                key TEXT PRIMARY KEY,
+                                expires_at REAL NOT NULL)""")
+
+    def _connect(self):
+        """ One connection per thread and process; sqlite handles can't be shared. """
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute('SELECT value FROM tmdb_cache WHERE key = ? AND expires_at > ?',
+                           (key, now)).fetchone()
+        if row is None:
+            return None
+        conn.execute('UPDATE tmdb_cache SET accessed_at = ? WHERE key = ?', (now, key))
+        return row[0]
+
+    def set(self, key, value, ttl):
+        conn = self._connect()
+        now = time.time()
+        conn.execute('INSERT OR REPLACE INTO tmdb_cache VALUES (?, ?, ?, ?)',
+                     (key, value, now + ttl, now))
+
+        self._writes += 1
+        if self._writes % self.EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        """ Drop expired entries, then the least recently read ones over maxsize. """
+
+        conn = self._connect()
+        conn.execute('DELETE FROM tmdb_cache WHERE expires_at <= ?', (time.time(),))
+        conn.execute("""DELETE FROM tmdb_cache WHERE key IN (
+                            SELECT key FROM tmdb_cache
+                            ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)""",
+                     (self.maxsize,))
+
+    def delete(self, key):
+        self._connect().execute('DELETE FROM tmdb_cache WHERE key = ?', (key,))
+
+    def clear(self):
+        self._connect().execute('DELETE FROM tmdb_cache')
+
+    def lease(self, key, ttl):
+        """ Take the right to fill key for ttl seconds; False while another
+        process holds it. """
+
+        conn = self._connect()
+        now = time.time()
+        conn.execute('DELETE FROM tmdb_leases WHERE key = ? AND expires_at <= ?', (key, now))
+        return conn.execute('INSERT OR IGNORE INTO tmdb_leases VALUES (?, ?)',
+                            (key, now + ttl)).rowcount == 1
+
+    def release(self, key):
+        self._connect().execute('DELETE FROM tmdb_leases WHERE key = ?', (key,))
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM tmdb_cache').fetchone()[0]
+
+
+class ResponseCache:
+    """ Keyed TMDB response cache with per-endpoint TTLs and hit/miss counters. """
+
+    def __init__(self, backend, ttls=None):
+        self.backend = backend
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.hits = Counter()
+        self.misses = Counter()
+        self._lock = threading.Lock()
+
+    def get(self, endpoint, key):
+        value = self.backend.get(f'{endpoint}:{key}')
+        with self._lock:
+            if value is None:
+                self.misses[endpoint] += 1
+            else:
+                self.hits[endpoint] += 1
+
+        if value is None:
+            return None
+        return json.loads(value)
+
+    def peek(self, endpoint, key):
+        """ Like get, but without touching the hit/miss counters. """
+
+        value = self.backend.get(f'{endpoint}:{key}')
+        return json.loads(value) if value is not None else None
+
+    def set(self, endpoint, key, payload):
+        ttl = self.ttls.get(endpoint, 0)
+        if ttl > 0:
+            self.backend.set(f'{endpoint}:{key}', json.dumps(payload), ttl)
+
+    def delete(self, endpoint, key):
+        self.backend.delete(f'{endpoint}:{key}')
+
+    def lease(self, endpoint, key, ttl):
+        """ Claim the fill of a key across processes sharing the backend. """
+
+        return self.backend.lease(f'{endpoint}:{key}', ttl)
+
+    def release(self, endpoint, key):
+        self.backend.release(f'{endpoint}:{key}')
+
+    def stats(self):
+        """ Hit/miss counts per endpoint. """
+
+        return {endpoint: {'hits': self.hits[endpoint], 'misses': self.misses[endpoint]}
+                for endpoint in sorted(set(self.hits) | set(self.misses))}
+
+
+class SingleFlight:
+    """ Lets concurrent callers that miss the same key share one fetch.
+
+    The first caller of begin(key) leads: it fetches and then calls finish().
+    The others get the leader's Future, which threads wait on with result()
+    and coroutines with asyncio.wrap_future(). A payload goes to waiters as
+    JSON text, so each of them decodes its own copy, like a cache hit. """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def begin(self, key):
+        """ (future, True) for the leader, (the leader's future, False) for the rest. """
+
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight[1] += 1
+                return flight[0], False
+
+            future = Future()
+            self._flights[key] = [future, 0]
+            return future, True
+
+    def finish(self, key, future, payload=None, exc=None):
+        """ Hand the leader's payload, or the exception it raised, to the waiters. """
+
+        with self._lock:
+            flight = self._flights.pop(key, None)
+
+        if exc is not None:
+            future.set_exception(exc)
+        else:
+            # Nobody joined: skip encoding a copy
+            future.set_result(json.dumps(payload) if flight and flight[1] else None)
+
+    def __len__(self):
+        return len(self._flights)
+
+
+def make_cache():
+    """ Build the cache configured by the environment.
+
+    TMDB_CACHE_BACKEND is 'memory' (default), 'sqlite' or 'none';
+    TMDB_CACHE_TTL_<ENDPOINT> overrides a TTL, 0 disables that endpoint. """
+
+    kind = os.environ.get('TMDB_CACHE_BACKEND', 'memory')
+    maxsize = int(os.environ.get('TMDB_CACHE_MAXSIZE', 2048))
+
+    ttls = {}
+    for endpoint in DEFAULT_TTLS:
+        value = os.environ.get(f'TMDB_CACHE_TTL_{endpoint.upper()}')
+        if value is not None:
+            ttls[endpoint] = int(value)
+
+    if kind == 'none':
+        ttls = {endpoint: 0 for endpoint in DEFAULT_TTLS}
+        backend = MemoryBackend(1)
+    elif kind == 'sqlite':
+        backend = SQLiteBackend(os.environ.get('TMDB_CACHE_PATH', '/tmp/moviesbox_tmdb_cache.sqlite3'),
+                                maxsize)
+    else:
+        backend = MemoryBackend(maxsize)
+
+    return ResponseCache(backend, ttls)
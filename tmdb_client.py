@@ -0,0 +1,125 @@
+"""Pooled HTTP client for the TMDB API."""
+
+import os, threading, requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from instrumentation import timed
+
+
+# Status codes worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+class TMDBError(Exception):
+    """ Raised when TMDB can't be reached after all retries. """
+
+
+def client_settings():
+    """ Read the client settings from the environment.
+
+    Read lazily so values from .env (loaded by api_requests) are picked up. """
+
+    return {
+        'pool_size': int(os.environ.get('TMDB_POOL_SIZE', 20)),
+        'connect_timeout': float(os.environ.get('TMDB_CONNECT_TIMEOUT', 3.05)),
+        'read_timeout': float(os.environ.get('TMDB_READ_TIMEOUT', 10)),
+        'max_retries': int(os.environ.get('TMDB_MAX_RETRIES', 3)),
+        'backoff_factor': float(os.environ.get('TMDB_BACKOFF_FACTOR', 0.5)),
+    }
+
+
+def make_session(settings=None):
+    """ Build a keep-alive session with a bounded connection pool and
+    retry-with-backoff on 429/5xx responses. """
+
+    settings = settings or client_settings()
+
+    retry = Retry(
+        total=settings['max_retries'],
+        backoff_factor=settings['backoff_factor'],
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET']),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=settings['pool_size'],
+        pool_maxsize=settings['pool_size'],
+        max_retries=retry,
+    )
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept': 'application/json'})
+
+    return session
+
+
+def get_session():
+    """ Return the session of the current process.
+
+    Each gunicorn worker gets its own pool; a session inherited through fork
+    (e.g. with --preload) is discarded because its sockets are shared. """
+
+    global _session, _session_pid
+
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                _session = make_session()
+                _session_pid = pid
+
+    return _session
+
+
+def decode_json(res):
+    """ The JSON body of a 2xx response (requests or httpx); TMDBError for anything else.
+
+    A 429/5xx left after the retries, or an HTML error page from a proxy,
+    must not reach callers as a payload or a JSONDecodeError. """
+
+    if not 200 <= res.status_code < 300:
+        raise TMDBError(f'TMDB answered {res.status_code}')
+
+    try:
+        return res.json()
+    except ValueError as e:
+        raise TMDBError('TMDB answered with a body that is not JSON') from e
+
+
+def get_json(url):
+    """ GET a TMDB url through the pooled session and decode the JSON body. """
+
+    settings = client_settings()
+
+    try:
+        with timed('tmdb'):
+            res = get_session().get(url, timeout=(settings['connect_timeout'],
+                                                  settings['read_timeout']))
+    except requests.RequestException as e:
+        raise TMDBError('not connected to internet or movidb issue') from e
+
+    return decode_json(res)
+
+
+def get_image(url):
+    """ GET an image from TMDB's image server through the pooled session.
+
+    Returns the image bytes, or None if TMDB has no such image. """
+
+    settings = client_settings()
+
+    try:
+        with timed('tmdb'):
+            res = get_session().get(url, headers={'Accept': 'image/*'},
+                                    timeout=(settings['connect_timeout'], settings['read_timeout']))
+    except requests.RequestException as e:
+        raise TMDBError('not connected to internet or movidb issue') from e
+
+    return res.content if res.status_code == 200 else None